@@ -0,0 +1,182 @@
+"""
+Response cache for Gemini calls.
+
+Two tiers: a small in-process LRU for microsecond hits, backed by a SQLite
+file so every gunicorn worker on the host shares the same entries.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+AI_CACHE_PATH = os.getenv('AI_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ai_cache.sqlite3'))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', '5000'))
+AI_CACHE_MEMORY_ENTRIES = int(os.getenv('AI_CACHE_MEMORY_ENTRIES', '512'))
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'true').lower() == 'true'
+
+# Default time-to-live in seconds per AI endpoint; override with AI_CACHE_TTL_<ENDPOINT>=seconds.
+# A TTL of 0 disables caching for that endpoint.
+DEFAULT_TTLS = {
+    'attendance_summary': 60 * 60,
+    'student_summary': 6 * 60 * 60,
+    'goal': 24 * 60 * 60,
+    'prediction': 6 * 60 * 60,
+    'chat': 10 * 60,
+    'default': 60 * 60,
+}
+
+
+def ttl_for(endpoint: str) -> int:
+    """Return the configured TTL (seconds) for an endpoint"""
+    override = os.getenv(f"AI_CACHE_TTL_{endpoint.upper()}")
+    if override is not None:
+        try:
+            return max(0, int(override))
+        except ValueError:
+            pass
+    return DEFAULT_TTLS.get(endpoint, DEFAULT_TTLS['default'])
+
+
+def make_key(model: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """Build a cache key from the model, a hash of the prompt and the generation settings"""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f"{model}|{prompt_hash}|{temperature:.3f}|{max_tokens}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU + TTL cache with a shared SQLite backing store"""
+
+    def __init__(self, path: str = AI_CACHE_PATH, max_entries: int = AI_CACHE_MAX_ENTRIES,
+                 memory_entries: int = AI_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._disk_ok = True
+        try:
+            self._connection()
+        except sqlite3.Error as e:
+            print(f"[AICache] Disk store unavailable, using memory only: {e}")
+            self._disk_ok = False
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's SQLite connection, creating the table on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+                ' expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)')
+            self._local.conn = conn
+        return conn
+
+    def _count(self, endpoint: str, field: str):
+        with self._lock:
+            counters = self._stats.setdefault(endpoint, {'hits': 0, 'diskHits': 0, 'misses': 0})
+            counters[field] += 1
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str, endpoint: str = 'default') -> Optional[str]:
+        """Return a cached response or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                else:
+                    del self._memory[key]
+                    entry = None
+        if entry is not None:
+            self._count(endpoint, 'hits')
+            return entry[0]
+
+        if self._disk_ok:
+            try:
+                conn = self._connection()
+                row = conn.execute(
+                    'SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?',
+                    (key, now)
+                ).fetchone()
+                if row:
+                    conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+                    self._remember(key, row[0], row[1])
+                    self._count(endpoint, 'hits')
+                    self._count(endpoint, 'diskHits')
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"[AICache] Read error: {e}")
+
+        self._count(endpoint, 'misses')
+        return None
+
+    def set(self, key: str, value: str, ttl: int):
+        """Store a response for ttl seconds, evicting expired and least recently used entries"""
+        if ttl <= 0:
+            return
+        now = time.time()
+        expires_at = now + ttl
+        self._remember(key, value, expires_at)
+        if not self._disk_ok:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, value, expires_at, now)
+            )
+            conn.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'DELETE FROM responses WHERE key IN ('
+                ' SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        except sqlite3.Error as e:
+            print(f"[AICache] Write error: {e}")
+
+    def clear(self):
+        """Drop every cached response"""
+        with self._lock:
+            self._memory.clear()
+        if self._disk_ok:
+            try:
+                self._connection().execute('DELETE FROM responses')
+            except sqlite3.Error as e:
+                print(f"[AICache] Clear error: {e}")
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters for this process, per endpoint"""
+        with self._lock:
+            endpoints = {name: dict(c) for name, c in self._stats.items()}
+            memory_size = len(self._memory)
+        hits = sum(c['hits'] for c in endpoints.values())
+        misses = sum(c['misses'] for c in endpoints.values())
+        return {
+            "enabled": AI_CACHE_ENABLED,
+            "hits": hits,
+            "misses": misses,
+            "hitRate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "memoryEntries": memory_size,
+            "diskStore": self.path if self._disk_ok else None,
+            "endpoints": endpoints,
+        }
+
+
+response_cache = ResponseCache()
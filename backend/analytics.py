@@ -0,0 +1,153 @@
+"""
+Deterministic attendance statistics computed locally with NumPy
+"""
+from typing import Dict, List, Tuple, Any
+import numpy as np
+
+# Attendance bands used by the report UI (see AttendanceReportData in src/types.ts)
+GOOD_THRESHOLD = 75.0
+AT_RISK_THRESHOLD = 50.0
+
+
+def build_presence_matrix(student_ids: List[str], records: List[Dict]) -> Tuple[np.ndarray, List[str]]:
+    """Build a students x sessions boolean matrix, with sessions ordered by date"""
+    ordered = sorted(records, key=lambda r: r.get('date', ''))
+    row_of = {student_id: row for row, student_id in enumerate(student_ids)}
+    matrix = np.zeros((len(student_ids), len(ordered)), dtype=bool)
+
+    for col, record in enumerate(ordered):
+        rows = [row_of[sid] for sid in record.get('presentStudentIds', []) if sid in row_of]
+        if rows:
+            matrix[np.fromiter(rows, dtype=np.intp, count=len(rows)), col] = True
+
+    return matrix, [r.get('date', '') for r in ordered]
+
+
+def current_absence_streaks(matrix: np.ndarray) -> np.ndarray:
+    """Return the current run of consecutive absences (ending at the latest session) per student"""
+    if matrix.shape[1] == 0:
+        return np.zeros(matrix.shape[0], dtype=int)
+    # Reversed so argmax finds the most recent session each student attended
+    attended = matrix[:, ::-1]
+    any_present = attended.any(axis=1)
+    first_present_from_end = np.argmax(attended, axis=1)
+    return np.where(any_present, first_present_from_end, matrix.shape[1])
+
+
+def compute_course_statistics(course: Dict, students: List[Dict], records: List[Dict]) -> Dict[str, Any]:
+    """Compute every numeric field of the course summary in one vectorized pass"""
+    enrolled_ids = list(course.get('studentIds', []))
+    enrolled_set = set(enrolled_ids)
+    students_by_id = {s['id']: s for s in students if s.get('id') in enrolled_set}
+    # Keep roster order but skip ids that no longer have a student document
+    enrolled_ids = [sid for sid in enrolled_ids if sid in students_by_id]
+
+    matrix, dates = build_presence_matrix(enrolled_ids, records)
+    n_students, n_sessions = matrix.shape
+
+    if n_students and n_sessions:
+        student_pct = matrix.mean(axis=1) * 100.0
+        session_pct = matrix.mean(axis=0) * 100.0
+        overall = float(matrix.mean() * 100.0)
+    else:
+        student_pct = np.zeros(n_students)
+        session_pct = np.zeros(n_sessions)
+        overall = 0.0
+
+    perfect = student_pct >= 100.0
+    good = (student_pct >= GOOD_THRESHOLD) & ~perfect
+    at_risk = (student_pct >= AT_RISK_THRESHOLD) & (student_pct < GOOD_THRESHOLD)
+    critical = student_pct < AT_RISK_THRESHOLD
+
+    below_good = np.flatnonzero(student_pct < GOOD_THRESHOLD)
+    below_good = below_good[np.argsort(student_pct[below_good], kind='stable')]
+    at_risk_students = [
+        {
+            "name": students_by_id[enrolled_ids[i]].get('name', ''),
+            "studentId": students_by_id[enrolled_ids[i]].get('studentId', ''),
+            "attendancePercentage": round(float(student_pct[i]), 1),
+        }
+        for i in below_good
+    ]
+
+    streaks = current_absence_streaks(matrix)
+
+    return {
+        "overallAttendancePercentage": round(overall, 1),
+        "atRiskStudents": at_risk_students,
+        "attendanceDistribution": {
+            "perfect": int(perfect.sum()),
+            "good": int(good.sum()),
+            "atRisk": int(at_risk.sum()),
+            "critical": int(critical.sum()),
+        },
+        # Extra context used to build the LLM digest; not part of the response schema
+        "_digest": {
+            "courseName": course.get('name', ''),
+            "courseCode": course.get('code', ''),
+            "students": n_students,
+            "sessions": n_sessions,
+            "sessionDates": dates,
+            "sessionPercentages": [round(float(p), 1) for p in session_pct],
+            "currentAbsenceStreaks3Plus": int((streaks >= 3).sum()) if n_sessions else 0,
+        },
+    }
+
+
+def _half_average(values: List[float]) -> Tuple[float, float]:
+    """Average of the first and second half of a series"""
+    mid = len(values) // 2
+    first = values[:mid] or values
+    second = values[mid:] or values
+    return sum(first) / len(first), sum(second) / len(second)
+
+
+def build_digest(stats: Dict[str, Any]) -> str:
+    """Render a compact, prompt-friendly digest of course statistics"""
+    digest = stats['_digest']
+    dist = stats['attendanceDistribution']
+    session_pct = digest['sessionPercentages']
+    lines = [
+        f"Course: {digest['courseName']} ({digest['courseCode']})",
+        f"Students: {digest['students']}, sessions: {digest['sessions']}",
+        f"Overall attendance: {stats['overallAttendancePercentage']}%",
+        f"Distribution: perfect={dist['perfect']}, good={dist['good']}, atRisk={dist['atRisk']}, critical={dist['critical']}",
+        f"Students below 75%: {len(stats['atRiskStudents'])}",
+        f"Students currently absent 3+ sessions in a row: {digest['currentAbsenceStreaks3Plus']}",
+    ]
+    if session_pct:
+        early, late = _half_average(session_pct)
+        lowest = min(range(len(session_pct)), key=lambda i: session_pct[i])
+        recent = ', '.join(f"{d}: {p}%" for d, p in zip(digest['sessionDates'][-5:], session_pct[-5:]))
+        lines.extend([
+            f"First-half average: {early:.1f}%, second-half average: {late:.1f}%",
+            f"Lowest session: {digest['sessionDates'][lowest]} at {session_pct[lowest]}%",
+            f"Most recent sessions: {recent}",
+        ])
+    return '\n'.join(lines)
+
+
+def fallback_narrative(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Plain-text prose used when the LLM is unavailable"""
+    digest = stats['_digest']
+    trends = [
+        f"Overall attendance is {stats['overallAttendancePercentage']}% across {digest['sessions']} sessions.",
+    ]
+    if digest['sessionPercentages']:
+        early, late = _half_average(digest['sessionPercentages'])
+        direction = 'improved' if late > early else 'declined' if late < early else 'held steady'
+        trends.append(f"Attendance has {direction} from {early:.1f}% to {late:.1f}% between the first and second half of the term.")
+    if digest['currentAbsenceStreaks3Plus']:
+        trends.append(f"{digest['currentAbsenceStreaks3Plus']} student(s) have missed the last 3 or more sessions.")
+
+    at_risk = len(stats['atRiskStudents'])
+    return {
+        "notableTrends": trends,
+        "concludingRemark": f"{at_risk} of {digest['students']} students are below the 75% attendance threshold.",
+        "actionableInsight": "Reach out to students below 75% attendance." if at_risk else "Keep reinforcing current attendance habits.",
+    }
+
+
+def public_statistics(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip internal digest fields from a statistics dict"""
+    return {k: v for k, v in stats.items() if not k.startswith('_')}
@@ -7,10 +7,10 @@ import json
 import os
 from typing import Dict, Any, List
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 import database
+from gemini_client import call_gemini, gemini_model, GEMINI_MODEL
 
 load_dotenv()
 
@@ -33,65 +33,6 @@ def home():
 def health_check_root():
     return jsonify({"status": "healthy"}), 200
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
-
-if not GEMINI_API_KEY:
-    raise RuntimeError('GEMINI_API_KEY is not set. Add it to backend/.env or your environment.')
-
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel(GEMINI_MODEL)
-
-
-def call_gemini(prompt: str, temperature: float = 0.2, max_tokens: int = 1024) -> str:
-    """Call Gemini API and return the generated text"""
-    try:
-        print(f"[Gemini] Calling model {GEMINI_MODEL} with prompt length: {len(prompt)} chars")
-        
-        response = gemini_model.generate_content(
-            prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=temperature,
-                max_output_tokens=max_tokens,
-            ),
-        )
-
-        text_response = ''
-
-        # Extract text from candidates - handle empty parts list properly
-        for candidate in getattr(response, 'candidates', []) or []:
-            content = getattr(candidate, 'content', None)
-            if not content:
-                continue
-            parts = getattr(content, 'parts', []) or []
-            for part in parts:
-                part_text = getattr(part, 'text', '')
-                if part_text:
-                    text_response += part_text
-            if text_response:
-                break
-
-        # Fallback to response.text if available
-        if not text_response:
-            try:
-                text_response = response.text or ''
-            except Exception:
-                pass
-
-        if not text_response:
-            print(f"[Gemini] Empty response. Candidates: {len(getattr(response, 'candidates', []))}")
-            if hasattr(response, 'candidates') and response.candidates:
-                for i, cand in enumerate(response.candidates):
-                    print(f"[Gemini] Candidate {i} finish_reason: {getattr(cand, 'finish_reason', 'unknown')}")
-            raise Exception('Received empty response from Gemini')
-
-        print(f"[Gemini] Response received: {len(text_response)} chars")
-        return text_response.strip()
-    except Exception as e:
-        print(f"[Gemini] Error: {e}")
-        raise Exception(f"Failed to call Gemini: {str(e)}")
-
-
 @app.route('/api/chat', methods=['POST'])
 def chat_with_ai():
     """
@@ -108,7 +49,7 @@ def chat_with_ai():
         if not prompt:
             return jsonify({"error": "Missing prompt"}), 400
             
-        response_text = call_gemini(prompt, temperature=0.7, max_tokens=500)
+        response_text = call_gemini(prompt, temperature=0.7, max_tokens=500, endpoint='chat')
         return jsonify({"response": response_text.strip()})
         
     except Exception as e:
@@ -177,7 +118,7 @@ Raw Attendance Data (present student IDs per date):
 
 Return strictly the JSON object described above. No additional text."""
         
-        response_text = call_gemini(prompt, temperature=0.0, max_tokens=800)
+        response_text = call_gemini(prompt, temperature=0.0, max_tokens=800, endpoint='attendance_summary')
         
         # Try to extract JSON from response
         try:
@@ -404,7 +345,7 @@ Course-specific percentages:
 
 Keep tone positive and encouraging. Do not exceed 3 sentences."""
         
-        response_text = call_gemini(prompt, temperature=0.3, max_tokens=200)
+        response_text = call_gemini(prompt, temperature=0.3, max_tokens=200, endpoint='student_summary')
         return jsonify({"summary": response_text.strip()})
         
     except KeyError as e:
@@ -432,7 +373,7 @@ def generate_attendance_goal():
         
         prompt = f"""You are a motivational academic coach. For {student_name} in {course_name} with current attendance {current_percentage}%, suggest a realistic attendance goal for the next month and give 2-3 short actionable tips. Keep under 100 words and format using Markdown with a bulleted list for tips."""
         
-        response_text = call_gemini(prompt, temperature=0.4, max_tokens=200)
+        response_text = call_gemini(prompt, temperature=0.4, max_tokens=200, endpoint='goal')
         return jsonify({"goal": response_text.strip()})
         
     except KeyError as e:
@@ -465,7 +406,7 @@ def predict_attendance_performance():
 
 Provide a one-sentence prediction of likely end-of-semester attendance if this pattern continues, and one-sentence observation about recent performance. Keep under 75 words."""
         
-        response_text = call_gemini(prompt, temperature=0.2, max_tokens=150)
+        response_text = call_gemini(prompt, temperature=0.2, max_tokens=150, endpoint='prediction')
         return jsonify({"prediction": response_text.strip()})
         
     except KeyError as e:
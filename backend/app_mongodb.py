@@ -1,89 +1,60 @@
 """
 Flask backend with MongoDB integration and Gemini 2.5 Flash
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
-import json
+import base64
+import csv
+import hashlib
+import io
+import itertools
 import os
-from typing import Dict, Any, List
+import re
+from typing import Dict, Any, Iterator, List, Optional
 import errno
+from datetime import datetime, timedelta
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-import google.generativeai as genai
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 import database as db
+import analytics
+import forecast
+import insights
+import jobs
+import photos
+import ai_cache
+import json_provider
+import wire
+from gemini_client import call_gemini, stream_gemini, extract_json_block, gemini_client, gemini_model, GEMINI_MODEL, GeminiUnavailableError
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
+app.json = wire.NegotiatingJSONProvider(app)
+app.after_request(wire.compress_response)
+
+# Shared pool for per-course report work in bulk report runs
+REPORT_CONCURRENCY = int(os.getenv('REPORT_CONCURRENCY', '8'))
+report_executor = ThreadPoolExecutor(max_workers=REPORT_CONCURRENCY, thread_name_prefix='report')
+
+# Background runner for AI reports requested with "async": true (see the JOB ENDPOINTS section)
+job_queue = jobs.JobQueue(lambda: db.db.jobs)
 
 # Configure CORS - Allow all origins for development and mobile apps
 CORS(app, resources={
     r"/api/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"],
+        # Job polls are paced by Retry-After, which browsers hide from scripts unless exposed
+        "expose_headers": ["Retry-After"],
         "supports_credentials": False
     }
 })
 
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
-
-if not GEMINI_API_KEY:
-    raise RuntimeError('GEMINI_API_KEY is not set. Add it to backend/.env or your environment.')
-
-genai.configure(api_key=GEMINI_API_KEY)
-gemini_model = genai.GenerativeModel(GEMINI_MODEL)
-
-
-def call_gemini(prompt: str, temperature: float = 0.2, max_tokens: int = 1024) -> str:
-    """Call Gemini API and return the generated text"""
-    try:
-        print(f"[Gemini] Calling model {GEMINI_MODEL} with prompt length: {len(prompt)} chars")
-        
-        response = gemini_model.generate_content(
-            prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=temperature,
-                max_output_tokens=max_tokens,
-            ),
-        )
-
-        text_response = ''
-
-        # Extract text from candidates - handle empty parts list properly
-        for candidate in getattr(response, 'candidates', []) or []:
-            content = getattr(candidate, 'content', None)
-            if not content:
-                continue
-            parts = getattr(content, 'parts', []) or []
-            for part in parts:
-                part_text = getattr(part, 'text', '')
-                if part_text:
-                    text_response += part_text
-            if text_response:
-                break
-
-        # Fallback to response.text if available
-        if not text_response:
-            try:
-                text_response = response.text or ''
-            except Exception:
-                pass
-
-        if not text_response:
-            print(f"[Gemini] Empty response. Candidates: {len(getattr(response, 'candidates', []))}")
-            if hasattr(response, 'candidates') and response.candidates:
-                for i, cand in enumerate(response.candidates):
-                    print(f"[Gemini] Candidate {i} finish_reason: {getattr(cand, 'finish_reason', 'unknown')}")
-            raise Exception('Received empty response from Gemini')
-
-        print(f"[Gemini] Response received: {len(text_response)} chars")
-        return text_response.strip()
-    except Exception as e:
-        print(f"[Gemini] Error: {e}")
-        raise Exception(f"Failed to call Gemini: {str(e)}")
-
 
 @app.route('/', methods=['GET'])
 def index():
@@ -110,30 +81,227 @@ def health_check():
     })
 
 
+@app.route('/api/ai/cache/stats', methods=['GET'])
+def ai_cache_stats():
+    """Hit/miss counters for the Gemini response cache (this worker process)"""
+    return jsonify(ai_cache.response_cache.stats())
+
+
+@app.route('/api/cache/entities/stats', methods=['GET'])
+def entity_cache_stats():
+    """Hit/miss counters for the course and student document cache (this worker process)"""
+    return jsonify(db.entity_cache.stats())
+
+
+@app.route('/api/ai/client/stats', methods=['GET'])
+def ai_client_stats():
+    """Pool, queue-depth and coalescing metrics for the Gemini client (this worker process)"""
+    return jsonify(gemini_client.stats())
+
+
+# ============= LISTING HELPERS =============
+
+def list_query_params() -> Dict[str, Any]:
+    """Parse fields=, limit= and after= from the query string"""
+    fields = request.args.get('fields')
+    limit = request.args.get('limit', type=int)
+    return {
+        "fields": [f.strip() for f in fields.split(',') if f.strip()] if fields else None,
+        "limit": limit,
+        "after": request.args.get('after') or None,
+    }
+
+
+def is_paginated(params: Dict[str, Any]) -> bool:
+    """True when the caller asked for one page (limit= or after=) instead of everything"""
+    return params['limit'] is not None or params['after'] is not None
+
+
+def page_response(items: List[Dict], next_cursor: Optional[str]):
+    """Page envelope for paginated list requests"""
+    return jsonify({"items": items, "nextCursor": next_cursor})
+
+
+def prime(documents: Iterator[Dict]) -> Iterator[Dict]:
+    """Pull the first batch now so query errors still become a normal error response"""
+    documents = iter(documents)
+    first = next(documents, None)
+    return documents if first is None else itertools.chain([first], documents)
+
+
+def stream_list(documents: Iterator[Dict]) -> Response:
+    """Stream documents as a bare array (JSON or MessagePack) while they are read from the cursor"""
+    items = prime(documents)
+    return Response(stream_with_context(wire.iter_array(items)), mimetype=wire.response_mimetype())
+
+
+def conditional_on(*collections: str):
+    """Serve a GET with a strong ETag from the collections' version counters.
+
+    A matching If-None-Match gets a 304 after one small version lookup, before
+    the view queries or serializes anything.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                versions = db.get_versions(list(collections))
+            except Exception as e:
+                print(f"[ETag] Version lookup failed, serving uncached: {e}")
+                return view(*args, **kwargs)
+            tag = '|'.join(f"{name}={versions[name]}" for name in collections)
+            # Each format and content coding is a different representation, so it gets its own tag
+            variant = f"{wire.response_mimetype()}|{wire.choose_encoding()}"
+            etag = hashlib.sha1(f"{tag}|{variant}|{request.full_path}".encode('utf-8')).hexdigest()[:32]
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # Clients may keep the response but must revalidate it, which is a cheap 304
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
 # ============= STUDENT ENDPOINTS =============
 
 @app.route('/api/students', methods=['GET'])
+@conditional_on('students')
 def get_students():
-    """Get all students"""
+    """List students: ?fields=a,b&limit=N&after=<cursor>; photos and passwords are never in the default projection"""
     try:
-        students = db.get_all_students()
-        return jsonify(students)
+        params = list_query_params()
+        if not is_paginated(params):
+            return stream_list(db.iter_students(params['fields']))
+        students, next_cursor = db.list_students(**params)
+        return page_response(students, next_cursor)
+    except InvalidId:
+        return jsonify({"error": "Invalid cursor"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+STUDENT_IMPORT_CHUNK_SIZE = int(os.getenv('STUDENT_IMPORT_CHUNK_SIZE', '500'))
+
+
+def iter_import_rows():
+    """Yield student rows from a JSON body or a raw CSV upload, read incrementally"""
+    if request.mimetype in ('text/csv', 'application/csv'):
+        reader = csv.reader(io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline=''))
+        header = [h.strip().lower() for h in next(reader, [])]
+        missing = [h for h in ('name', 'studentid', 'branch') if h not in header]
+        if missing:
+            raise ValueError(f"CSV is missing required header(s): {', '.join(missing)}")
+        columns = {'name': 'name', 'studentid': 'studentId', 'branch': 'branch', 'email': 'email', 'password': 'password'}
+        for line_number, values in enumerate(reader, start=2):
+            if not any(v.strip() for v in values):
+                continue
+            row = {columns[h]: v.strip() for h, v in zip(header, values) if h in columns}
+            row['lineNumber'] = line_number
+            yield row
+    else:
+        for index, row in enumerate((request.json or {}).get('students', [])):
+            yield {**row, 'lineNumber': row.get('lineNumber', index + 1)}
+
+
+@app.route('/api/students/bulk', methods=['POST'])
+def bulk_create_students():
+    """Import many students at once (JSON {"students": [...]} or text/csv), reporting per-row results"""
+    try:
+        required_branch = (request.args.get('branch') or '').upper() or None
+        seen_ids = set()
+        pending: List[Dict] = []
+        result = {"successCount": 0, "errors": [], "created": []}
+
+        def flush():
+            outcome = db.bulk_create_students(pending, chunk_size=STUDENT_IMPORT_CHUNK_SIZE)
+            result['created'].extend(outcome['created'])
+            result['errors'].extend(outcome['errors'])
+            pending.clear()
+
+        for row in iter_import_rows():
+            name = str(row.get('name') or '').strip()
+            student_id = str(row.get('studentId') or '').strip()
+            branch = str(row.get('branch') or '').strip().upper()
+            error = None
+            if not name or not student_id or not branch:
+                error = "Missing name, student ID, or branch."
+            elif required_branch and branch != required_branch:
+                error = f"Branch must be '{required_branch}' for this teacher."
+            elif student_id.lower() in seen_ids:
+                error = "Student ID already exists."
+            if error:
+                result['errors'].append({"lineNumber": row['lineNumber'], "name": name, "studentId": student_id, "reason": error})
+                continue
+
+            seen_ids.add(student_id.lower())
+            row.pop('photo', None)
+            pending.append({
+                **row,
+                "name": name,
+                "studentId": student_id,
+                "branch": branch,
+                "email": row.get('email') or '',
+                "password": row.get('password') or 'pass123',
+            })
+            if len(pending) >= STUDENT_IMPORT_CHUNK_SIZE:
+                flush()
+        if pending:
+            flush()
+
+        result['successCount'] = len(result['created'])
+        result['errors'].sort(key=lambda e: e['lineNumber'] or 0)
+        return jsonify(result), 201 if result['successCount'] else 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/auth/student', methods=['POST'])
+def authenticate_student():
+    """Check student credentials on the server so passwords never have to be listed"""
+    try:
+        data = request.json
+        student = db.authenticate_student(data['email'], data['password'])
+        if student:
+            return jsonify(student)
+        return jsonify({"error": "Invalid student email or password"}), 401
+    except KeyError as e:
+        return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def create_student_record(student_data: Dict) -> Dict:
+    """Create a student, moving an uploaded photo into the photo store"""
+    photo = student_data.pop('photo', None)
+    result = db.create_student(student_data)
+    if photo:
+        photo_fields = photos.apply_photo_update(result['id'], {"photo": photo})
+        db.update_student(result['id'], photo_fields)
+        result.update(photo_fields)
+    return result
+
+
 @app.route('/api/students', methods=['POST'])
 def create_student():
     """Create a new student"""
     try:
-        student_data = request.json
-        result = db.create_student(student_data)
+        result = create_student_record(dict(request.json))
         return jsonify(result), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/students/<student_id>', methods=['GET'])
+@conditional_on('students')
 def get_student(student_id):
     """Get student by ID"""
     try:
@@ -149,11 +317,16 @@ def get_student(student_id):
 def update_student(student_id):
     """Update student"""
     try:
-        update_data = request.json
+        # Checked first so a photo is never stored (or deleted) for a student that does not exist
+        if not db.get_student_by_id(student_id):
+            return jsonify({"error": "Student not found"}), 404
+        update_data = photos.apply_photo_update(student_id, request.json)
         success = db.update_student(student_id, update_data)
         if success:
             return jsonify({"message": "Student updated successfully"})
         return jsonify({"error": "Student not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -164,20 +337,106 @@ def delete_student(student_id):
     try:
         success = db.delete_student(student_id)
         if success:
+            photos.delete_student_photo(student_id)
             return jsonify({"message": "Student deleted successfully"})
         return jsonify({"error": "Student not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/students/<student_id>/attendance-stats', methods=['GET'])
+@conditional_on('attendance_records', 'courses')
+def get_student_attendance_stats(student_id):
+    """Per-course and overall attendance for a student from the materialized counters"""
+    try:
+        return jsonify(db.get_student_attendance_stats(student_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/students/<student_id>/attendance', methods=['GET'])
+@conditional_on('attendance_records', 'courses')
+def get_student_attendance(student_id):
+    """Per-session present/absent rows: ?from=YYYY-MM-DD&to=YYYY-MM-DD&courseId=&limit=N (most recent N)"""
+    try:
+        bounds = {}
+        for param in ('from', 'to'):
+            value = request.args.get(param)
+            if value:
+                bounds[param] = db.attendance_date_value(value)
+                if bounds[param] is None:
+                    return jsonify({"error": f"{param} must be YYYY-MM-DD."}), 400
+        if db.get_student_by_id(student_id) is None:
+            return jsonify({"error": "Student not found"}), 404
+        limit = request.args.get('limit', type=int)
+        course_id = request.args.get('courseId') or None
+        sessions = db.get_student_attendance(
+            student_id, course_id, bounds.get('from'), bounds.get('to'),
+            limit=max(1, min(limit, db.MAX_PAGE_SIZE)) if limit else None,
+        )
+        return jsonify({
+            "studentId": student_id,
+            "courseId": course_id,
+            "from": request.args.get('from'),
+            "to": request.args.get('to'),
+            "total": len(sessions),
+            "present": sum(1 for session in sessions if session['present']),
+            "sessions": sessions,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/students/<student_id>/photo', methods=['GET'])
+def get_student_photo(student_id):
+    """Serve a student's photo: ?size=thumb|medium|full, cacheable by versioned URL"""
+    try:
+        size = request.args.get('size', 'full')
+        if size != 'full' and size not in photos.PHOTO_SIZES:
+            return jsonify({"error": f"Unknown size '{size}'"}), 400
+
+        found = photos.find_student_photo(student_id, size)
+        if found is None:
+            return jsonify({"error": "Photo not found"}), 404
+        version = found[2]
+
+        etag = f"{version}-{size}"
+        if request.args.get('v') == version:
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            # Unversioned URLs may change on the next upload, so revalidate with the ETag
+            cache_control = 'public, max-age=0, must-revalidate'
+        if request.if_none_match.contains(etag):
+            # Answered from the file metadata alone; no photo bytes are read
+            response = Response(status=304)
+        else:
+            photo = photos.read_student_photo(student_id, size, found)
+            if photo is None:
+                return jsonify({"error": "Photo not found"}), 404
+            data, content_type, version = photo
+            etag = f"{version}-{size}"
+            response = Response(data, mimetype=content_type)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # ============= COURSE ENDPOINTS =============
 
 @app.route('/api/courses', methods=['GET'])
+@conditional_on('courses')
 def get_courses():
-    """Get all courses"""
+    """List courses: ?fields=a,b&limit=N&after=<cursor>"""
     try:
-        courses = db.get_all_courses()
-        return jsonify(courses)
+        params = list_query_params()
+        if not is_paginated(params):
+            return stream_list(db.iter_courses(params['fields']))
+        courses, next_cursor = db.list_courses(**params)
+        return page_response(courses, next_cursor)
+    except InvalidId:
+        return jsonify({"error": "Invalid cursor"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -194,6 +453,7 @@ def create_course():
 
 
 @app.route('/api/courses/<course_id>', methods=['GET'])
+@conditional_on('courses')
 def get_course(course_id):
     """Get course by ID"""
     try:
@@ -230,18 +490,81 @@ def delete_course(course_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/courses/<course_id>/forecast', methods=['GET'])
+@conditional_on('attendance_records', 'courses', 'students')
+def get_course_forecast(course_id):
+    """End-of-term forecast for every enrolled student, most at risk first: ?threshold=75&remainingSessions=N"""
+    try:
+        threshold = request.args.get('threshold', type=float)
+        if 'threshold' in request.args and (threshold is None or not 0 <= threshold <= 100):
+            return jsonify({"error": "threshold must be a number between 0 and 100."}), 400
+        remaining = request.args.get('remainingSessions', type=int)
+        if 'remainingSessions' in request.args and (remaining is None or remaining < 0):
+            return jsonify({"error": "remainingSessions must be a non-negative integer."}), 400
+        if threshold is None:
+            threshold = forecast.FORECAST_THRESHOLD
+        loaded = db.load_course_report_data(course_ids=[course_id])
+        if not loaded['courses']:
+            return jsonify({"error": "Course not found"}), 404
+        return jsonify(forecast.forecast_course(
+            loaded['courses'][0], loaded['students'], loaded['recordsByCourse'].get(course_id, []),
+            threshold, remaining,
+        ))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # ============= ATTENDANCE ENDPOINTS =============
 
+def compact_records(records: Iterator[Dict], rosters: Dict[str, List[str]]) -> Iterator[Dict]:
+    """Replace presentStudentIds with positions in the course roster"""
+    positions = {course_id: {sid: i for i, sid in enumerate(roster)} for course_id, roster in rosters.items()}
+    for record in records:
+        if 'presentStudentIds' not in record:
+            yield record
+            continue
+        index_of = positions.get(record.get('courseId'), {})
+        present = record.pop('presentStudentIds') or []
+        record['presentIndexes'] = [index_of[sid] for sid in present if sid in index_of]
+        extra = [sid for sid in present if sid not in index_of]
+        if extra:
+            # Students no longer on the roster keep their ids
+            record['presentExtraIds'] = extra
+        yield record
+
+
+def stream_compact_attendance(records: Iterator[Dict], rosters: Dict[str, List[str]]) -> Response:
+    """Stream {"rosters": {...}, "records": [...]} with records in compact form"""
+    items = prime(compact_records(records, rosters))
+    if wire.wants_msgpack():
+        body = [wire.dumps_bytes({"rosters": rosters, "records": list(items)})]
+    else:
+        body = itertools.chain(
+            [b'{"rosters":', wire.dumps_bytes(rosters), b',"records":'],
+            wire.iter_array(items),
+            [b'}'],
+        )
+    return Response(stream_with_context(body), mimetype=wire.response_mimetype())
+
+
 @app.route('/api/attendance', methods=['GET'])
+@conditional_on('attendance_records', 'courses')
 def get_attendance_records():
-    """Get all attendance records"""
+    """List attendance records: ?courseId=&fields=a,b&limit=N&after=<cursor>&encoding=compact"""
     try:
+        params = list_query_params()
         course_id = request.args.get('courseId')
-        if course_id:
-            records = db.get_attendance_by_course(course_id)
-        else:
-            records = db.get_all_attendance_records()
-        return jsonify(records)
+        compact = request.args.get('encoding') == 'compact'
+        rosters = db.get_course_rosters([course_id] if course_id else None) if compact else None
+        if not is_paginated(params):
+            records = db.iter_attendance_records(course_id, params['fields'])
+            return stream_compact_attendance(records, rosters) if compact else stream_list(records)
+        records, next_cursor = db.list_attendance_records(course_id, **params)
+        if compact:
+            return jsonify({"items": list(compact_records(records, rosters)), "nextCursor": next_cursor, "rosters": rosters})
+        return page_response(records, next_cursor)
+    except InvalidId:
+        return jsonify({"error": "Invalid cursor"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -257,6 +580,113 @@ def create_attendance():
         return jsonify({"error": str(e)}), 500
 
 
+ATTENDANCE_BULK_CHUNK_SIZE = int(os.getenv('ATTENDANCE_BULK_CHUNK_SIZE', '1000'))
+ATTENDANCE_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def validate_session(session: Any) -> Optional[str]:
+    """Return why a bulk attendance item is unusable, or None if it is valid"""
+    if not isinstance(session, dict):
+        return "Session must be an object."
+    if not isinstance(session.get('courseId'), str) or not session['courseId']:
+        return "Missing courseId."
+    if not isinstance(session.get('date'), str) or not ATTENDANCE_DATE_PATTERN.match(session['date']):
+        return "Date must be YYYY-MM-DD."
+    present = session.get('presentStudentIds')
+    if not isinstance(present, list) or not all(isinstance(sid, str) for sid in present):
+        return "presentStudentIds must be a list of student ids."
+    return None
+
+
+@app.route('/api/attendance/bulk', methods=['POST'])
+def bulk_upsert_attendance():
+    """Create or replace many sessions at once: {"sessions": [{courseId, date, presentStudentIds}]}"""
+    try:
+        sessions = request.json['sessions']
+        if not isinstance(sessions, list):
+            return jsonify({"error": "sessions must be a list"}), 400
+
+        results: List[Optional[Dict]] = [None] * len(sessions)
+        valid: List[Dict] = []
+        positions: List[int] = []
+        for index, session in enumerate(sessions):
+            error = validate_session(session)
+            if error:
+                results[index] = {"index": index, "status": "error", "error": error}
+                continue
+            positions.append(index)
+            valid.append({
+                "courseId": session['courseId'],
+                "date": session['date'],
+                # Keep first-seen order but drop repeated ids
+                "presentStudentIds": list(dict.fromkeys(session['presentStudentIds'])),
+                **({"id": session['id']} if session.get('id') else {}),
+            })
+
+        for outcome in db.bulk_upsert_attendance(valid, chunk_size=ATTENDANCE_BULK_CHUNK_SIZE):
+            index = positions[outcome['index']]
+            results[index] = {**outcome, "index": index}
+
+        counts = {"created": 0, "updated": 0, "superseded": 0, "error": 0}
+        for result in results:
+            counts[result['status']] += 1
+        return jsonify({
+            "created": counts['created'],
+            "updated": counts['updated'],
+            "superseded": counts['superseded'],
+            "failed": counts['error'],
+            "results": results,
+        })
+    except KeyError as e:
+        return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/courses/<course_id>/attendance/<date>', methods=['PUT'])
+def save_attendance_session(course_id, date):
+    """Idempotently create or update the attendance record for one course and date"""
+    try:
+        if not ATTENDANCE_DATE_PATTERN.match(date):
+            return jsonify({"error": "Date must be YYYY-MM-DD."}), 400
+        data = request.json or {}
+        present = data.get('presentStudentIds')
+        if present is not None:
+            if not isinstance(present, list) or not all(isinstance(sid, str) for sid in present):
+                return jsonify({"error": "presentStudentIds must be a list of student ids."}), 400
+            data['presentStudentIds'] = list(dict.fromkeys(present))
+        record, created = db.upsert_attendance_session(course_id, date, data)
+        return jsonify(record), 201 if created else 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/courses/<course_id>/attendance/<date>', methods=['PATCH'])
+def patch_attendance_session(course_id, date):
+    """Mark/unmark students on one session: {"add": [ids], "remove": [ids], "timestamp": ms}"""
+    try:
+        if not ATTENDANCE_DATE_PATTERN.match(date):
+            return jsonify({"error": "Date must be YYYY-MM-DD."}), 400
+        data = request.json or {}
+        deltas = {}
+        for field in ('add', 'remove'):
+            ids = data.get(field) or []
+            if not isinstance(ids, list) or not all(isinstance(sid, str) for sid in ids):
+                return jsonify({"error": f"{field} must be a list of student ids."}), 400
+            deltas[field] = list(dict.fromkeys(ids))
+        timestamp = data.get('timestamp')
+        if timestamp is not None and (isinstance(timestamp, bool) or not isinstance(timestamp, (int, float))):
+            return jsonify({"error": "timestamp must be a number (milliseconds since the epoch)."}), 400
+        if not deltas['add'] and not deltas['remove'] and timestamp is None:
+            return jsonify({"error": "Nothing to change: send add, remove and/or timestamp."}), 400
+        if set(deltas['add']) & set(deltas['remove']):
+            return jsonify({"error": "A student cannot be in both add and remove."}), 400
+        result = db.patch_attendance_session(course_id, date, deltas['add'], deltas['remove'], timestamp)
+        return jsonify(result), 201 if result['created'] else 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/attendance/<record_id>', methods=['PUT'])
 def update_attendance(record_id):
     """Update attendance record"""
@@ -282,160 +712,498 @@ def delete_attendance(record_id):
         return jsonify({"error": str(e)}), 500
 
 
-# ============= AI-POWERED ENDPOINTS =============
+# ============= SYNC ENDPOINTS =============
 
-@app.route('/api/attendance/summary', methods=['POST'])
-def generate_attendance_summary():
-    """Generate AI-powered attendance summary for a course"""
+# Cursors are set this far behind the server clock so writes stamped just before
+# a sync but committed after it are picked up next time (clients apply upserts idempotently)
+SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '30'))
+
+
+def encode_sync_cursor(moment: datetime) -> str:
+    """Opaque cursor for a point in server time (millisecond precision, like BSON dates)"""
+    millis = int((moment - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return base64.urlsafe_b64encode(f"v1:{millis}".encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_sync_cursor(cursor: str) -> datetime:
+    """Inverse of encode_sync_cursor; raises ValueError for anything else"""
     try:
-        data = request.json
-        course = data['course']
-        all_students = data['students']
-        records = data['records']
-        
-        enrolled_students = [s for s in all_students if s['id'] in course['studentIds']]
-        course_records = [r for r in records if r['courseId'] == course['id']]
-        
-        if not course_records:
-            return jsonify({"error": "No attendance records found for this course"}), 400
-        
-        prompt = f"""You are an analytical assistant. Produce ONLY valid JSON (no explanatory text) matching this exact schema:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        version, millis = raw.split(':', 1)
+        if version != 'v1':
+            raise ValueError(version)
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis))
+    except Exception:
+        raise ValueError('Invalid sync cursor')
+
+
+@app.route('/api/sync', methods=['GET'])
+def sync_changes():
+    """Delta sync: ?since=<cursor> returns what changed in students, courses and attendance"""
+    try:
+        now = datetime.utcnow()
+        since = decode_sync_cursor(request.args['since']) if request.args.get('since') else None
+        # Tombstones expire, so cursors older than their retention get a full resync
+        full = since is None or since < db.tombstone_horizon()
+        fields = {}
+        for name in db.SYNC_COLLECTIONS:
+            requested = request.args.get(f"{name}Fields")
+            if requested:
+                fields[name] = [f.strip() for f in requested.split(',') if f.strip()]
+
+        changes = db.get_changes_since(None if full else since, fields)
+        next_cursor = now - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+        if not full:
+            next_cursor = max(next_cursor, since)
+        return jsonify({"full": full, "cursor": encode_sync_cursor(next_cursor), **changes})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+PUSH_MAX_OPERATIONS = int(os.getenv('PUSH_MAX_OPERATIONS', '1000'))
+
+
+def push_update_student(op: Dict) -> Dict:
+    if not db.get_student_by_id(op['id']):
+        raise LookupError("Student not found")
+    db.update_student(op['id'], photos.apply_photo_update(op['id'], op['data']))
+    return {"id": op['id']}
+
+
+def push_delete_student(op: Dict) -> Dict:
+    if db.delete_student(op['id']):
+        photos.delete_student_photo(op['id'])
+    # Deleting something already gone is what the device wanted anyway
+    return {"id": op['id']}
+
+
+def push_update_course(op: Dict) -> Dict:
+    if not db.update_course(op['id'], dict(op['data'])) and not db.get_course_by_id(op['id']):
+        raise LookupError("Course not found")
+    return {"id": op['id']}
+
+
+def push_patch_attendance(op: Dict) -> Dict:
+    add = list(dict.fromkeys(op.get('add') or []))
+    remove = list(dict.fromkeys(op.get('remove') or []))
+    if set(add) & set(remove):
+        raise ValueError("A student cannot be in both add and remove.")
+    timestamp = op.get('timestamp')
+    if timestamp is not None and (isinstance(timestamp, bool) or not isinstance(timestamp, (int, float))):
+        raise ValueError("timestamp must be a number (milliseconds since the epoch).")
+    return db.patch_attendance_session(op['courseId'], op['date'], add, remove, timestamp)
+
+
+# Operation type -> handler; saveAttendance is handled in batches instead
+PUSH_HANDLERS = {
+    'createStudent': lambda op: create_student_record(dict(op['data'])),
+    'updateStudent': push_update_student,
+    'deleteStudent': push_delete_student,
+    'createCourse': lambda op: db.create_course(dict(op['data'])),
+    'updateCourse': push_update_course,
+    'deleteCourse': lambda op: {"id": op['id'], "deleted": db.delete_course(op['id'])},
+    'patchAttendance': push_patch_attendance,
+    'deleteAttendance': lambda op: {"id": op['id'], "deleted": db.delete_attendance_record(op['id'])},
+}
+
+
+def apply_attendance_run(run: List[Dict]) -> List[Dict]:
+    """Apply consecutive saveAttendance operations with one bulk upsert"""
+    outcomes: List[Optional[Dict]] = [None] * len(run)
+    valid, positions = [], []
+    for index, op in enumerate(run):
+        error = validate_session(op)
+        if error:
+            outcomes[index] = {"status": "failed", "code": 400, "error": error}
+            continue
+        positions.append(index)
+        valid.append({
+            "courseId": op['courseId'],
+            "date": op['date'],
+            "presentStudentIds": list(dict.fromkeys(op['presentStudentIds'])),
+        })
+    for result in db.bulk_upsert_attendance(valid, chunk_size=ATTENDANCE_BULK_CHUNK_SIZE):
+        index = positions[result.pop('index')]
+        if result['status'] == 'error':
+            outcomes[index] = {"status": "failed", "code": 409, "error": result['error']}
+        else:
+            outcomes[index] = {"status": "applied", "result": result}
+    return outcomes
+
+
+def apply_operation(op: Dict) -> Dict:
+    """Run one queued operation, turning client mistakes into a stored failure"""
+    handler = PUSH_HANDLERS.get(op.get('type'))
+    if handler is None:
+        return {"status": "failed", "code": 400, "error": f"Unknown operation type: {op.get('type')}"}
+    try:
+        return {"status": "applied", "result": handler(op)}
+    except KeyError as e:
+        return {"status": "failed", "code": 400, "error": f"Missing required field: {str(e)}"}
+    except DuplicateKeyError:
+        return {"status": "failed", "code": 409, "error": "Document already exists"}
+    except (ValueError, LookupError) as e:
+        return {"status": "failed", "code": 404 if isinstance(e, LookupError) else 400, "error": str(e)}
+
+
+@app.route('/api/sync/push', methods=['POST'])
+def push_operations():
+    """Apply a device's offline write queue in order: {"operations": [{key, type, ...}]}"""
+    try:
+        operations = request.json['operations']
+        if not isinstance(operations, list):
+            return jsonify({"error": "operations must be a list"}), 400
+        if len(operations) > PUSH_MAX_OPERATIONS:
+            return jsonify({"error": f"At most {PUSH_MAX_OPERATIONS} operations per push"}), 413
+
+        results: List[Optional[Dict]] = [None] * len(operations)
+        first_index: Dict[str, int] = {}
+        for index, op in enumerate(operations):
+            key = op.get('key') if isinstance(op, dict) else None
+            if not isinstance(key, str) or not key:
+                results[index] = {"index": index, "status": "failed", "code": 400, "error": "Missing idempotency key"}
+            elif key not in first_index:
+                first_index[key] = index
+
+        # One round trip claims every key; keys seen before come back with their stored outcome
+        seen = db.claim_idempotency_keys(list(first_index))
+        for key, entry in seen.items():
+            index = first_index[key]
+            if entry.get('status') == 'done':
+                results[index] = {**entry['outcome'], "index": index, "key": key, "replayed": True}
+            else:
+                results[index] = {"index": index, "key": key, "status": "inProgress"}
+
+        pending = [i for i in sorted(first_index.values()) if results[i] is None]
+        outcomes: Dict[str, Dict] = {}
+        try:
+            position = 0
+            while position < len(pending):
+                index = pending[position]
+                if operations[index].get('type') == 'saveAttendance':
+                    run_end = position
+                    while run_end < len(pending) and operations[pending[run_end]].get('type') == 'saveAttendance':
+                        run_end += 1
+                    run = pending[position:run_end]
+                    for run_index, outcome in zip(run, apply_attendance_run([operations[i] for i in run])):
+                        outcomes[operations[run_index]['key']] = outcome
+                    position = run_end
+                else:
+                    outcomes[operations[index]['key']] = apply_operation(operations[index])
+                    position += 1
+        finally:
+            db.complete_idempotency_keys(outcomes)
+            db.release_idempotency_keys([operations[i]['key'] for i in pending if operations[i]['key'] not in outcomes])
+
+        for key, outcome in outcomes.items():
+            results[first_index[key]] = {**outcome, "index": first_index[key], "key": key}
+        # Repeats of a key inside the same push get the first occurrence's outcome
+        for index, op in enumerate(operations):
+            if results[index] is None:
+                first = results[first_index[op['key']]]
+                results[index] = {**first, "index": index, "replayed": True}
+
+        return jsonify({
+            "applied": sum(1 for r in results if r['status'] == 'applied' and not r.get('replayed')),
+            "failed": sum(1 for r in results if r['status'] == 'failed'),
+            "results": results,
+        })
+    except KeyError as e:
+        return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ============= AI-POWERED ENDPOINTS =============
+
+def build_course_report(course: Dict, students: List[Dict], records: List[Dict]) -> Dict[str, Any]:
+    """Compute course statistics locally and let Gemini write only the prose fields"""
+    stats = analytics.compute_course_statistics(course, students, records)
+    report = analytics.public_statistics(stats)
+
+    prompt = f"""You are an analytical assistant. The statistics below were computed exactly; do not recalculate them.
+Produce ONLY valid JSON (no explanatory text) matching this exact schema:
 {{
-  "overallAttendancePercentage": number,
-  "atRiskStudents": [{{"name": string, "studentId": string, "attendancePercentage": number}}],
   "notableTrends": [string],
   "concludingRemark": string,
-  "attendanceDistribution": {{"perfect": number, "good": number, "atRisk": number, "critical": number}},
   "actionableInsight": string
 }}
 
-Now analyze the course: "{course['name']} ({course['code']})".
-Enrolled students: {len(enrolled_students)}.
-Sessions recorded: {len(course_records)}.
+{analytics.build_digest(stats)}
 
-Enrolled Students List:
-{chr(10).join([f"- {s['name']} ({s['studentId']})" for s in enrolled_students])}
+Return strictly the JSON object described above. No additional text."""
 
-Raw Attendance Data (present student IDs per date):
-{chr(10).join([f"Date: {r['date']}, Present IDs: [{', '.join(r['presentStudentIds'])}]" for r in course_records])}
+    try:
+        narrative = extract_json_block(call_gemini(prompt, temperature=0.0, max_tokens=300, endpoint='attendance_summary'))
+        report.update({
+            "notableTrends": list(narrative.get('notableTrends') or []),
+            "concludingRemark": str(narrative.get('concludingRemark') or ''),
+            "actionableInsight": str(narrative.get('actionableInsight') or ''),
+        })
+        report['aiStatus'] = 'ok'
+    except Exception as e:
+        # The numbers are already correct; serve them with locally written prose
+        print(f"[Summary] Falling back to local narrative: {e}")
+        report.update(analytics.fallback_narrative(stats))
+        report['aiStatus'] = 'unavailable'
 
-Return strictly the JSON object described above. No additional text."""
-        
-        response_text = call_gemini(prompt, temperature=0.0, max_tokens=800)
-        
-        try:
-            if '```json' in response_text:
-                json_str = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                json_str = response_text.split('```')[1].split('```')[0].strip()
-            else:
-                json_str = response_text.strip()
-            
-            result = json.loads(json_str)
-            return jsonify(result)
-        except json.JSONDecodeError as e:
-            print(f"Failed to parse JSON: {response_text}")
-            return jsonify({
-                "error": "Failed to parse AI response",
-                "details": str(e),
-                "raw_response": response_text
-            }), 500
+    return report
+
+
+def build_course_report_for(course_id: str) -> Dict[str, Any]:
+    """Load a course with its students and records, then build its report"""
+    loaded = db.load_course_report_data(course_ids=[course_id])
+    if not loaded['courses']:
+        raise LookupError("Course not found")
+    course_records = loaded['recordsByCourse'].get(course_id, [])
+    if not course_records:
+        raise ValueError("No attendance records found for this course")
+    return build_course_report(loaded['courses'][0], loaded['students'], course_records)
+
+
+@app.route('/api/attendance/summary', methods=['POST'])
+def generate_attendance_summary():
+    """Generate attendance summary for a course: local statistics plus AI-written insights.
+
+    With {"async": true} the report is queued as a job and 202 with the job id is returned.
+    """
+    try:
+        data = request.json
+        if data.get('async'):
+            course_id = data.get('courseId') or data['course']['id']
+            return enqueue_job_response('attendance_summary', {"courseId": course_id})
+        if 'records' in data:
+            # Legacy payload: the client posts the course with every student and record
+            course = data['course']
+            all_students = data['students']
+            course_records = [r for r in data['records'] if r['courseId'] == course['id']]
+            if not course_records:
+                return jsonify({"error": "No attendance records found for this course"}), 400
+            return jsonify(build_course_report(course, all_students, course_records))
+
+        return jsonify(build_course_report_for(data.get('courseId') or data['course']['id']))
             
     except KeyError as e:
         return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def course_report_line(course: Dict, students: List[Dict], records: List[Dict]) -> Dict[str, Any]:
+    """Build one NDJSON entry of a bulk report run"""
+    line = {"courseId": course['id'], "courseName": course.get('name', ''), "code": course.get('code', '')}
+    if not records:
+        return {**line, "status": "empty", "error": "No attendance records found for this course"}
+    try:
+        return {**line, "status": "ok", "report": build_course_report(course, students, records)}
+    except Exception as e:
+        return {**line, "status": "error", "error": str(e)}
+
+
+@app.route('/api/reports/courses', methods=['POST'])
+def generate_course_reports():
+    """Generate summaries for many courses concurrently and stream each one as NDJSON when ready"""
+    try:
+        data = request.json or {}
+        course_ids = data.get('courseIds')
+        branch = data.get('branch')
+        if not course_ids and not branch:
+            return jsonify({"error": "Missing required field: 'courseIds' or 'branch'"}), 400
+
+        loaded = db.load_course_report_data(course_ids=course_ids, branch=branch)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    courses = loaded['courses']
+    students = loaded['students']
+    records_by_course = loaded['recordsByCourse']
+
+    def generate():
+        futures = [
+            report_executor.submit(course_report_line, course, students, records_by_course.get(course['id'], []))
+            for course in courses
+        ]
+        try:
+            for future in as_completed(futures):
+                yield json_provider.dumps_bytes(future.result()) + b'\n'
+            yield json_provider.dumps_bytes({"done": True, "courses": len(courses)}) + b'\n'
+        finally:
+            # Client went away or the run finished; drop anything not yet started
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def build_student_summary(student_id: str, student_name: Optional[str] = None) -> Dict[str, Any]:
+    """Aggregate a student's attendance in MongoDB and ask Gemini for a short summary"""
+    if not student_name:
+        student = db.get_student_by_id(student_id)
+        if not student:
+            raise LookupError("Student not found")
+        student_name = student.get('name', 'the student')
+
+    stats = db.get_student_attendance_stats(student_id)
+    stored = insights.fresh_insights(student_id)
+    if stored and stored.get('summary'):
+        # Pregenerated by the insights scheduler and still matching the attendance counts
+        return {**stats, "summary": stored['summary'], "generatedAt": stored['generatedAt']}
+
+    prompt = f"""You are an encouraging academic advisor. Write a short (2-3 sentence) supportive summary for {student_name}.
+Overall Attendance: {stats['overallPercentage']}%
+Total Classes Attended: {stats['presentClasses']} out of {stats['totalClasses']}
+Course-specific percentages:
+{chr(10).join([f"- {c['name']}: {c['percentage']}%" for c in stats['courses']])}
+
+Keep tone positive and encouraging. Do not exceed 3 sentences."""
+
+    response_text = call_gemini(prompt, temperature=0.3, max_tokens=500, endpoint='student_summary')
+    return {**stats, "summary": response_text.strip()}
+
+
 @app.route('/api/student/summary', methods=['POST'])
 def generate_student_summary():
-    """Generate AI-powered summary for a student"""
+    """Generate AI-powered summary for a student from server-side attendance stats.
+
+    With {"async": true} the summary is queued as a job and 202 with the job id is returned.
+    """
     try:
         data = request.json
-        student = data['student']
-        courses = data['courses']
-        records = data['records']
-        
-        student_courses = [c for c in courses if student['id'] in c['studentIds']]
-        
-        total_classes = 0
-        present_classes = 0
-        course_details = []
-        
-        for course in student_courses:
-            course_records = [r for r in records if r['courseId'] == course['id']]
-            course_total = len(course_records)
-            
-            if course_total == 0:
-                course_details.append({"name": course['name'], "percentage": 100})
-                continue
-            
-            course_present = len([r for r in course_records if student['id'] in r['presentStudentIds']])
-            total_classes += course_total
-            present_classes += course_present
-            
-            course_details.append({
-                "name": course['name'],
-                "percentage": round((course_present / course_total) * 100)
-            })
-        
-        overall_percentage = 100 if total_classes == 0 else round((present_classes / total_classes) * 100)
-        
-        prompt = f"""You are an encouraging academic advisor. Write a short (2-3 sentence) supportive summary for {student['name']}.
-Overall Attendance: {overall_percentage}%
-Total Classes Attended: {present_classes} out of {total_classes}
-Course-specific percentages:
-{chr(10).join([f"- {c['name']}: {c['percentage']}%" for c in course_details])}
+        # Older clients post the whole student object alongside every course and record;
+        # only the id (and optionally the name) is used now.
+        student = data.get('student') or {}
+        student_id = data.get('studentId') or student['id']
+        student_name = data.get('studentName') or student.get('name')
+
+        if data.get('async'):
+            return enqueue_job_response('student_summary', {"studentId": student_id, "studentName": student_name})
+        return jsonify(build_student_summary(student_id, student_name))
 
-Keep tone positive and encouraging. Do not exceed 3 sentences."""
-        
-        response_text = call_gemini(prompt, temperature=0.3, max_tokens=500)
-        return jsonify({"summary": response_text.strip()})
-        
     except KeyError as e:
         return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except GeminiUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/students/<student_id>/summary', methods=['GET'])
+def get_student_summary(student_id):
+    """Generate AI-powered summary for a student by ID"""
+    try:
+        return jsonify(build_student_summary(student_id))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except GeminiUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/student/goal', methods=['POST'])
 def generate_attendance_goal():
-    """Generate attendance goal for a student"""
+    """Generate attendance goal for a student.
+
+    With studentId and courseId, a pregenerated goal is served while attendance is unchanged.
+    """
     try:
         data = request.json
+        if data.get('studentId') and data.get('courseId'):
+            stored = insights.fresh_insights(data['studentId']) or {}
+            goal = next((c['goal'] for c in stored.get('courses', []) if c['courseId'] == data['courseId'] and c.get('goal')), None)
+            if goal:
+                return jsonify({"goal": goal, "generatedAt": stored['generatedAt']})
         student_name = data['studentName']
         course_name = data['courseName']
         current_percentage = data['currentPercentage']
         
         prompt = f"""You are a motivational academic coach. For {student_name} in {course_name} with current attendance {current_percentage}%, suggest a realistic attendance goal for the next month and give 2-3 short actionable tips. Keep under 100 words and format using Markdown with a bulleted list for tips."""
         
-        response_text = call_gemini(prompt, temperature=0.4, max_tokens=500)
+        response_text = call_gemini(prompt, temperature=0.4, max_tokens=500, endpoint='goal')
         return jsonify({"goal": response_text.strip()})
         
     except KeyError as e:
         return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except GeminiUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+# Gemini only rewords the forecast when asked to
+PREDICTION_NARRATE = os.getenv('PREDICTION_NARRATE', 'false').lower() == 'true'
+
+
+def narrate_forecast(student_name: str, course_name: str, result: Dict[str, Any]) -> Dict[str, str]:
+    """Have Gemini word a computed forecast, falling back to the local sentences"""
+    low, high = result['confidenceBand']
+    prompt = f"""You are an analytical academic advisor. The forecast below was computed exactly; do not change any number.
+Student: {student_name}
+Course: {course_name}
+Sessions so far: {result['sessions']} ({result['present']} attended, {result['currentPercentage']}%)
+Recent attendance rate: {result['recentRate']}% ({result['trend']})
+Projected end-of-term attendance: {result['projectedPercentage']}% (likely {low}% to {high}%)
+Sessions remaining: {result['remainingSessions']}; absences still allowed to stay at {result['threshold']}%: {result['absencesAllowed']}
+
+In at most two sentences (under 75 words), state the projected end-of-term attendance and one observation about recent performance."""
+    try:
+        return {"prediction": call_gemini(prompt, temperature=0.2, max_tokens=300, endpoint='prediction').strip(), "aiStatus": "ok"}
+    except Exception as e:
+        print(f"[Prediction] Falling back to local wording: {e}")
+        return {"prediction": forecast.describe(result, course_name), "aiStatus": "unavailable"}
+
+
 @app.route('/api/student/prediction', methods=['POST'])
 def predict_attendance_performance():
-    """Predict student attendance performance"""
+    """Forecast a student's end-of-term attendance in a course.
+
+    Send {studentId, courseId}; the sessions are read on the server. Older clients
+    may still send studentName, courseName and recentRecords themselves. The
+    numbers are computed locally (see forecast.py); with {"narrate": true}
+    Gemini rewords them. Optional: threshold, remainingSessions.
+    """
     try:
         data = request.json
-        student_name = data['studentName']
-        course_name = data['courseName']
-        recent_records = data['recentRecords']
-        
-        attendance_string = '\n'.join([f"- {r['date']}: {'Present' if r['isPresent'] else 'Absent'}" for r in recent_records])
-        
-        prompt = f"""You are an analytical academic advisor. For {student_name} in {course_name}, here is recent attendance:
-{attendance_string}
-
-Provide a one-sentence prediction of likely end-of-semester attendance if this pattern continues, and one-sentence observation about recent performance. Keep under 75 words."""
-        
-        response_text = call_gemini(prompt, temperature=0.2, max_tokens=500)
-        return jsonify({"prediction": response_text.strip()})
+        threshold = data.get('threshold')
+        if threshold is None:
+            threshold = forecast.FORECAST_THRESHOLD
+        elif isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold <= 100:
+            return jsonify({"error": "threshold must be a number between 0 and 100."}), 400
+        remaining = data.get('remainingSessions')
+        if remaining is not None and (isinstance(remaining, bool) or not isinstance(remaining, int) or remaining < 0):
+            return jsonify({"error": "remainingSessions must be a non-negative integer."}), 400
+        if 'recentRecords' in data:
+            student_name = data['studentName']
+            course_name = data['courseName']
+            presence = [bool(r['isPresent']) for r in sorted(data['recentRecords'], key=lambda r: r['date'])]
+            course = {}
+        else:
+            student_id = data['studentId']
+            course_id = data['courseId']
+            course = db.get_course_by_id(course_id) or {}
+            student_name = data.get('studentName') or (db.get_student_by_id(student_id) or {}).get('name', 'the student')
+            course_name = data.get('courseName') or course.get('name', 'this course')
+            presence = [session['present'] for session in db.get_student_attendance(student_id, course_id)]
+        if len(presence) < forecast.PREDICTION_MIN_SESSIONS:
+            return jsonify({"prediction": None, "insufficientData": True, "sessions": len(presence)})
+
+        if remaining is None:
+            remaining = forecast.remaining_sessions(course, len(presence))
+        result = forecast.forecast_student(presence, remaining, threshold)
+
+        if data.get('narrate', PREDICTION_NARRATE):
+            wording = narrate_forecast(student_name, course_name, result)
+        else:
+            wording = {"prediction": forecast.describe(result, course_name), "aiStatus": "skipped"}
+        return jsonify({**wording, "forecast": result})
         
     except KeyError as e:
         return jsonify({"error": f"Missing required field: {str(e)}"}), 400
@@ -443,18 +1211,127 @@ Provide a one-sentence prediction of likely end-of-semester attendance if this p
         return jsonify({"error": str(e)}), 500
 
 
+def sse_event(payload: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format one Server-Sent Events message"""
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json_provider.dumps_bytes(payload).decode('utf-8')}\n\n"
+
+
+def wants_event_stream(data: Dict) -> bool:
+    """Streaming is opt-in so older clients keep receiving a single JSON response"""
+    return (
+        bool(data.get('stream'))
+        or request.args.get('stream') in ('1', 'true')
+        or 'text/event-stream' in request.headers.get('Accept', '')
+    )
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """Chatbot endpoint for general queries"""
+    """Chatbot endpoint for general queries, optionally streamed as Server-Sent Events"""
     try:
         data = request.json
         prompt = data['prompt']
-        
-        response_text = call_gemini(prompt, temperature=0.7, max_tokens=300)
+
+        if wants_event_stream(data):
+            def generate():
+                chunks = []
+                try:
+                    for text in stream_gemini(prompt, temperature=0.7, max_tokens=300, endpoint='chat'):
+                        chunks.append(text)
+                        yield sse_event({"text": text})
+                    yield sse_event({"response": ''.join(chunks).strip()}, event='done')
+                except GeminiUnavailableError as e:
+                    yield sse_event({"error": str(e), "status": 503}, event='error')
+                except Exception as e:
+                    print(f"[Chat] Stream error: {e}")
+                    yield sse_event({"error": str(e), "status": 500}, event='error')
+
+            # Closing this generator on client disconnect also closes the upstream Gemini stream
+            return Response(generate(), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+            })
+
+        response_text = call_gemini(prompt, temperature=0.7, max_tokens=300, endpoint='chat')
         return jsonify({"response": response_text.strip()})
         
     except KeyError as e:
         return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except GeminiUnavailableError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/students/<student_id>/insights', methods=['GET'])
+def get_student_insights(student_id):
+    """Pregenerated summary, goals and predictions; "stale" is true when attendance changed since"""
+    try:
+        stored = insights.get_insights(student_id)
+        if stored is None:
+            if db.get_student_by_id(student_id) is None:
+                return jsonify({"error": "Student not found"}), 404
+            return jsonify({"studentId": student_id, "available": False})
+        return jsonify({**stored, "available": True})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/students/<student_id>/insights/refresh', methods=['POST'])
+def refresh_student_insights(student_id):
+    """Queue regeneration of a student's insights (skipped while unchanged unless {"force": true})"""
+    try:
+        data = request.get_json(silent=True) or {}
+        return enqueue_job_response('student_insights', {"studentId": student_id, "force": bool(data.get('force'))})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ============= JOB ENDPOINTS =============
+
+job_queue.register('attendance_summary', lambda params: build_course_report_for(params['courseId']))
+job_queue.register('student_summary', lambda params: build_student_summary(params['studentId'], params.get('studentName')))
+job_queue.register('student_insights', lambda params: insights.refresh_student(params['studentId'], bool(params.get('force'))))
+
+
+def enqueue_job_response(job_type: str, params: Dict) -> Response:
+    """Queue a job and answer 202 with where to poll for it"""
+    job = job_queue.enqueue(job_type, params)
+    response = jsonify({"jobId": job['id'], "status": job['status'], "statusUrl": f"/api/jobs/{job['id']}"})
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a report job: {"type": "attendance_summary" | "student_summary", "params": {...}}"""
+    try:
+        data = request.json
+        job_type = data['type']
+        if job_type not in job_queue.job_types:
+            return jsonify({"error": f"Unknown job type: {job_type}", "types": job_queue.job_types}), 400
+        return enqueue_job_response(job_type, data.get('params') or {})
+    except KeyError as e:
+        return jsonify({"error": f"Missing required field: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status and result; ?wait=N holds the request up to N seconds until the job finishes"""
+    try:
+        wait = request.args.get('wait', type=float)
+        job = job_queue.wait(job_id, wait) if wait else job_queue.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found or expired"}), 404
+        response = jsonify(job)
+        if job['status'] in jobs.PENDING_STATUSES:
+            response.headers['Retry-After'] = '1'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -500,6 +1377,8 @@ try:
     db_connected = db.init_db()
     if db_connected:
         print("✓ Connected to MongoDB")
+        if insights.INSIGHTS_SCHEDULER_ENABLED:
+            insights.scheduler.start()
     else:
         print("⚠ Warning: MongoDB connection failed")
 except Exception as e:
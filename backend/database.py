@@ -1,14 +1,21 @@
 """
 MongoDB database connection and operations
 """
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure
 from bson import ObjectId
+from bson.binary import Binary
 import os
-from typing import Dict, List, Optional
-from datetime import datetime
+import re
+import uuid
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from entity_cache import EntityCache
+import migrations
+
 # Load environment variables
 load_dotenv()
 
@@ -16,6 +23,35 @@ load_dotenv()
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
 MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'iiit_attendance')
 
+# Apply pending schema/index migrations (migrations.py) when connecting
+MIGRATE_ON_START = os.getenv('MIGRATE_ON_START', 'true').lower() == 'true'
+
+# How attendance presence is written: 'ids' (presentStudentIds arrays) or 'bitset'
+# (presenceBits bitmaps over the course roster). Both formats are always readable;
+# run `python manage.py migrate-attendance-format --to <format>` after switching.
+ATTENDANCE_STORAGE = os.getenv('ATTENDANCE_STORAGE', 'ids')
+# Attempts at a compare-and-swap presence patch before giving up
+ATTENDANCE_PATCH_RETRIES = int(os.getenv('ATTENDANCE_PATCH_RETRIES', '5'))
+
+# A bulk upload writing more sessions than this to one course rebuilds that course's
+# attendance_stats from its records instead of applying the sessions one by one
+ATTENDANCE_STATS_REBUILD_AFTER = int(os.getenv('ATTENDANCE_STATS_REBUILD_AFTER', '25'))
+
+# Deleted-document markers are kept this long; older sync cursors get a full resync
+SYNC_TOMBSTONE_DAYS = int(os.getenv('SYNC_TOMBSTONE_DAYS', '30'))
+
+# Idempotency keys from offline push queues are remembered this long
+IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', '72'))
+# A claim still pending after this long is assumed abandoned (e.g. the worker died) and can be retaken
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv('IDEMPOTENCY_PENDING_SECONDS', '120'))
+
+# Sync names -> collections covered by GET /api/sync
+SYNC_COLLECTIONS = {
+    'students': 'students',
+    'courses': 'courses',
+    'attendance': 'attendance_records',
+}
+
 # Global database connection
 client = None
 db = None
@@ -33,8 +69,26 @@ def init_db():
         # Create indexes for better performance
         db.students.create_index("studentId", unique=True)
         db.courses.create_index("code", unique=True)
-        db.attendance_records.create_index([("courseId", 1), ("date", 1)])
+        db.courses.create_index("studentIds")
+        ensure_attendance_key_index()
+        for collection in SYNC_COLLECTIONS.values():
+            db[collection].create_index("updatedAt")
+        db.tombstones.create_index([("deletedAt", 1)], expireAfterSeconds=SYNC_TOMBSTONE_DAYS * 24 * 3600)
+        db.tombstones.create_index([("collection", 1), ("deletedAt", 1)])
+        db.idempotency_keys.create_index([("createdAt", 1)], expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+        db.attendance_stats.create_index([("studentId", 1), ("courseId", 1)], unique=True)
+        db.attendance_stats.create_index("courseId")
         db.users.create_index("username", unique=True)
+        # Finished jobs are removed once expiresAt passes (see jobs.JOB_TTL_SECONDS)
+        db.jobs.create_index([("expiresAt", 1)], expireAfterSeconds=0)
+        db.jobs.create_index([("key", 1), ("status", 1)])
+
+        if MIGRATE_ON_START:
+            migrations.run_migrations(db, on_change=bump_version)
+        else:
+            pending = migrations.pending_migrations(db)
+            if pending:
+                print(f"⚠ Warning: {len(pending)} schema migration(s) pending. Run: python manage.py migrate")
         
         print(f"✓ Connected to MongoDB at {MONGODB_URI}")
         print(f"✓ Using database: {MONGODB_DB_NAME}")
@@ -45,6 +99,57 @@ def init_db():
         return False
 
 
+ATTENDANCE_KEY_INDEX = "courseId_1_date_1"
+
+
+def find_duplicate_attendance() -> List[Dict]:
+    """Return (courseId, date) groups that have more than one attendance record"""
+    return list(db.attendance_records.aggregate([
+        {"$group": {
+            "_id": {"courseId": "$courseId", "date": "$date"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True))
+
+
+def ensure_attendance_key_index() -> bool:
+    """Make (courseId, date) unique, replacing the old non-unique index.
+
+    Returns False (and keeps the old index) while duplicate sessions exist;
+    run ``python manage.py dedupe-attendance`` to merge them.
+    """
+    existing = db.attendance_records.index_information().get(ATTENDANCE_KEY_INDEX)
+    if existing and existing.get('unique'):
+        return True
+    duplicates = find_duplicate_attendance()
+    if duplicates:
+        print(f"⚠ Warning: {len(duplicates)} course/date pair(s) have duplicate attendance records; "
+              f"(courseId, date) is not unique yet. Run: python manage.py dedupe-attendance")
+        if not existing:
+            db.attendance_records.create_index([("courseId", 1), ("date", 1)], name=ATTENDANCE_KEY_INDEX)
+        return False
+    try:
+        if existing:
+            db.attendance_records.drop_index(ATTENDANCE_KEY_INDEX)
+        db.attendance_records.create_index([("courseId", 1), ("date", 1)], name=ATTENDANCE_KEY_INDEX, unique=True)
+    except OperationFailure as e:
+        # Another worker starting at the same time dropped or rebuilt the index first
+        current = db.attendance_records.index_information().get(ATTENDANCE_KEY_INDEX)
+        if current and current.get('unique'):
+            return True
+        if current:
+            print(f"⚠ Warning: Could not make (courseId, date) unique yet: {e}")
+            return False
+        try:
+            db.attendance_records.create_index([("courseId", 1), ("date", 1)], name=ATTENDANCE_KEY_INDEX, unique=True)
+        except OperationFailure as retry_error:
+            print(f"⚠ Warning: Could not make (courseId, date) unique yet: {retry_error}")
+            return False
+    return True
+
+
 def get_db():
     """Get database instance"""
     if db is None:
@@ -52,46 +157,316 @@ def get_db():
     return db
 
 
+# ============= LISTING HELPERS =============
+
+# Fields left out of list responses unless explicitly requested with fields=
+LIST_EXCLUDED_FIELDS = {
+    'students': ('photo', 'password'),
+    'courses': (),
+    # Server-side copy of date for range queries; clients use the YYYY-MM-DD string
+    'attendance_records': ('dateValue',),
+}
+
+# Stored presence fields of an attendance record, in either format
+PRESENCE_FIELDS = ('presentStudentIds', 'presenceBits', 'rosterVersion')
+
+# What the attendance_stats maintenance needs from a record before it changes
+ATTENDANCE_STATS_PROJECTION = {"_id": 1, "id": 1, "courseId": 1, "date": 1, **{f: 1 for f in PRESENCE_FIELDS}}
+
+# Fields that must be fetched along with a requested field to rebuild it
+PROJECTION_COMPANIONS = {
+    'attendance_records': {'presentStudentIds': ('presenceBits', 'rosterVersion', 'courseId')},
+}
+
+# Fields that list responses never include, even when requested
+NEVER_LISTED_FIELDS = {
+    'students': ('password',),
+}
+
+MAX_PAGE_SIZE = 500
+
+# Documents fetched per round trip when streaming a whole collection
+LIST_BATCH_SIZE = int(os.getenv('LIST_BATCH_SIZE', '500'))
+
+
+def _list_projection(collection: str, fields: Optional[List[str]] = None) -> Optional[Dict]:
+    """Build the projection for a list query"""
+    if fields:
+        hidden = NEVER_LISTED_FIELDS.get(collection, ())
+        projection = {field: 1 for field in fields if field and field not in hidden and field != '_id'}
+        # The app-level id is always needed by clients to address documents
+        projection['id'] = 1
+        for field, companions in PROJECTION_COMPANIONS.get(collection, {}).items():
+            if field in projection:
+                projection.update({companion: 1 for companion in companions})
+        return projection
+    excluded = LIST_EXCLUDED_FIELDS.get(collection, ())
+    return {field: 0 for field in excluded} or None
+
+
+def list_documents(collection: str, query: Optional[Dict] = None, fields: Optional[List[str]] = None,
+                   limit: Optional[int] = None, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """List documents with field projection and keyset pagination on _id.
+
+    Returns the page and the cursor for the next page (None on the last page).
+    """
+    query = dict(query or {})
+    if after:
+        query['_id'] = {"$gt": ObjectId(after)}
+
+    cursor = db[collection].find(query, _list_projection(collection, fields)).sort('_id', 1)
+    if limit:
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        cursor = cursor.limit(limit + 1)
+
+    documents = list(cursor)
+    next_cursor = None
+    if limit and len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = str(documents[-1]['_id'])
+
+    for document in documents:
+        _normalize_listed(document)
+    return documents, next_cursor
+
+
+def _normalize_listed(document: Dict) -> Dict:
+    """Stringify _id and rebuild presentStudentIds from a presence bitmap"""
+    document['_id'] = str(document['_id'])
+    if 'presenceBits' in document:
+        normalize_presence(document)
+    return document
+
+
+def iter_documents(collection: str, query: Optional[Dict] = None,
+                   fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Yield every matching document straight from the cursor, LIST_BATCH_SIZE at a time"""
+    cursor = db[collection].find(query or {}, _list_projection(collection, fields)).sort('_id', 1)
+    for document in cursor.batch_size(LIST_BATCH_SIZE):
+        yield _normalize_listed(document)
+
+
+# ============= COLLECTION VERSIONS =============
+
+def bump_version(collection: str):
+    """Advance a collection's version after a write, invalidating ETags and cached documents"""
+    db.collection_versions.update_one(
+        {"_id": collection},
+        # The epoch keeps versions from repeating if the counters are ever reset
+        {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+        upsert=True
+    )
+    entity_cache.invalidate(collection)
+
+
+def get_versions(collections: List[str]) -> Dict[str, str]:
+    """Return the current version tag of each collection in one query"""
+    found = {
+        entry['_id']: f"{entry.get('epoch', '')}.{entry.get('version', 0)}"
+        for entry in db.collection_versions.find({"_id": {"$in": list(collections)}})
+    }
+    return {collection: found.get(collection, '0') for collection in collections}
+
+
+# Course and student reads go through this per-process cache (see entity_cache.py)
+entity_cache = EntityCache(get_versions)
+
+
+# ============= SYNC =============
+
+def record_tombstone(collection: str, document_id: str):
+    """Remember a deleted document so delta sync can tell clients to drop it"""
+    db.tombstones.insert_one({"collection": collection, "id": document_id, "deletedAt": datetime.utcnow()})
+
+
+def get_changes_since(since: Optional[datetime], fields: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """Return documents updated and ids deleted after ``since`` for every synced collection.
+
+    With ``since`` of None every document is returned (a full sync).
+    """
+    fields = fields or {}
+    changes = {}
+    for name, collection in SYNC_COLLECTIONS.items():
+        query = {"updatedAt": {"$gt": since}} if since else None
+        upserted, _ = list_documents(collection, query, fields=fields.get(name))
+        deleted = []
+        if since:
+            deleted = list(dict.fromkeys(
+                t['id'] for t in db.tombstones.find(
+                    {"collection": collection, "deletedAt": {"$gt": since}},
+                    {"_id": 0, "id": 1}
+                ).sort("deletedAt", 1)
+            ))
+        changes[name] = {"upserted": upserted, "deleted": deleted}
+    return changes
+
+
+def tombstone_horizon() -> datetime:
+    """Oldest point in time a delta sync can still be answered from tombstones"""
+    return datetime.utcnow() - timedelta(days=SYNC_TOMBSTONE_DAYS)
+
+
+def claim_idempotency_keys(keys: List[str]) -> Dict[str, Dict]:
+    """Claim unseen keys for this request in one unordered insert.
+
+    Returns the stored entry for every key that was already claimed, either
+    finished (``status: done`` with its ``outcome``) or still ``pending``.
+    """
+    if not keys:
+        return {}
+    now = datetime.utcnow()
+    taken = []
+    try:
+        db.idempotency_keys.insert_many(
+            [{"_id": key, "status": "pending", "createdAt": now} for key in keys], ordered=False
+        )
+    except BulkWriteError as e:
+        for write_error in e.details.get('writeErrors', []):
+            if write_error.get('code') != 11000:
+                raise
+            taken.append(keys[write_error['index']])
+    if not taken:
+        return {}
+
+    existing = {entry['_id']: entry for entry in db.idempotency_keys.find({"_id": {"$in": taken}})}
+    stale_before = now - timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS)
+    for key, entry in list(existing.items()):
+        if entry.get('status') == 'pending' and entry['createdAt'] < stale_before:
+            retaken = db.idempotency_keys.update_one(
+                {"_id": key, "status": "pending", "createdAt": entry['createdAt']},
+                {"$set": {"createdAt": now}}
+            )
+            if retaken.modified_count:
+                del existing[key]
+    return existing
+
+
+def complete_idempotency_keys(outcomes: Dict[str, Dict]):
+    """Store the outcome of every applied operation under its key"""
+    if not outcomes:
+        return
+    db.idempotency_keys.bulk_write([
+        UpdateOne({"_id": key}, {"$set": {"status": "done", "outcome": outcome}})
+        for key, outcome in outcomes.items()
+    ], ordered=False)
+
+
+def release_idempotency_keys(keys: List[str]):
+    """Forget claims whose operations failed unexpectedly, so a retry can apply them"""
+    if keys:
+        db.idempotency_keys.delete_many({"_id": {"$in": list(keys)}, "status": "pending"})
+
+
 # ============= STUDENT OPERATIONS =============
 
+def _assign_id(document: Dict) -> Dict:
+    """Give a new document its _id and, unless the client chose one, an id matching it"""
+    document['_id'] = ObjectId()
+    if not document.get('id'):
+        document['id'] = str(document['_id'])
+    return document
+
+
 def create_student(student_data: Dict) -> Dict:
     """Create a new student"""
     student_data['createdAt'] = datetime.utcnow()
     student_data['updatedAt'] = datetime.utcnow()
+    # Every student document has a stable id field for the frontend/mobile app
+    _assign_id(student_data)
     result = db.students.insert_one(student_data)
+    bump_version('students')
     student_data['_id'] = str(result.inserted_id)
-    # Ensure every student document has a stable id field for the frontend/mobile app
-    if 'id' not in student_data or not student_data['id']:
-        student_data['id'] = student_data['_id']
     return student_data
 
 
-def get_all_students() -> List[Dict]:
-    """Get all students"""
-    students = list(db.students.find())
-    for student in students:
+def bulk_create_students(rows: List[Dict], chunk_size: int = 500) -> Dict:
+    """Insert many students with unordered insert_many, reporting success or failure per row.
+
+    Each row carries a ``lineNumber`` used in the report; the unique studentId index
+    is the authority on duplicates.
+    """
+    created = []
+    errors = []
+    now = datetime.utcnow()
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        documents = []
+        for row in chunk:
+            document = _assign_id({k: v for k, v in row.items() if k not in ('lineNumber', '_id')})
+            document['createdAt'] = now
+            document['updatedAt'] = now
+            documents.append(document)
+
+        failed: Dict[int, str] = {}
+        try:
+            db.students.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                if write_error.get('code') == 11000:
+                    failed[write_error['index']] = "Student ID already exists."
+                else:
+                    failed[write_error['index']] = write_error.get('errmsg', 'Insert failed')
+
+        for index, (row, document) in enumerate(zip(chunk, documents)):
+            if index in failed:
+                errors.append({
+                    "lineNumber": row.get('lineNumber'),
+                    "name": row.get('name', ''),
+                    "studentId": row.get('studentId', ''),
+                    "reason": failed[index],
+                })
+            else:
+                created.append({
+                    "lineNumber": row.get('lineNumber'),
+                    "id": document['id'],
+                    "_id": str(document['_id']),
+                    "studentId": document.get('studentId', ''),
+                })
+
+    if created:
+        bump_version('students')
+    return {"created": created, "errors": errors}
+
+
+def get_all_students(fields: Optional[List[str]] = None) -> List[Dict]:
+    """Get all students (photos and passwords are left out by default)"""
+    return list(iter_students(fields))
+
+
+def iter_students(fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Stream all students"""
+    return iter_documents('students', fields=fields)
+
+
+def list_students(fields: Optional[List[str]] = None, limit: Optional[int] = None,
+                  after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Get one page of students"""
+    return list_documents('students', fields=fields, limit=limit, after=after)
+
+
+def authenticate_student(email: str, password: str) -> Optional[Dict]:
+    """Return the student with these credentials, without the password, or None"""
+    student = db.students.find_one(
+        {"email": {"$regex": f"^{re.escape(email)}$", "$options": "i"}, "password": password},
+        {"password": 0}
+    )
+    if student:
         student['_id'] = str(student['_id'])
-        # Backfill id if older records were created without it
         if 'id' not in student or not student['id']:
             student['id'] = student['_id']
-    return students
+    return student
 
 
 def get_student_by_id(student_id: str) -> Optional[Dict]:
     """Get student by ID"""
+    return entity_cache.get_or_load('students', student_id, lambda: _load_student(student_id))
+
+
+def _load_student(student_id: str) -> Optional[Dict]:
     student = db.students.find_one({"id": student_id})
-    if not student:
-        try:
-            object_id = ObjectId(student_id)
-            student = db.students.find_one({"_id": object_id})
-            if student and ('id' not in student or not student['id']):
-                db.students.update_one({"_id": object_id}, {"$set": {"id": student_id}})
-        except Exception:
-            student = None
     if student:
         student['_id'] = str(student['_id'])
-        if 'id' not in student or not student['id']:
-            student['id'] = student['_id']
     return student
 
 
@@ -103,25 +478,19 @@ def update_student(student_id: str, update_data: Dict) -> bool:
         {"id": student_id},
         {"$set": update_data}
     )
-
-    if result.modified_count == 0:
-        try:
-            object_id = ObjectId(student_id)
-            # When falling back to _id, also ensure the document now has the "id" field for future lookups
-            fallback_update = {**update_data, "id": student_id}
-            result = db.students.update_one(
-                {"_id": object_id},
-                {"$set": fallback_update}
-            )
-        except Exception:
-            pass
-
+    if result.modified_count:
+        bump_version('students')
     return result.modified_count > 0
 
 
 def delete_student(student_id: str) -> bool:
     """Delete student"""
     result = db.students.delete_one({"id": student_id})
+    if result.deleted_count:
+        db.attendance_stats.delete_many({"studentId": student_id})
+        db.student_insights.delete_one({"_id": student_id})
+        record_tombstone('students', student_id)
+        bump_version('students')
     return result.deleted_count > 0
 
 
@@ -131,21 +500,46 @@ def create_course(course_data: Dict) -> Dict:
     """Create a new course"""
     course_data['createdAt'] = datetime.utcnow()
     course_data['updatedAt'] = datetime.utcnow()
+    _assign_id(course_data)
     result = db.courses.insert_one(course_data)
+    bump_version('courses')
+    _seed_attendance_stats(course_data.get('id'), course_data.get('studentIds', []))
     course_data['_id'] = str(result.inserted_id)
     return course_data
 
 
-def get_all_courses() -> List[Dict]:
+def get_all_courses(fields: Optional[List[str]] = None) -> List[Dict]:
     """Get all courses"""
-    courses = list(db.courses.find())
-    for course in courses:
-        course['_id'] = str(course['_id'])
-    return courses
+    return entity_cache.get_or_load('courses', ('all', tuple(fields or ())), lambda: list(iter_courses(fields)))
+
+
+def iter_courses(fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Stream all courses"""
+    return iter_documents('courses', fields=fields)
+
+
+def list_courses(fields: Optional[List[str]] = None, limit: Optional[int] = None,
+                 after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Get one page of courses"""
+    return list_documents('courses', fields=fields, limit=limit, after=after)
+
+
+def get_course_rosters(course_ids: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    """Map course id -> ordered studentIds, for every course or the given ones"""
+    query = {"id": {"$in": list(course_ids)}} if course_ids is not None else {}
+    return {
+        course['id']: course.get('studentIds', [])
+        for course in db.courses.find(query, {"_id": 0, "id": 1, "studentIds": 1})
+        if course.get('id')
+    }
 
 
 def get_course_by_id(course_id: str) -> Optional[Dict]:
     """Get course by ID"""
+    return entity_cache.get_or_load('courses', course_id, lambda: _load_course(course_id))
+
+
+def _load_course(course_id: str) -> Optional[Dict]:
     course = db.courses.find_one({"id": course_id})
     if course:
         course['_id'] = str(course['_id'])
@@ -159,40 +553,467 @@ def update_course(course_id: str, update_data: Dict) -> bool:
         {"id": course_id},
         {"$set": update_data}
     )
+    if result.modified_count:
+        bump_version('courses')
+        if 'studentIds' in update_data:
+            _seed_attendance_stats(course_id, update_data['studentIds'])
     return result.modified_count > 0
 
 
 def delete_course(course_id: str) -> bool:
     """Delete course"""
     result = db.courses.delete_one({"id": course_id})
+    if result.deleted_count:
+        db.attendance_stats.delete_many({"courseId": course_id})
+        record_tombstone('courses', course_id)
+        bump_version('courses')
     return result.deleted_count > 0
 
 
+# ============= ATTENDANCE PRESENCE FORMAT =============
+
+# course id -> (roster version, studentIds in bit order, position of each id)
+_roster_cache: Dict[str, Tuple[int, List[str], Dict[str, int]]] = {}
+
+
+def encode_presence(positions: Iterable[int]) -> bytes:
+    """Pack roster positions into a bitmap: position p is bit p % 8 of byte p // 8.
+
+    This is the bit numbering MongoDB uses for ``$bitsAllSet`` on BinData.
+    """
+    positions = list(positions)
+    if not positions:
+        return b''
+    bits = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return bytes(bits)
+
+
+def decode_presence(bits: bytes) -> List[int]:
+    """Roster positions set in a presence bitmap, in ascending order"""
+    return [i * 8 + bit for i, byte in enumerate(bits) if byte for bit in range(8) if byte >> bit & 1]
+
+
+def count_present(bits: bytes) -> int:
+    """Popcount of a presence bitmap"""
+    return bin(int.from_bytes(bits, 'little')).count('1')
+
+
+def _cache_roster(course_id: str, roster: Dict) -> Tuple[int, List[str], Dict[str, int]]:
+    student_ids = roster.get('studentIds', [])
+    entry = (roster.get('version', 0), student_ids, {sid: i for i, sid in enumerate(student_ids)})
+    _roster_cache[course_id] = entry
+    return entry
+
+
+def get_roster(course_id: str, min_version: int = 0) -> Tuple[int, List[str], Dict[str, int]]:
+    """Return the append-only bit order for a course, seeding it from the course's studentIds.
+
+    Students are only ever appended, so existing bitmaps stay valid when the
+    course roster changes; the version is bumped on every append.
+    """
+    cached = _roster_cache.get(course_id)
+    if cached and cached[0] >= min_version:
+        return cached
+    roster = db.course_rosters.find_one({"_id": course_id})
+    if roster is None:
+        course = db.courses.find_one({"id": course_id}, {"_id": 0, "studentIds": 1}) or {}
+        try:
+            roster = db.course_rosters.find_one_and_update(
+                {"_id": course_id},
+                {"$setOnInsert": {"studentIds": list(dict.fromkeys(course.get('studentIds', []))), "version": 1}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            roster = db.course_rosters.find_one({"_id": course_id})
+    return _cache_roster(course_id, roster)
+
+
+def roster_positions(course_id: str, student_ids: List[str]) -> Tuple[int, List[int]]:
+    """Bit positions for student ids, appending unknown students to the roster"""
+    version, roster, index_of = get_roster(course_id)
+    missing = [sid for sid in dict.fromkeys(student_ids) if sid not in index_of]
+    if missing:
+        roster_doc = db.course_rosters.find_one_and_update(
+            {"_id": course_id},
+            {"$addToSet": {"studentIds": {"$each": missing}}, "$inc": {"version": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        version, roster, index_of = _cache_roster(course_id, roster_doc)
+    return version, [index_of[sid] for sid in student_ids]
+
+
+def student_roster_bits(student_id: str, course_ids: List[str]) -> Dict[str, int]:
+    """A student's bit position in each course roster that has one.
+
+    Courses without a stored roster have no bitset records, so none is created here.
+    """
+    positions = {}
+    lookup = []
+    for course_id in course_ids:
+        cached = _roster_cache.get(course_id)
+        if cached and student_id in cached[2]:
+            positions[course_id] = cached[2][student_id]
+        else:
+            lookup.append(course_id)
+    if lookup:
+        for roster in db.course_rosters.find({"_id": {"$in": lookup}}):
+            _, _, index_of = _cache_roster(roster['_id'], roster)
+            if student_id in index_of:
+                positions[roster['_id']] = index_of[student_id]
+    return positions
+
+
+def presence_update(course_id: str, student_ids: List[str], storage: Optional[str] = None) -> Tuple[Dict, Dict]:
+    """($set, $unset) documents storing presence in the given (default: configured) format"""
+    if (storage or ATTENDANCE_STORAGE) == 'bitset':
+        version, positions = roster_positions(course_id, student_ids)
+        return ({"presenceBits": Binary(encode_presence(positions)), "rosterVersion": version},
+                {"presentStudentIds": ""})
+    return {"presentStudentIds": list(student_ids)}, {"presenceBits": "", "rosterVersion": ""}
+
+
+def present_ids(record: Dict) -> List[str]:
+    """Present student ids of a stored record in either format"""
+    if record.get('presenceBits') is None:
+        return list(record.get('presentStudentIds') or [])
+    _, roster, _ = get_roster(record['courseId'], record.get('rosterVersion', 0))
+    return [roster[p] for p in decode_presence(record['presenceBits']) if p < len(roster)]
+
+
+def normalize_presence(record: Dict) -> Dict:
+    """Rewrite a stored record so callers always see presentStudentIds"""
+    if 'presenceBits' in record:
+        record['presentStudentIds'] = present_ids(record)
+        record.pop('presenceBits', None)
+        record.pop('rosterVersion', None)
+    return record
+
+
+def _to_storage(record: Dict, course_id: Optional[str] = None) -> Tuple[Dict, Dict]:
+    """Split a record payload into ($set, $unset) with presence in the configured format"""
+    fields = dict(record)
+    if 'presentStudentIds' not in fields:
+        return fields, {}
+    present = fields.pop('presentStudentIds') or []
+    to_set, to_unset = presence_update(course_id or fields['courseId'], present)
+    fields.update(to_set)
+    return fields, to_unset
+
+
+def convert_attendance_storage(target: str, batch_size: int = 500) -> int:
+    """Rewrite every record not yet in the target format ('ids' or 'bitset')"""
+    query = {"presentStudentIds": {"$exists": True}} if target == 'bitset' else {"presenceBits": {"$exists": True}}
+    converted = 0
+    operations = []
+    cursor = db.attendance_records.find(
+        query, {"_id": 1, "courseId": 1, "presentStudentIds": 1, "presenceBits": 1, "rosterVersion": 1}
+    ).batch_size(batch_size)
+    for record in cursor:
+        to_set, to_unset = presence_update(record['courseId'], present_ids(record), target)
+        operations.append(UpdateOne({"_id": record['_id']}, {"$set": to_set, "$unset": to_unset}))
+        if len(operations) >= batch_size:
+            converted += db.attendance_records.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += db.attendance_records.bulk_write(operations, ordered=False).modified_count
+    if converted:
+        bump_version('attendance_records')
+    return converted
+
+
 # ============= ATTENDANCE OPERATIONS =============
 
+def attendance_date_value(date: str) -> Optional[datetime]:
+    """Datetime for a YYYY-MM-DD session date, stored as dateValue; None if it does not parse"""
+    try:
+        return datetime.strptime(date, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
 def create_attendance_record(record_data: Dict) -> Dict:
     """Create a new attendance record"""
     record_data['createdAt'] = datetime.utcnow()
     record_data['updatedAt'] = datetime.utcnow()
-    result = db.attendance_records.insert_one(record_data)
+    _assign_id(record_data)
+    stored, _ = _to_storage(record_data)
+    stored['dateValue'] = attendance_date_value(record_data.get('date'))
+    result = db.attendance_records.insert_one(stored)
+    bump_version('attendance_records')
+    _apply_stats_delta(record_data['courseId'], record_data['date'], None, record_data.get('presentStudentIds') or [])
     record_data['_id'] = str(result.inserted_id)
     return record_data
 
 
-def get_all_attendance_records() -> List[Dict]:
+def bulk_upsert_attendance(sessions: List[Dict], chunk_size: int = 1000) -> List[Dict]:
+    """Upsert many sessions keyed by (courseId, date) with unordered bulk_write.
+
+    Returns one result per input session, in input order: ``created``, ``updated``
+    or ``error``. When the same course and date appear more than once, the last
+    one wins and the earlier entries are reported as ``superseded``.
+    """
+    results: List[Optional[Dict]] = [None] * len(sessions)
+
+    # Collapse repeats so one chunk never carries two writes for the same key
+    last_index: Dict[Tuple[str, str], int] = {}
+    for index, session in enumerate(sessions):
+        last_index[(session['courseId'], session['date'])] = index
+    for index, session in enumerate(sessions):
+        if last_index[(session['courseId'], session['date'])] != index:
+            results[index] = {"index": index, "courseId": session['courseId'], "date": session['date'], "status": "superseded"}
+
+    pending = sorted(last_index.values())
+    changes: List[Tuple[Tuple[str, str], Optional[List[str]], List[str]]] = []
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        now = datetime.utcnow()
+        operations = []
+        new_ids = []
+        for index in chunk:
+            session = sessions[index]
+            # Same convention as the other create paths: id matches _id unless the client chose one
+            inserted = _assign_id({"id": session.get('id')})
+            new_ids.append(inserted['id'])
+            presence, stale = presence_update(session['courseId'], session['presentStudentIds'])
+            operations.append(UpdateOne(
+                {"courseId": session['courseId'], "date": session['date']},
+                {
+                    "$set": {**presence, "updatedAt": now},
+                    "$unset": stale,
+                    "$setOnInsert": {**inserted, "dateValue": attendance_date_value(session['date']), "createdAt": now},
+                },
+                upsert=True,
+            ))
+
+        # Presence before the write, for the attendance_stats deltas
+        existing: Dict[Tuple[str, str], Dict] = {
+            (record['courseId'], record['date']): record
+            for record in db.attendance_records.find(
+                {"$or": [{"courseId": sessions[i]['courseId'], "date": sessions[i]['date']} for i in chunk]},
+                ATTENDANCE_STATS_PROJECTION
+            )
+        }
+
+        failed: Dict[int, str] = {}
+        upserted: Dict[int, object] = {}
+        try:
+            outcome = db.attendance_records.bulk_write(operations, ordered=False)
+            upserted = outcome.upserted_ids
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                failed[write_error['index']] = write_error.get('errmsg', 'Write failed')
+            upserted = {u['index']: u['_id'] for u in e.details.get('upserted', [])}
+
+        # Existing records keep their id; one created concurrently since the lookup is fetched now
+        late_keys = [(sessions[i]['courseId'], sessions[i]['date']) for pos, i in enumerate(chunk)
+                     if pos not in upserted and pos not in failed
+                     and (sessions[i]['courseId'], sessions[i]['date']) not in existing]
+        late_ids: Dict[Tuple[str, str], Optional[str]] = {}
+        if late_keys:
+            for record in db.attendance_records.find(
+                {"$or": [{"courseId": c, "date": d} for c, d in late_keys]},
+                {"_id": 0, "id": 1, "courseId": 1, "date": 1}
+            ):
+                late_ids[(record['courseId'], record['date'])] = record.get('id')
+
+        for pos, index in enumerate(chunk):
+            session = sessions[index]
+            key = (session['courseId'], session['date'])
+            result = {"index": index, "courseId": session['courseId'], "date": session['date']}
+            if pos in failed:
+                result.update({"status": "error", "error": failed[pos]})
+            elif pos in upserted:
+                result.update({"status": "created", "id": new_ids[pos]})
+            else:
+                before = existing.get(key)
+                result.update({"status": "updated", "id": before.get('id') if before else late_ids.get(key)})
+            if pos not in failed:
+                before = existing.get(key)
+                changes.append((key, present_ids(before) if before else None, session['presentStudentIds']))
+            results[index] = result
+
+    if pending:
+        bump_version('attendance_records')
+
+    per_course = Counter(course_id for (course_id, _), _, _ in changes)
+    rebuild = [course_id for course_id, count in per_course.items() if count > ATTENDANCE_STATS_REBUILD_AFTER]
+    if rebuild:
+        rebuild_attendance_stats(rebuild)
+    # Newest first: only the newest session may extend streaks in place, older ones re-read them
+    for (course_id, date), before, after in sorted(changes, key=lambda change: change[0][1], reverse=True):
+        if course_id not in rebuild:
+            _apply_stats_delta(course_id, date, before, after)
+    return results
+
+
+def get_all_attendance_records(fields: Optional[List[str]] = None) -> List[Dict]:
     """Get all attendance records"""
-    records = list(db.attendance_records.find())
-    for record in records:
-        record['_id'] = str(record['_id'])
-    return records
+    return list(iter_attendance_records(fields=fields))
 
 
-def get_attendance_by_course(course_id: str) -> List[Dict]:
+def iter_attendance_records(course_id: Optional[str] = None, fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Stream attendance records, optionally for one course"""
+    query = {"courseId": course_id} if course_id else None
+    return iter_documents('attendance_records', query, fields=fields)
+
+
+def get_attendance_by_course(course_id: str, fields: Optional[List[str]] = None) -> List[Dict]:
     """Get attendance records for a specific course"""
-    records = list(db.attendance_records.find({"courseId": course_id}))
-    for record in records:
-        record['_id'] = str(record['_id'])
-    return records
+    return list(iter_attendance_records(course_id, fields))
+
+
+def list_attendance_records(course_id: Optional[str] = None, fields: Optional[List[str]] = None,
+                            limit: Optional[int] = None, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Get one page of attendance records, optionally for one course"""
+    query = {"courseId": course_id} if course_id else None
+    return list_documents('attendance_records', query, fields=fields, limit=limit, after=after)
+
+
+def upsert_attendance_session(course_id: str, date: str, data: Dict) -> Tuple[Dict, bool]:
+    """Create or update the single record for a course and date in one atomic call.
+
+    Returns the stored record and whether it was created.
+    """
+    # dateValue and updatedAt are set by the server (a client may echo them back from a record it read)
+    fields = {k: v for k, v in data.items() if k not in ('_id', 'id', 'courseId', 'date', 'dateValue', 'createdAt', 'updatedAt')}
+    stored, stale = _to_storage(fields, course_id)
+    now = datetime.utcnow()
+    new_oid = ObjectId()
+    inserted = {"_id": new_oid, "id": str(new_oid), "courseId": course_id, "date": date, "createdAt": now}
+    update = {"$set": {**stored, "updatedAt": now},
+              "$setOnInsert": {**inserted, "dateValue": attendance_date_value(date)}}
+    if stale:
+        update["$unset"] = stale
+    # The previous state drives the attendance_stats delta; the new one is rebuilt from it below
+    try:
+        before = db.attendance_records.find_one_and_update(
+            {"courseId": course_id, "date": date}, update,
+            upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Lost an insert race on the unique index; the other writer's record now exists
+        before = db.attendance_records.find_one_and_update(
+            {"courseId": course_id, "date": date}, update,
+            return_document=ReturnDocument.BEFORE
+        )
+    bump_version('attendance_records')
+
+    previous = present_ids(before) if before else None
+    present = fields['presentStudentIds'] if 'presentStudentIds' in fields else (previous or [])
+    _apply_stats_delta(course_id, date, previous, present)
+
+    record = {k: v for k, v in before.items() if k not in stale} if before else dict(inserted)
+    record.update({**stored, "updatedAt": now})
+    record['_id'] = str(record['_id'])
+    # Internal like in list responses; new and existing sessions come back in the same shape
+    record.pop('dateValue', None)
+    return normalize_presence(record), before is None
+
+
+def patch_attendance_session(course_id: str, date: str, add: List[str], remove: List[str],
+                             timestamp: Optional[float] = None) -> Dict:
+    """Mark and unmark students on one session without rewriting the whole array.
+
+    Records stored as id arrays are changed in place with ``$addToSet``/``$pull``
+    (or one pipeline update when both are given). New sessions and bitset
+    records go through a compare-and-swap on the stored presence instead.
+    A client ``timestamp`` (the time the teacher saved) is stored along with the change.
+    """
+    now = datetime.utcnow()
+    saved = {"updatedAt": now}
+    if timestamp is not None:
+        saved['timestamp'] = timestamp
+    if ATTENDANCE_STORAGE == 'ids':
+        if add and remove:
+            present = {"$ifNull": ["$presentStudentIds", []]}
+            update = [{"$set": {
+                "presentStudentIds": {"$concatArrays": [
+                    {"$filter": {"input": present, "cond": {"$not": [{"$in": ["$$this", add + remove]}]}}},
+                    add,
+                ]},
+                **{field: {"$literal": value} for field, value in saved.items()},
+            }}]
+        else:
+            update = {"$set": dict(saved)}
+            if add:
+                update["$addToSet"] = {"presentStudentIds": {"$each": add}}
+            elif remove:
+                update["$pull"] = {"presentStudentIds": {"$in": remove}}
+        before = db.attendance_records.find_one_and_update(
+            {"courseId": course_id, "date": date, "presenceBits": {"$exists": False}}, update,
+            projection={"_id": 0, "id": 1, "presentStudentIds": 1}, return_document=ReturnDocument.BEFORE
+        )
+        if before is not None:
+            bump_version('attendance_records')
+            previous = before.get('presentStudentIds') or []
+            present = apply_presence_delta(previous, add, remove)
+            _apply_stats_delta(course_id, date, previous, present)
+            return {
+                "id": before.get('id'),
+                "courseId": course_id,
+                "date": date,
+                "presentCount": len(present),
+                "created": False,
+            }
+    return _patch_attendance_cas(course_id, date, add, remove, now, saved)
+
+
+def apply_presence_delta(present: List[str], add: List[str], remove: List[str]) -> List[str]:
+    """Present ids after a PATCH delta, matching what the atomic updates store"""
+    if add and remove:
+        changed = set(add) | set(remove)
+        return [sid for sid in present if sid not in changed] + list(add)
+    if add:
+        return present + [sid for sid in dict.fromkeys(add) if sid not in present]
+    dropped = set(remove)
+    return [sid for sid in present if sid not in dropped]
+
+
+def _patch_attendance_cas(course_id: str, date: str, add: List[str], remove: List[str], now: datetime,
+                          saved: Dict) -> Dict:
+    """Read-modify-write a session's presence, retrying if another writer got there first"""
+    for _ in range(ATTENDANCE_PATCH_RETRIES):
+        current = db.attendance_records.find_one({"courseId": course_id, "date": date}, ATTENDANCE_STATS_PROJECTION)
+        if current is None:
+            before, present = None, list(dict.fromkeys(add))
+            presence, _ = presence_update(course_id, present)
+            document = _assign_id({
+                "courseId": course_id, "date": date, "dateValue": attendance_date_value(date),
+                **presence, "createdAt": now, **saved,
+            })
+            try:
+                db.attendance_records.insert_one(document)
+            except DuplicateKeyError:
+                continue
+            record_id, created = document['id'], True
+        else:
+            before = present_ids(current)
+            present = apply_presence_delta(before, add, remove)
+            presence, stale = presence_update(course_id, present)
+            swapped = db.attendance_records.update_one(
+                {
+                    "_id": current['_id'],
+                    "presentStudentIds": current.get('presentStudentIds'),
+                    "presenceBits": current.get('presenceBits'),
+                },
+                {"$set": {**presence, **saved}, "$unset": stale}
+            )
+            if not swapped.matched_count:
+                continue
+            record_id, created = current.get('id') or str(current['_id']), False
+        bump_version('attendance_records')
+        _apply_stats_delta(course_id, date, before, present)
+        bits = presence.get('presenceBits')
+        return {
+            "id": record_id,
+            "courseId": course_id,
+            "date": date,
+            "presentCount": count_present(bits) if bits is not None else len(present),
+            "created": created,
+        }
+    raise Exception('Attendance session is being changed concurrently, try again')
 
 
 def get_attendance_by_date(course_id: str, date: str) -> Optional[Dict]:
@@ -200,23 +1021,397 @@ def get_attendance_by_date(course_id: str, date: str) -> Optional[Dict]:
     record = db.attendance_records.find_one({"courseId": course_id, "date": date})
     if record:
         record['_id'] = str(record['_id'])
+        normalize_presence(record)
     return record
 
 
 def update_attendance_record(record_id: str, update_data: Dict) -> bool:
     """Update attendance record"""
     update_data['updatedAt'] = datetime.utcnow()
-    result = db.attendance_records.update_one(
-        {"id": record_id},
-        {"$set": update_data}
+    course_id = update_data.get('courseId')
+    if 'presentStudentIds' in update_data and not course_id:
+        existing = db.attendance_records.find_one({"id": record_id}, {"_id": 0, "courseId": 1})
+        if existing is None:
+            return False
+        course_id = existing['courseId']
+    to_set, to_unset = _to_storage(update_data, course_id)
+    if 'date' in update_data:
+        to_set['dateValue'] = attendance_date_value(update_data['date'])
+    update = {"$set": to_set}
+    if to_unset:
+        update["$unset"] = to_unset
+    before = db.attendance_records.find_one_and_update(
+        {"id": record_id}, update, projection=ATTENDANCE_STATS_PROJECTION
     )
-    return result.modified_count > 0
+    if before is None:
+        return False
+    bump_version('attendance_records')
+
+    old_key = (before['courseId'], before['date'])
+    new_key = (update_data.get('courseId', old_key[0]), update_data.get('date', old_key[1]))
+    previous = present_ids(before)
+    present = update_data.get('presentStudentIds', previous)
+    if new_key != old_key:
+        _apply_stats_delta(*old_key, previous, None)
+        _apply_stats_delta(*new_key, None, present)
+    else:
+        _apply_stats_delta(*old_key, previous, present)
+    return True
 
 
 def delete_attendance_record(record_id: str) -> bool:
     """Delete attendance record"""
-    result = db.attendance_records.delete_one({"id": record_id})
-    return result.deleted_count > 0
+    deleted = db.attendance_records.find_one_and_delete({"id": record_id}, projection=ATTENDANCE_STATS_PROJECTION)
+    if deleted is None:
+        return False
+    record_tombstone('attendance_records', record_id)
+    bump_version('attendance_records')
+    _apply_stats_delta(deleted['courseId'], deleted['date'], present_ids(deleted), None)
+    return True
+
+
+def merge_duplicate_attendance(dry_run: bool = False) -> Dict:
+    """Merge duplicate (courseId, date) records into the oldest one, then enforce the unique index.
+
+    Present students are unioned so nobody marked present by any copy is lost;
+    other fields come from the most recently updated copy.
+    """
+    groups = find_duplicate_attendance()
+    removed = 0
+    for group in groups:
+        records = sorted(db.attendance_records.find({"_id": {"$in": group['ids']}}), key=lambda r: r['_id'])
+        keeper = records[0]
+        latest = max(records, key=lambda r: (r.get('updatedAt') or r['_id'].generation_time.replace(tzinfo=None), r['_id']))
+        present = list(dict.fromkeys(sid for r in records for sid in present_ids(r)))
+        merged = {k: v for k, v in latest.items() if k not in ('_id', 'id', 'createdAt', *PRESENCE_FIELDS)}
+        merged.update({"presentStudentIds": present, "updatedAt": datetime.utcnow()})
+        if not keeper.get('id'):
+            merged['id'] = str(keeper['_id'])
+        removed += len(records) - 1
+        if dry_run:
+            continue
+        merged, stale = _to_storage(merged, keeper['courseId'])
+        update = {"$set": merged}
+        if stale:
+            update["$unset"] = stale
+        db.attendance_records.update_one({"_id": keeper['_id']}, update)
+        db.attendance_records.delete_many({"_id": {"$in": [r['_id'] for r in records[1:]]}})
+        keeper_id = keeper.get('id') or str(keeper['_id'])
+        for record in records[1:]:
+            if record.get('id') and record['id'] != keeper_id:
+                record_tombstone('attendance_records', record['id'])
+
+    if groups and not dry_run:
+        bump_version('attendance_records')
+        # Each copy was counted as its own session, so the affected courses are recounted
+        rebuild_attendance_stats(list({group['_id']['courseId'] for group in groups}))
+    unique = False if dry_run else ensure_attendance_key_index()
+    return {"groups": len(groups), "removed": removed, "uniqueIndex": unique}
+
+
+# ============= ATTENDANCE STATISTICS =============
+
+def _recent_presence(course_id: str, student_ids: Iterable[str]) -> Dict[str, Tuple[Optional[str], int]]:
+    """(lastSeen, streak) per student, reading the course's sessions newest first only as far as needed"""
+    seen_pending = set(student_ids)
+    streak_pending = set(seen_pending)
+    last_seen: Dict[str, Optional[str]] = dict.fromkeys(seen_pending)
+    streak: Dict[str, int] = dict.fromkeys(seen_pending, 0)
+    cursor = db.attendance_records.find({"courseId": course_id}, ATTENDANCE_STATS_PROJECTION).sort("date", -1)
+    for record in cursor.batch_size(LIST_BATCH_SIZE):
+        if not seen_pending and not streak_pending:
+            break
+        present = set(present_ids(record))
+        for sid in seen_pending & present:
+            last_seen[sid] = record['date']
+        seen_pending -= present
+        for sid in list(streak_pending):
+            if sid in present:
+                streak[sid] += 1
+            else:
+                streak_pending.discard(sid)
+    return {sid: (last_seen[sid], streak[sid]) for sid in last_seen}
+
+
+def _apply_stats_delta(course_id: str, date: str, before: Optional[List[str]], after: Optional[List[str]]):
+    """Fold one session change into the attendance_stats rows of the course's students.
+
+    ``before`` is None for a new session and ``after`` is None for a deleted one.
+    Counts move by $inc. Adding the course's newest session extends lastSeen and
+    streak in place; any other change re-reads recent sessions for the students
+    it touched.
+    """
+    before_set = set(before or [])
+    after_set = set(after or [])
+    sessions_delta = (after is not None) - (before is not None)
+    # Rows are kept for enrolled students; every one of them gains or loses a session
+    course = db.courses.find_one({"id": course_id}, {"_id": 0, "studentIds": 1}) or {}
+    students = set(course.get('studentIds', []))
+    if not sessions_delta:
+        students &= before_set ^ after_set
+    if not students:
+        return
+
+    newest = sessions_delta > 0 and db.attendance_records.find_one(
+        {"courseId": course_id, "date": {"$gt": date}}, {"_id": 1}
+    ) is None
+    recent = {} if newest else _recent_presence(course_id, students)
+
+    now = datetime.utcnow()
+    operations = []
+    for sid in students:
+        update: Dict = {
+            "$inc": {"sessions": sessions_delta, "present": (sid in after_set) - (sid in before_set)},
+            "$set": {"updatedAt": now},
+        }
+        if not newest:
+            update["$set"].update(dict(zip(("lastSeen", "streak"), recent[sid])))
+        elif sid in after_set:
+            update["$inc"]["streak"] = 1
+            update["$set"]["lastSeen"] = date
+        else:
+            update["$set"]["streak"] = 0
+        operations.append(UpdateOne({"studentId": sid, "courseId": course_id}, update, upsert=True))
+    db.attendance_stats.bulk_write(operations, ordered=False)
+
+
+def _seed_attendance_stats(course_id: Optional[str], student_ids: List[str]):
+    """Match a course's stats rows to its roster after enrollment changes.
+
+    Students who left lose their row; newly enrolled students get one counted
+    from the course's records.
+    """
+    if not course_id:
+        return
+    db.attendance_stats.delete_many({"courseId": course_id, "studentId": {"$nin": list(student_ids)}})
+    have = {row['studentId'] for row in db.attendance_stats.find({"courseId": course_id}, {"_id": 0, "studentId": 1})}
+    joined = [sid for sid in dict.fromkeys(student_ids) if sid not in have]
+    if not joined:
+        return
+    # One pass over the course's records counts every joined student at once
+    sessions, present, last_seen, streak = _count_course_attendance(course_id, joined)
+    now = datetime.utcnow()
+    db.attendance_stats.bulk_write([
+        UpdateOne({"studentId": sid, "courseId": course_id}, {"$setOnInsert": {
+            "sessions": sessions, "present": present[sid],
+            "lastSeen": last_seen.get(sid), "streak": streak.get(sid, 0), "updatedAt": now,
+        }}, upsert=True)
+        for sid in joined
+    ], ordered=False)
+
+
+def _count_course_attendance(course_id: str, student_ids: Optional[List[str]] = None):
+    """Scan a course's records once: (sessions, present, lastSeen, streak) per student.
+
+    With ``student_ids`` only those students are tallied.
+    """
+    wanted = set(student_ids) if student_ids is not None else None
+    sessions = 0
+    present: Counter = Counter()
+    last_seen: Dict[str, str] = {}
+    streak: Dict[str, int] = {}
+    cursor = db.attendance_records.find({"courseId": course_id}, ATTENDANCE_STATS_PROJECTION).sort("date", 1)
+    for record in cursor.batch_size(LIST_BATCH_SIZE):
+        sessions += 1
+        marked = set(present_ids(record))
+        if wanted is not None:
+            marked &= wanted
+        present.update(marked)
+        for sid in marked:
+            last_seen[sid] = record['date']
+        for sid in set(streak) | marked:
+            streak[sid] = streak.get(sid, 0) + 1 if sid in marked else 0
+    return sessions, present, last_seen, streak
+
+
+def rebuild_attendance_stats(course_ids: Optional[List[str]] = None) -> Dict:
+    """Regenerate attendance_stats from the raw records, for every course or the given ones"""
+    course_filter = {"id": {"$in": list(course_ids)}} if course_ids is not None else {}
+    rosters = {
+        course['id']: course.get('studentIds', [])
+        for course in db.courses.find(course_filter, {"_id": 0, "id": 1, "studentIds": 1})
+        if course.get('id')
+    }
+    now = datetime.utcnow()
+    written = 0
+    for course_id, roster in rosters.items():
+        sessions, present, last_seen, streak = _count_course_attendance(course_id)
+        students = list(dict.fromkeys(roster))
+        if students:
+            db.attendance_stats.bulk_write([
+                ReplaceOne({"studentId": sid, "courseId": course_id}, {
+                    "studentId": sid, "courseId": course_id,
+                    "sessions": sessions, "present": present[sid],
+                    "lastSeen": last_seen.get(sid), "streak": streak.get(sid, 0),
+                    "updatedAt": now,
+                }, upsert=True)
+                for sid in students
+            ], ordered=False)
+        db.attendance_stats.delete_many({"courseId": course_id, "studentId": {"$nin": students}})
+        written += len(students)
+
+    if course_ids is None:
+        db.attendance_stats.delete_many({"courseId": {"$nin": list(rosters)}})
+    else:
+        # Courses that no longer exist keep no stats
+        db.attendance_stats.delete_many({"courseId": {"$in": [c for c in course_ids if c not in rosters]}})
+    return {"courses": len(rosters), "stats": written}
+
+
+def get_attendance_stats(student_id: str) -> List[Dict]:
+    """Materialized per-course counters for a student (one indexed read)"""
+    return list(db.attendance_stats.find({"studentId": student_id}, {"_id": 0, "updatedAt": 0}))
+
+
+def _aggregate_student_attendance(student_id: str, course_ids: List[str]) -> Dict[str, Dict]:
+    """Count sessions and presence for a student straight from the attendance records"""
+    sessions_by_course = {row['_id']: row['sessions'] for row in db.attendance_records.aggregate([
+        {"$match": {"courseId": {"$in": course_ids}}},
+        {"$group": {"_id": "$courseId", "sessions": {"$sum": 1}}},
+    ])}
+
+    # Bitset records are matched on the student's roster bit, id-array records on membership
+    present_matches = [{"courseId": {"$in": course_ids}, "presentStudentIds": student_id}]
+    for course_id, position in student_roster_bits(student_id, course_ids).items():
+        present_matches.append({"courseId": course_id, "presenceBits": {"$bitsAllSet": [position]}})
+    present_by_course = {row['_id']: row['present'] for row in db.attendance_records.aggregate([
+        {"$match": {"$or": present_matches}},
+        {"$group": {"_id": "$courseId", "present": {"$sum": 1}}},
+    ])}
+    return {
+        course_id: {
+            "sessions": sessions_by_course.get(course_id, 0),
+            "present": present_by_course.get(course_id, 0),
+            "lastSeen": None,
+            "streak": None,
+        }
+        for course_id in course_ids
+    }
+
+
+def get_student_attendance_stats(student_id: str) -> Dict:
+    """Per-course and overall attendance for a student, read from attendance_stats"""
+    courses = list(db.courses.find(
+        {"studentIds": student_id},
+        {"_id": 0, "id": 1, "name": 1, "code": 1}
+    ))
+    stats = {row['courseId']: row for row in get_attendance_stats(student_id)}
+    missing = [c['id'] for c in courses if c['id'] not in stats]
+    if missing:
+        # Not materialized yet (e.g. before the first rebuild); count from the records
+        print(f"[Stats] No attendance_stats for {student_id} in {len(missing)} course(s); run: python manage.py rebuild-attendance-stats")
+        stats.update(_aggregate_student_attendance(student_id, missing))
+
+    total_classes = 0
+    present_classes = 0
+    course_details = []
+    for course in courses:
+        row = stats[course['id']]
+        sessions = row['sessions']
+        present = row['present']
+        total_classes += sessions
+        present_classes += present
+        course_details.append({
+            "courseId": course['id'],
+            "name": course.get('name', ''),
+            "code": course.get('code', ''),
+            "sessions": sessions,
+            "present": present,
+            # Courses without any sessions yet count as full attendance
+            "percentage": 100 if sessions == 0 else round((present / sessions) * 100),
+            "lastSeen": row.get('lastSeen'),
+            "streak": row.get('streak'),
+        })
+
+    return {
+        "studentId": student_id,
+        "totalClasses": total_classes,
+        "presentClasses": present_classes,
+        "overallPercentage": 100 if total_classes == 0 else round((present_classes / total_classes) * 100),
+        "courses": course_details,
+    }
+
+
+def get_student_attendance(student_id: str, course_id: Optional[str] = None,
+                           date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                           limit: Optional[int] = None) -> List[Dict]:
+    """Present/absent row per session of the student's courses (or one course), oldest first.
+
+    With ``limit`` only the most recent sessions are returned. Attendance is
+    matched through the (presentStudentIds, dateValue) multikey index, and
+    through the student's roster bit for bitset records.
+    """
+    if course_id:
+        course_ids = [course_id]
+    else:
+        course_ids = [c['id'] for c in db.courses.find({"studentIds": student_id}, {"_id": 0, "id": 1})]
+    if not course_ids:
+        return []
+
+    date_range: Dict = {}
+    if date_from:
+        date_range['$gte'] = date_from
+    if date_to:
+        date_range['$lte'] = date_to
+    query: Dict = {"courseId": {"$in": course_ids}, "dateValue": date_range or {"$ne": None}}
+    cursor = db.attendance_records.find(
+        query, {"_id": 0, "id": 1, "courseId": 1, "date": 1, "dateValue": 1}
+    ).sort([("dateValue", -1), ("courseId", -1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    sessions = list(cursor)[::-1]
+    if not sessions:
+        return []
+
+    # Only the window the sessions span needs to be searched for attendance
+    window = {"$gte": sessions[0]['dateValue'], "$lte": sessions[-1]['dateValue']}
+    attended_matches = [{"presentStudentIds": student_id, "dateValue": window, "courseId": {"$in": course_ids}}]
+    for cid, position in student_roster_bits(student_id, course_ids).items():
+        attended_matches.append({"courseId": cid, "dateValue": window, "presenceBits": {"$bitsAllSet": [position]}})
+    attended = {
+        (record['courseId'], record['date'])
+        for record in db.attendance_records.find({"$or": attended_matches}, {"_id": 0, "courseId": 1, "date": 1})
+    }
+    return [
+        {
+            "id": session.get('id'),
+            "courseId": session['courseId'],
+            "date": session['date'],
+            "present": (session['courseId'], session['date']) in attended,
+        }
+        for session in sessions
+    ]
+
+
+def load_course_report_data(course_ids: Optional[List[str]] = None, branch: Optional[str] = None) -> Dict:
+    """Load courses, their enrolled students and attendance records in three queries.
+
+    An empty course_ids means no id filter, like None, so a branch report covers the whole branch.
+    """
+    course_filter: Dict = {}
+    if course_ids:
+        course_filter['id'] = {"$in": list(course_ids)}
+    if branch:
+        course_filter['branch'] = branch
+    courses = list(db.courses.find(course_filter))
+    for course in courses:
+        course['_id'] = str(course['_id'])
+
+    student_ids = {sid for course in courses for sid in course.get('studentIds', [])}
+    students = list(db.students.find(
+        {"id": {"$in": list(student_ids)}},
+        {"_id": 0, "id": 1, "name": 1, "studentId": 1}
+    ))
+
+    records_by_course: Dict[str, List[Dict]] = {course['id']: [] for course in courses}
+    cursor = db.attendance_records.find(
+        {"courseId": {"$in": list(records_by_course)}},
+        {"_id": 0, "courseId": 1, "date": 1, "presentStudentIds": 1, "presenceBits": 1, "rosterVersion": 1}
+    )
+    for record in cursor:
+        records_by_course.setdefault(record['courseId'], []).append(normalize_presence(record))
+
+    return {"courses": courses, "students": students, "recordsByCourse": records_by_course}
 
 
 # ============= USER OPERATIONS =============
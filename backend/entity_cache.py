@@ -0,0 +1,130 @@
+"""
+Read-through cache for course and student documents.
+
+Each gunicorn worker keeps its own size-bounded LRU + TTL cache. Entries are
+stamped with their collection's version from the collection_versions counters
+in MongoDB, which every write bumps, so a write made by any worker invalidates
+the entries of every other worker once they next check the version.
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+ENTITY_CACHE_ENABLED = os.getenv('ENTITY_CACHE_ENABLED', 'true').lower() == 'true'
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv('ENTITY_CACHE_MAX_ENTRIES', '2000'))
+ENTITY_CACHE_TTL = float(os.getenv('ENTITY_CACHE_TTL', '300'))
+# How long a worker trusts its last look at a collection's version. Writes made by
+# this worker take effect at once; writes made by other workers within this many seconds.
+ENTITY_CACHE_REVALIDATE_SECONDS = float(os.getenv('ENTITY_CACHE_REVALIDATE_SECONDS', '2'))
+
+
+class EntityCache:
+    """Per-process LRU + TTL cache of documents, stamped with their collection's version"""
+
+    def __init__(self, version_loader: Callable[[List[str]], Dict[str, str]],
+                 max_entries: int = ENTITY_CACHE_MAX_ENTRIES, ttl: float = ENTITY_CACHE_TTL,
+                 revalidate_seconds: float = ENTITY_CACHE_REVALIDATE_SECONDS):
+        self._load_versions = version_loader
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.revalidate_seconds = revalidate_seconds
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[Any, str, float]]" = OrderedDict()
+        self._versions: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._version_checks = 0
+
+    def _count(self, collection: str, field: str):
+        counters = self._stats.setdefault(collection, {'hits': 0, 'misses': 0, 'stale': 0, 'invalidations': 0})
+        counters[field] += 1
+
+    def _current_version(self, collection: str) -> Optional[str]:
+        """The collection's version, re-read from MongoDB at most every revalidate_seconds"""
+        now = time.monotonic()
+        with self._lock:
+            known = self._versions.get(collection)
+            if known and now - known[1] < self.revalidate_seconds:
+                return known[0]
+        try:
+            version = self._load_versions([collection])[collection]
+        except Exception as e:
+            print(f"[EntityCache] Version lookup failed, bypassing cache: {e}")
+            return None
+        with self._lock:
+            self._versions[collection] = (version, now)
+            self._version_checks += 1
+        return version
+
+    def get_or_load(self, collection: str, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return a cached copy of the value for key, calling loader on a miss.
+
+        None results are not cached. Callers get their own copy and may mutate it.
+        """
+        if not ENTITY_CACHE_ENABLED:
+            return loader()
+        version = self._current_version(collection)
+        if version is None:
+            return loader()
+
+        now = time.monotonic()
+        cache_key = (collection, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if entry[1] == version and entry[2] > now:
+                    self._entries.move_to_end(cache_key)
+                    self._count(collection, 'hits')
+                    return copy.deepcopy(entry[0])
+                del self._entries[cache_key]
+                self._count(collection, 'stale')
+            self._count(collection, 'misses')
+
+        # Stamped with the version read before loading: a write racing the load bumps
+        # the version, so the entry is discarded on its next lookup
+        value = loader()
+        if value is not None:
+            with self._lock:
+                self._entries[cache_key] = (copy.deepcopy(value), version, now + self.ttl)
+                self._entries.move_to_end(cache_key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, collection: str):
+        """Drop a collection's entries after a write in this process"""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[cache_key]
+            # Forget the version too, so an entry filled by a load racing this write is not trusted
+            self._versions.pop(collection, None)
+            self._count(collection, 'invalidations')
+
+    def clear(self):
+        """Drop every cached document"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters for this process, per collection"""
+        with self._lock:
+            collections = {name: dict(c) for name, c in self._stats.items()}
+            entries = len(self._entries)
+            version_checks = self._version_checks
+        hits = sum(c['hits'] for c in collections.values())
+        misses = sum(c['misses'] for c in collections.values())
+        return {
+            "enabled": ENTITY_CACHE_ENABLED,
+            "hits": hits,
+            "misses": misses,
+            "hitRate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "entries": entries,
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl,
+            "revalidateSeconds": self.revalidate_seconds,
+            "versionChecks": version_checks,
+            "collections": collections,
+        }
@@ -0,0 +1,208 @@
+"""
+Local end-of-term attendance forecasts computed with NumPy.
+
+Every student of a course is fitted at once from the students x sessions
+presence matrix (see analytics.build_presence_matrix):
+
+- an EWMA of recent presence, started from the course-wide rate, estimates how
+  likely the student is to attend each remaining session;
+- a ridge-regularized logistic regression on session position gives the trend;
+- the projected final percentage gets a confidence band from the binomial
+  spread of the remaining sessions plus the uncertainty of the rate itself.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import analytics
+
+FORECAST_EWMA_ALPHA = float(os.getenv('FORECAST_EWMA_ALPHA', '0.3'))
+# Sessions in a term when the course does not say (course.plannedSessions)
+FORECAST_TERM_SESSIONS = int(os.getenv('FORECAST_TERM_SESSIONS', '40'))
+FORECAST_THRESHOLD = float(os.getenv('FORECAST_THRESHOLD', str(analytics.GOOD_THRESHOLD)))
+# z-score of the confidence band; 1.2816 is a two-sided 80% interval
+FORECAST_BAND_Z = float(os.getenv('FORECAST_BAND_Z', '1.2816'))
+# Fewest sessions a student forecast is made from
+PREDICTION_MIN_SESSIONS = int(os.getenv('PREDICTION_MIN_SESSIONS', '5'))
+
+# A change in attendance probability across the term smaller than this counts as steady
+TREND_STEADY_DELTA = 0.1
+LOGISTIC_ITERATIONS = 8
+LOGISTIC_RIDGE = 1.0
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def ewma_rates(matrix: np.ndarray, prior: float, alpha: float = FORECAST_EWMA_ALPHA) -> np.ndarray:
+    """Exponentially weighted presence rate per student, starting from prior"""
+    n_sessions = matrix.shape[1]
+    decay = (1.0 - alpha) ** np.arange(n_sessions - 1, -1, -1)
+    return prior * (1.0 - alpha) ** n_sessions + matrix @ (alpha * decay)
+
+
+def effective_sessions(n_sessions: int, alpha: float = FORECAST_EWMA_ALPHA) -> float:
+    """Kish effective sample size of the EWMA weights (how many sessions the rate really rests on)"""
+    if n_sessions == 0:
+        return 0.0
+    weights = alpha * (1.0 - alpha) ** np.arange(n_sessions)
+    return float(weights.sum() ** 2 / (weights ** 2).sum())
+
+
+def logistic_trends(matrix: np.ndarray, prior: float) -> np.ndarray:
+    """Fitted change in attendance probability from the first to the latest session, per student.
+
+    Fits logit(p) = b0 + b1 * t with t in [0, 1] for every row at once using
+    Newton steps; ridge terms pull b0 toward the course rate and b1 toward 0 so
+    rows that are all present or all absent stay finite.
+    """
+    n_students, n_sessions = matrix.shape
+    if n_sessions < 2:
+        return np.zeros(n_students)
+    t = np.linspace(0.0, 1.0, n_sessions)
+    y = matrix.astype(float)
+    prior_logit = float(np.log(np.clip(prior, 0.01, 0.99) / (1.0 - np.clip(prior, 0.01, 0.99))))
+    b0 = np.full(n_students, prior_logit)
+    b1 = np.zeros(n_students)
+    for _ in range(LOGISTIC_ITERATIONS):
+        p = _sigmoid(b0[:, None] + b1[:, None] * t)
+        residual = y - p
+        w = p * (1.0 - p)
+        g0 = residual.sum(axis=1) - LOGISTIC_RIDGE * (b0 - prior_logit)
+        g1 = residual @ t - LOGISTIC_RIDGE * b1
+        h00 = w.sum(axis=1) + LOGISTIC_RIDGE
+        h01 = w @ t
+        h11 = w @ (t * t) + LOGISTIC_RIDGE
+        det = h00 * h11 - h01 * h01
+        b0 = b0 + (h11 * g0 - h01 * g1) / det
+        b1 = b1 + (h00 * g1 - h01 * g0) / det
+    return _sigmoid(b0 + b1) - _sigmoid(b0)
+
+
+def forecast_matrix(matrix: np.ndarray, remaining: int, threshold: float = FORECAST_THRESHOLD,
+                    prior: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """Vectorized forecast for every row of a presence matrix.
+
+    ``remaining`` is the number of sessions still to be held; ``threshold`` is
+    the attendance percentage the absences budget is measured against.
+    """
+    n_students, n_sessions = matrix.shape
+    present = matrix.sum(axis=1).astype(float)
+    if prior is None:
+        prior = float(matrix.mean()) if matrix.size else 1.0
+    rate = ewma_rates(matrix, prior) if n_sessions else np.full(n_students, prior)
+    total = n_sessions + remaining
+
+    expected = present + rate * remaining
+    # Binomial spread of the remaining sessions plus the uncertainty of the rate estimate
+    rate_variance = rate * (1.0 - rate) / (effective_sessions(n_sessions) + 1.0)
+    spread = np.sqrt(remaining * rate * (1.0 - rate) + remaining ** 2 * rate_variance)
+    scale = 100.0 / total if total else 0.0
+    current = present / n_sessions * 100.0 if n_sessions else np.full(n_students, 100.0)
+
+    # Most sessions that can still be missed while finishing at or above the threshold
+    slack = np.floor(present + remaining - threshold / 100.0 * total + 1e-9)
+    return {
+        "currentPercentage": current,
+        "projectedPercentage": expected * scale if total else current,
+        "low": np.clip((expected - FORECAST_BAND_Z * spread) * scale, present * scale, (present + remaining) * scale) if total else current,
+        "high": np.clip((expected + FORECAST_BAND_Z * spread) * scale, present * scale, (present + remaining) * scale) if total else current,
+        "recentRate": rate * 100.0,
+        "trendDelta": logistic_trends(matrix, prior) * 100.0,
+        "absencesAllowed": np.clip(slack, 0, remaining).astype(int),
+        "canReachThreshold": slack >= 0,
+        "present": present.astype(int),
+    }
+
+
+def trend_label(delta: float) -> str:
+    """Word for a fitted change in attendance probability (in percentage points)"""
+    if abs(delta) < TREND_STEADY_DELTA * 100.0:
+        return 'steady'
+    return 'improving' if delta > 0 else 'declining'
+
+
+def remaining_sessions(course: Dict, held: int) -> int:
+    """Sessions still to come, from the course's plannedSessions or FORECAST_TERM_SESSIONS"""
+    planned = course.get('plannedSessions') or FORECAST_TERM_SESSIONS
+    try:
+        planned = int(planned)
+    except (TypeError, ValueError):
+        planned = FORECAST_TERM_SESSIONS
+    return max(0, planned - held)
+
+
+def _student_rows(result: Dict[str, np.ndarray], n_sessions: int, remaining: int) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(len(result['present'])):
+        delta = float(result['trendDelta'][i])
+        rows.append({
+            "sessions": n_sessions,
+            "present": int(result['present'][i]),
+            "remainingSessions": remaining,
+            "currentPercentage": round(float(result['currentPercentage'][i]), 1),
+            "projectedPercentage": round(float(result['projectedPercentage'][i]), 1),
+            "confidenceBand": [round(float(result['low'][i]), 1), round(float(result['high'][i]), 1)],
+            "recentRate": round(float(result['recentRate'][i]), 1),
+            "trend": trend_label(delta),
+            "trendDelta": round(delta, 1),
+            "absencesAllowed": int(result['absencesAllowed'][i]),
+            "canReachThreshold": bool(result['canReachThreshold'][i]),
+        })
+    return rows
+
+
+def forecast_student(presence: List[bool], remaining: int, threshold: float = FORECAST_THRESHOLD,
+                     prior: Optional[float] = None) -> Dict[str, Any]:
+    """Forecast for one student's presence series, oldest session first"""
+    matrix = np.array([presence], dtype=bool).reshape(1, len(presence))
+    result = forecast_matrix(matrix, remaining, threshold, prior)
+    return {**_student_rows(result, len(presence), remaining)[0], "threshold": threshold}
+
+
+def forecast_course(course: Dict, students: List[Dict], records: List[Dict],
+                    threshold: float = FORECAST_THRESHOLD, remaining: Optional[int] = None) -> Dict[str, Any]:
+    """Forecast every enrolled student of a course, most at risk first"""
+    students_by_id = {s['id']: s for s in students if s.get('id')}
+    enrolled_ids = [sid for sid in course.get('studentIds', []) if sid in students_by_id]
+    matrix, dates = analytics.build_presence_matrix(enrolled_ids, records)
+    held = matrix.shape[1]
+    if remaining is None:
+        remaining = remaining_sessions(course, held)
+
+    rows = _student_rows(forecast_matrix(matrix, remaining, threshold), held, remaining)
+    for sid, row in zip(enrolled_ids, rows):
+        row.update({
+            "id": sid,
+            "name": students_by_id[sid].get('name', ''),
+            "studentId": students_by_id[sid].get('studentId', ''),
+        })
+    rows.sort(key=lambda row: (row['projectedPercentage'], row['name']))
+    return {
+        "courseId": course.get('id'),
+        "courseName": course.get('name', ''),
+        "threshold": threshold,
+        "sessionsHeld": held,
+        "remainingSessions": remaining,
+        "lastSession": dates[-1] if dates else None,
+        "atRisk": [row for row in rows if row['projectedPercentage'] < threshold],
+        "students": rows,
+    }
+
+
+def describe(forecast: Dict[str, Any], course_name: str = 'this course') -> str:
+    """Two plain sentences summarizing a student forecast"""
+    low, high = forecast['confidenceBand']
+    first = (f"If the current pattern continues, attendance in {course_name} should finish around "
+             f"{forecast['projectedPercentage']:.0f}% (likely between {low:.0f}% and {high:.0f}%).")
+    if not forecast['canReachThreshold']:
+        second = f"Even perfect attendance from here cannot reach {forecast['threshold']:.0f}%, but every session attended still raises the final figure."
+    elif forecast['remainingSessions'] == 0:
+        second = f"The term's sessions are complete, and attendance is {forecast['trend']} at {forecast['currentPercentage']:.0f}%."
+    else:
+        second = (f"Attendance is {forecast['trend']} ({forecast['recentRate']:.0f}% recently), and up to "
+                  f"{forecast['absencesAllowed']} of the remaining {forecast['remainingSessions']} sessions can be missed "
+                  f"while staying at or above {forecast['threshold']:.0f}%.")
+    return f"{first} {second}"
@@ -0,0 +1,295 @@
+"""
+Gemini client shared by the Flask apps.
+
+Calls run on a bounded thread pool with a per-call deadline. Concurrent
+identical prompts are coalesced into a single upstream request, and
+responses go through the shared response cache (see ai_cache.py).
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+import google.generativeai as genai
+
+import ai_cache
+
+# Load environment variables
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash')
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+GEMINI_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', '64'))
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '25'))
+
+if not GEMINI_API_KEY:
+    raise RuntimeError('GEMINI_API_KEY is not set. Add it to backend/.env or your environment.')
+
+genai.configure(api_key=GEMINI_API_KEY)
+gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+
+
+class GeminiUnavailableError(Exception):
+    """Raised when Gemini cannot answer in time or the client is saturated"""
+
+
+class GeminiTimeoutError(GeminiUnavailableError):
+    """Raised when a call misses its deadline"""
+
+
+class GeminiOverloadedError(GeminiUnavailableError):
+    """Raised when too many calls are already queued"""
+
+
+def extract_text(response) -> str:
+    """Collect the generated text from a Gemini response"""
+    text_response = ''
+
+    # Extract text from candidates - handle empty parts list properly
+    for candidate in getattr(response, 'candidates', []) or []:
+        content = getattr(candidate, 'content', None)
+        if not content:
+            continue
+        parts = getattr(content, 'parts', []) or []
+        for part in parts:
+            part_text = getattr(part, 'text', '')
+            if part_text:
+                text_response += part_text
+        if text_response:
+            break
+
+    # Fallback to response.text if available
+    if not text_response:
+        try:
+            text_response = response.text or ''
+        except Exception:
+            pass
+
+    if not text_response:
+        print(f"[Gemini] Empty response. Candidates: {len(getattr(response, 'candidates', []))}")
+        if hasattr(response, 'candidates') and response.candidates:
+            for i, cand in enumerate(response.candidates):
+                print(f"[Gemini] Candidate {i} finish_reason: {getattr(cand, 'finish_reason', 'unknown')}")
+        raise Exception('Received empty response from Gemini')
+
+    return text_response.strip()
+
+
+def extract_json_block(response_text: str) -> Dict[str, Any]:
+    """Parse a JSON object from a model response, tolerating markdown code fences"""
+    if '```json' in response_text:
+        json_str = response_text.split('```json')[1].split('```')[0].strip()
+    elif '```' in response_text:
+        json_str = response_text.split('```')[1].split('```')[0].strip()
+    else:
+        json_str = response_text.strip()
+    return json.loads(json_str)
+
+
+class GeminiClient:
+    """Bounded, deadline-aware Gemini client with single-flight request coalescing"""
+
+    def __init__(self, model=None, max_workers: int = GEMINI_MAX_CONCURRENCY,
+                 max_queue: int = GEMINI_MAX_QUEUE, default_timeout: float = GEMINI_TIMEOUT):
+        self.model = model or gemini_model
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemini')
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        # Streaming calls run on the request thread but count against the same concurrency limit
+        self._stream_slots = threading.BoundedSemaphore(max_workers)
+        self._streaming = 0
+        self._pending = 0
+        self._running = 0
+        self._metrics = {
+            'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0,
+            'timeouts': 0, 'rejected': 0, 'maxQueueDepth': 0,
+            'streamsStarted': 0, 'streamsCancelled': 0,
+        }
+
+    def _generate(self, prompt: str, temperature: float, max_tokens: int, timeout: float) -> str:
+        """Run one upstream call on a pool thread"""
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            print(f"[Gemini] Calling model {GEMINI_MODEL} with prompt length: {len(prompt)} chars")
+            response = self.model.generate_content(
+                prompt,
+                generation_config=genai.GenerationConfig(
+                    temperature=temperature,
+                    max_output_tokens=max_tokens,
+                ),
+                request_options={'timeout': timeout},
+            )
+            text_response = extract_text(response)
+            print(f"[Gemini] Response received: {len(text_response)} chars in {time.perf_counter() - started:.2f}s")
+            with self._lock:
+                self._metrics['completed'] += 1
+            return text_response
+        except Exception:
+            with self._lock:
+                self._metrics['failed'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def submit(self, key: str, prompt: str, temperature: float, max_tokens: int,
+               timeout: Optional[float] = None) -> Future:
+        """Start (or join) the upstream call for key and return its future"""
+        timeout = timeout or self.default_timeout
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._metrics['coalesced'] += 1
+                return future
+            if self._pending >= self.max_queue:
+                self._metrics['rejected'] += 1
+                raise GeminiOverloadedError('Gemini request queue is full, try again shortly')
+            self._pending += 1
+            self._metrics['submitted'] += 1
+            self._metrics['maxQueueDepth'] = max(self._metrics['maxQueueDepth'], self._pending)
+            future = self._executor.submit(self._generate, prompt, temperature, max_tokens, timeout)
+            self._inflight[key] = future
+
+        def _forget(done: Future):
+            with self._lock:
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+        future.add_done_callback(_forget)
+        return future
+
+    def generate(self, prompt: str, temperature: float = 0.2, max_tokens: int = 1024,
+                 endpoint: str = 'default', timeout: Optional[float] = None) -> str:
+        """Return generated text, served from cache, a shared in-flight call or a new call"""
+        key = ai_cache.make_key(GEMINI_MODEL, prompt, temperature, max_tokens)
+        ttl = ai_cache.ttl_for(endpoint)
+        use_cache = ai_cache.AI_CACHE_ENABLED and ttl > 0
+        if use_cache:
+            cached = ai_cache.response_cache.get(key, endpoint)
+            if cached is not None:
+                return cached
+
+        deadline = timeout or self.default_timeout
+        future = self.submit(key, prompt, temperature, max_tokens, deadline)
+        try:
+            text_response = future.result(timeout=deadline)
+        except FutureTimeoutError:
+            with self._lock:
+                self._metrics['timeouts'] += 1
+            raise GeminiTimeoutError(f"Gemini did not respond within {deadline:.0f}s")
+
+        if use_cache:
+            ai_cache.response_cache.set(key, text_response, ttl)
+        return text_response
+
+    def stream(self, prompt: str, temperature: float = 0.2, max_tokens: int = 1024,
+               endpoint: str = 'default', timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield text chunks as Gemini generates them; closing the iterator abandons the upstream stream"""
+        key = ai_cache.make_key(GEMINI_MODEL, prompt, temperature, max_tokens)
+        ttl = ai_cache.ttl_for(endpoint)
+        use_cache = ai_cache.AI_CACHE_ENABLED and ttl > 0
+        if use_cache:
+            cached = ai_cache.response_cache.get(key, endpoint)
+            if cached is not None:
+                yield cached
+                return
+
+        deadline = timeout or self.default_timeout
+        if not self._stream_slots.acquire(timeout=deadline):
+            with self._lock:
+                self._metrics['rejected'] += 1
+            raise GeminiOverloadedError('Gemini is busy, try again shortly')
+
+        with self._lock:
+            self._metrics['streamsStarted'] += 1
+            self._streaming += 1
+        chunks = []
+        finished = False
+        try:
+            print(f"[Gemini] Streaming model {GEMINI_MODEL} with prompt length: {len(prompt)} chars")
+            response = self.model.generate_content(
+                prompt,
+                generation_config=genai.GenerationConfig(
+                    temperature=temperature,
+                    max_output_tokens=max_tokens,
+                ),
+                stream=True,
+                request_options={'timeout': deadline},
+            )
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except Exception:
+                    # Chunks without text parts (e.g. safety metadata) are skipped
+                    continue
+                if text:
+                    chunks.append(text)
+                    yield text
+            finished = True
+        except GeneratorExit:
+            with self._lock:
+                self._metrics['streamsCancelled'] += 1
+            print("[Gemini] Stream cancelled by client")
+            raise
+        except Exception:
+            with self._lock:
+                self._metrics['failed'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._streaming -= 1
+            self._stream_slots.release()
+
+        text_response = ''.join(chunks).strip()
+        if not text_response:
+            raise Exception('Received empty response from Gemini')
+        with self._lock:
+            self._metrics['completed'] += 1
+        if finished and use_cache:
+            ai_cache.response_cache.set(key, text_response, ttl)
+
+    def stats(self) -> Dict:
+        """Return pool and queue metrics for this process"""
+        with self._lock:
+            return {
+                **self._metrics,
+                'queueDepth': self._pending,
+                'running': self._running,
+                'streaming': self._streaming,
+                'inFlightKeys': len(self._inflight),
+                'maxWorkers': self._max_workers,
+                'maxQueue': self.max_queue,
+                'timeoutSeconds': self.default_timeout,
+            }
+
+
+gemini_client = GeminiClient()
+
+
+def call_gemini(prompt: str, temperature: float = 0.2, max_tokens: int = 1024,
+                endpoint: str = 'default', timeout: Optional[float] = None) -> str:
+    """Call Gemini API and return the generated text"""
+    try:
+        return gemini_client.generate(prompt, temperature, max_tokens, endpoint, timeout)
+    except GeminiUnavailableError as e:
+        print(f"[Gemini] Unavailable: {e}")
+        raise
+    except Exception as e:
+        print(f"[Gemini] Error: {e}")
+        raise Exception(f"Failed to call Gemini: {str(e)}")
+
+
+def stream_gemini(prompt: str, temperature: float = 0.2, max_tokens: int = 1024,
+                  endpoint: str = 'default', timeout: Optional[float] = None) -> Iterator[str]:
+    """Stream generated text chunks from Gemini"""
+    return gemini_client.stream(prompt, temperature, max_tokens, endpoint, timeout)
@@ -0,0 +1,260 @@
+"""
+Precomputed AI insights for student dashboards.
+
+Each student's summary, per-course goals and per-course prediction text are
+stored in the student_insights collection, stamped with a digest of the
+student's attendance counts. A background scheduler regenerates only the
+students whose digest changed, with one Gemini call per student per cycle.
+Dashboards read the stored copy. When attendance has changed since it was
+generated, the copy is served with "stale": true.
+
+One worker runs each cycle: the scheduler in every gunicorn worker competes
+for a lease document in the locks collection.
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import database as db
+import forecast
+from gemini_client import call_gemini, extract_json_block
+
+INSIGHTS_SCHEDULER_ENABLED = os.getenv('INSIGHTS_SCHEDULER_ENABLED', 'true').lower() == 'true'
+INSIGHTS_REFRESH_SECONDS = int(os.getenv('INSIGHTS_REFRESH_SECONDS', '900'))
+# Upper bound on Gemini calls per cycle; the remaining changed students wait for the next cycle
+INSIGHTS_MAX_PER_CYCLE = int(os.getenv('INSIGHTS_MAX_PER_CYCLE', '200'))
+INSIGHTS_CONCURRENCY = int(os.getenv('INSIGHTS_CONCURRENCY', '4'))
+# Delay before a worker's first cycle, so startup is not slowed down
+INSIGHTS_STARTUP_DELAY = float(os.getenv('INSIGHTS_STARTUP_DELAY', '30'))
+
+LEASE_NAME = 'student_insights'
+
+
+# ============= DIGESTS =============
+
+def stats_digest(name: str, rows: List[Dict]) -> str:
+    """Digest of what a student's insights are generated from: name and per-course counts"""
+    counts = sorted((row['courseId'], row.get('sessions', 0), row.get('present', 0)) for row in rows)
+    return hashlib.sha1(json.dumps([name, counts]).encode('utf-8')).hexdigest()
+
+
+def current_digests(student_ids: Optional[List[str]] = None) -> Dict[str, str]:
+    """Digest per student from attendance_stats, in two queries"""
+    query = {"studentId": {"$in": student_ids}} if student_ids is not None else {}
+    rows_by_student: Dict[str, List[Dict]] = {}
+    for row in db.db.attendance_stats.find(query, {"_id": 0, "studentId": 1, "courseId": 1, "sessions": 1, "present": 1}):
+        rows_by_student.setdefault(row['studentId'], []).append(row)
+    names = {
+        s['id']: s.get('name', '')
+        for s in db.db.students.find({"id": {"$in": list(rows_by_student)}}, {"_id": 0, "id": 1, "name": 1})
+    }
+    return {sid: stats_digest(names[sid], rows) for sid, rows in rows_by_student.items() if sid in names}
+
+
+# ============= GENERATION =============
+
+def _course_forecasts(student_id: str, courses: List[Dict]) -> Dict[str, Optional[Dict]]:
+    """Local forecast per course, or None where there are too few sessions"""
+    presence_by_course: Dict[str, List[bool]] = {}
+    for session in db.get_student_attendance(student_id):
+        presence_by_course.setdefault(session['courseId'], []).append(session['present'])
+    forecasts = {}
+    for course in courses:
+        presence = presence_by_course.get(course['courseId'], [])
+        if len(presence) < forecast.PREDICTION_MIN_SESSIONS:
+            forecasts[course['courseId']] = None
+            continue
+        remaining = forecast.remaining_sessions(db.get_course_by_id(course['courseId']) or {}, len(presence))
+        forecasts[course['courseId']] = forecast.forecast_student(presence, remaining)
+    return forecasts
+
+
+def generate_insights(student_id: str, digest: Optional[str] = None) -> Dict:
+    """Generate and store a student's insights with a single Gemini call; returns the stored document.
+
+    Raises LookupError for an unknown student. Gemini errors propagate and the
+    previous copy is kept.
+    """
+    student = db.get_student_by_id(student_id)
+    if not student:
+        raise LookupError("Student not found")
+    if digest is None:
+        digest = stats_digest(student.get('name', ''), db.get_attendance_stats(student_id))
+    name = student.get('name') or 'the student'
+
+    stats = db.get_student_attendance_stats(student_id)
+    forecasts = _course_forecasts(student_id, stats['courses'])
+    course_lines = []
+    for course in stats['courses']:
+        line = f"- [{course['courseId']}] {course['name']}: {course['percentage']}% ({course['present']} of {course['sessions']})"
+        result = forecasts[course['courseId']]
+        if result:
+            line += f"; projected end of term {result['projectedPercentage']}%, {result['trend']}"
+        course_lines.append(line)
+
+    prompt = f"""You are an encouraging academic advisor and coach. The figures below were computed exactly; do not change them.
+Student: {name}
+Overall Attendance: {stats['overallPercentage']}% ({stats['presentClasses']} of {stats['totalClasses']} classes)
+Courses:
+{chr(10).join(course_lines) or '- none yet'}
+
+Produce ONLY valid JSON (no explanatory text) matching this exact schema:
+{{
+  "summary": string,
+  "goals": {{"<course id in brackets above>": string}}
+}}
+"summary": a supportive summary of 2-3 sentences. Each goal: a realistic attendance goal for the next month in that course with 2-3 short actionable tips as a Markdown bulleted list, under 100 words."""
+
+    narrative = extract_json_block(call_gemini(
+        prompt, temperature=0.3, max_tokens=min(4096, 400 + 250 * len(course_lines)), endpoint='student_insights'
+    ))
+    goals = narrative.get('goals') or {}
+    now = datetime.utcnow()
+    document = {
+        "studentId": student_id,
+        "digest": digest,
+        "summary": str(narrative.get('summary') or '').strip(),
+        "overallPercentage": stats['overallPercentage'],
+        "courses": [{
+            "courseId": course['courseId'],
+            "name": course['name'],
+            "percentage": course['percentage'],
+            "goal": str(goals.get(course['courseId']) or '').strip() or None,
+            "prediction": forecast.describe(forecasts[course['courseId']], course['name']) if forecasts[course['courseId']] else None,
+            "forecast": forecasts[course['courseId']],
+        } for course in stats['courses']],
+        "generatedAt": now,
+        "lastError": None,
+    }
+    db.db.student_insights.update_one({"_id": student_id}, {"$set": document}, upsert=True)
+    return document
+
+
+def _record_failure(student_id: str, error: Exception):
+    db.db.student_insights.update_one(
+        {"_id": student_id},
+        {"$set": {"lastError": str(error), "lastErrorAt": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def get_insights(student_id: str) -> Optional[Dict]:
+    """Stored insights with a stale flag against the current attendance counts, or None"""
+    stored = db.db.student_insights.find_one({"_id": student_id}, {"_id": 0})
+    if not stored or not stored.get('generatedAt'):
+        return None
+    student = db.get_student_by_id(student_id) or {}
+    stored['stale'] = stored.get('digest') != stats_digest(student.get('name', ''), db.get_attendance_stats(student_id))
+    return stored
+
+
+def fresh_insights(student_id: str) -> Optional[Dict]:
+    """Stored insights only if attendance has not changed since they were generated"""
+    stored = get_insights(student_id)
+    return stored if stored and not stored['stale'] else None
+
+
+def refresh_student(student_id: str, force: bool = False) -> Dict:
+    """Regenerate one student's insights if their attendance changed (or always, with force)"""
+    if not force:
+        stored = fresh_insights(student_id)
+        if stored:
+            return stored
+    return {**generate_insights(student_id), "stale": False}
+
+
+# ============= SCHEDULER =============
+
+def run_cycle(max_students: int = INSIGHTS_MAX_PER_CYCLE, renew_lease=None) -> Dict:
+    """Regenerate insights for students whose attendance counts changed since their last generation"""
+    digests = current_digests()
+    stored = {doc['_id']: doc.get('digest') for doc in db.db.student_insights.find({}, {"digest": 1})}
+    changed = [sid for sid, digest in digests.items() if stored.get(sid) != digest]
+    batch = changed[:max_students]
+
+    def refresh(student_id: str) -> bool:
+        if renew_lease:
+            renew_lease()
+        try:
+            generate_insights(student_id, digests[student_id])
+            return True
+        except Exception as e:
+            print(f"[Insights] Could not refresh {student_id}: {e}")
+            _record_failure(student_id, e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=INSIGHTS_CONCURRENCY, thread_name_prefix='insights') as executor:
+        refreshed = sum(executor.map(refresh, batch))
+    removed = db.db.student_insights.delete_many({"_id": {"$nin": list(digests)}}).deleted_count
+    return {
+        "students": len(digests),
+        "changed": len(changed),
+        "refreshed": refreshed,
+        "failed": len(batch) - refreshed,
+        "deferred": len(changed) - len(batch),
+        "removed": removed,
+    }
+
+
+def acquire_lease(owner: str, seconds: float, renew: bool = False) -> bool:
+    """Take the cycle lease once it has expired, or extend our own with renew; False otherwise"""
+    now = datetime.utcnow()
+    held = {"owner": owner} if renew else {"expiresAt": {"$lt": now}}
+    try:
+        return db.db.locks.find_one_and_update(
+            {"_id": LEASE_NAME, **held},
+            {"$set": {"owner": owner, "expiresAt": now + timedelta(seconds=seconds)}},
+            upsert=not renew,
+            return_document=ReturnDocument.AFTER,
+        ) is not None
+    except DuplicateKeyError:
+        # The lease exists and has not expired yet
+        return False
+
+
+class InsightsScheduler:
+    """Background thread that runs a refresh cycle every interval on whichever worker holds the lease"""
+
+    def __init__(self, interval: float = INSIGHTS_REFRESH_SECONDS):
+        self.interval = interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_cycle: Optional[Dict] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='insights-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        if self._stop.wait(INSIGHTS_STARTUP_DELAY):
+            return
+        while not self._stop.is_set():
+            try:
+                # Held for a whole interval, so the cluster runs at most one cycle per interval
+                if acquire_lease(self.owner, self.interval):
+                    started = datetime.utcnow()
+                    result = run_cycle(renew_lease=lambda: acquire_lease(self.owner, self.interval, renew=True))
+                    self.last_cycle = {**result, "startedAt": started, "finishedAt": datetime.utcnow()}
+                    if result['changed']:
+                        print(f"[Insights] Refreshed {result['refreshed']} of {result['changed']} changed student(s)")
+            except Exception as e:
+                print(f"[Insights] Cycle failed: {e}")
+            self._stop.wait(min(self.interval, 60))
+
+
+scheduler = InsightsScheduler()
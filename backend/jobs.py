@@ -0,0 +1,169 @@
+"""
+Background jobs for slow AI report generation.
+
+Report endpoints enqueue a job and return its id at once. A small thread pool
+in the same process runs it, so gunicorn request threads stay free for
+attendance marking. Status and result live in the jobs collection, which any
+worker can read, and a TTL index on expiresAt deletes finished jobs after
+JOB_TTL_SECONDS. Clients poll GET /api/jobs/<id> every Retry-After seconds.
+?wait=N long-polls, but only briefly: a waiting poll holds a request thread.
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', '86400'))
+# Longest a single long-poll request is held; it occupies a gunicorn request thread meanwhile
+JOB_MAX_WAIT_SECONDS = float(os.getenv('JOB_MAX_WAIT_SECONDS', '3'))
+# How often a long-poll re-reads a job that runs in another worker process
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))
+# A pending job not updated for this long is taken to have died with its worker process
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '600'))
+
+PENDING_STATUSES = ('queued', 'running')
+
+
+def job_key(job_type: str, params: Dict) -> str:
+    """Identity of a job's work, so identical pending requests share one job"""
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return f"{job_type}:{hashlib.sha1(encoded.encode('utf-8')).hexdigest()}"
+
+
+def public_job(job: Dict) -> Dict[str, Any]:
+    """API view of a job document"""
+    return {
+        "id": job['_id'],
+        "type": job['type'],
+        "status": job['status'],
+        "params": job.get('params', {}),
+        "result": job.get('result'),
+        "error": job.get('error'),
+        "errorType": job.get('errorType'),
+        "createdAt": job.get('createdAt'),
+        "startedAt": job.get('startedAt'),
+        "finishedAt": job.get('finishedAt'),
+    }
+
+
+class JobQueue:
+    """Runs registered job types on a local thread pool and records them in MongoDB"""
+
+    def __init__(self, collection_getter: Callable[[], Any], workers: int = JOB_WORKERS):
+        self._collection = collection_getter
+        self._handlers: Dict[str, Callable[[Dict], Any]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        # Jobs running in this process, so local long-polls wake as soon as they finish
+        self._done_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(self, job_type: str, handler: Callable[[Dict], Any]):
+        """Register the function that runs a job type; it receives the job's params"""
+        self._handlers[job_type] = handler
+
+    @property
+    def job_types(self):
+        return sorted(self._handlers)
+
+    def enqueue(self, job_type: str, params: Dict) -> Dict[str, Any]:
+        """Queue a job and return it; an identical job still pending is returned instead"""
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        collection = self._collection()
+        now = datetime.utcnow()
+        key = job_key(job_type, params)
+        existing = collection.find_one({
+            "key": key,
+            "status": {"$in": list(PENDING_STATUSES)},
+            "updatedAt": {"$gte": now - timedelta(seconds=JOB_STALE_SECONDS)},
+        })
+        if existing:
+            return public_job(existing)
+
+        job = {
+            "_id": uuid.uuid4().hex,
+            "type": job_type,
+            "params": params,
+            "key": key,
+            "status": "queued",
+            "owner": self.owner,
+            "createdAt": now,
+            "updatedAt": now,
+            "expiresAt": now + timedelta(seconds=JOB_TTL_SECONDS),
+        }
+        collection.insert_one(job)
+        with self._lock:
+            self._done_events[job['_id']] = threading.Event()
+        self._executor.submit(self._run, job['_id'], job_type, params)
+        return public_job(job)
+
+    def _run(self, job_id: str, job_type: str, params: Dict):
+        collection = self._collection()
+        started = datetime.utcnow()
+        collection.update_one({"_id": job_id}, {"$set": {"status": "running", "startedAt": started, "updatedAt": started}})
+        try:
+            update = {"status": "done", "result": self._handlers[job_type](params)}
+        except Exception as e:
+            print(f"[Jobs] {job_type} job {job_id} failed: {e}")
+            update = {"status": "failed", "error": str(e), "errorType": type(e).__name__}
+        finished = datetime.utcnow()
+        update.update({
+            "finishedAt": finished,
+            "updatedAt": finished,
+            "durationMs": round((finished - started).total_seconds() * 1000),
+            "expiresAt": finished + timedelta(seconds=JOB_TTL_SECONDS),
+        })
+        try:
+            collection.update_one({"_id": job_id}, {"$set": update})
+        except Exception as e:
+            # e.g. a result too large to store; record the failure without it
+            print(f"[Jobs] Could not store result of {job_id}: {e}")
+            collection.update_one({"_id": job_id}, {"$set": {
+                "status": "failed", "error": f"Could not store result: {e}", "errorType": type(e).__name__,
+                "finishedAt": finished, "updatedAt": finished, "expiresAt": update['expiresAt'],
+            }})
+        with self._lock:
+            event = self._done_events.pop(job_id, None)
+        if event:
+            event.set()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a job, or None once it is unknown or expired"""
+        collection = self._collection()
+        job = collection.find_one({"_id": job_id})
+        if job is None:
+            return None
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        if job['status'] in PENDING_STATUSES and job.get('updatedAt') and job['updatedAt'] < cutoff:
+            # Its worker process went away (restart or crash) before finishing
+            now = datetime.utcnow()
+            collection.update_one(
+                {"_id": job_id, "status": job['status'], "updatedAt": job['updatedAt']},
+                {"$set": {"status": "failed", "error": "The job was interrupted by a server restart; submit it again.",
+                          "errorType": "Interrupted", "finishedAt": now, "updatedAt": now}},
+            )
+            job = collection.find_one({"_id": job_id}) or job
+        return public_job(job)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Return the job once it has finished or timeout seconds have passed (long-poll)"""
+        deadline = time.monotonic() + max(0.0, min(timeout, JOB_MAX_WAIT_SECONDS))
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] not in PENDING_STATUSES or remaining <= 0:
+                return job
+            with self._lock:
+                event = self._done_events.get(job_id)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(JOB_POLL_INTERVAL, remaining))
@@ -0,0 +1,84 @@
+"""
+Fast JSON encoding for API responses.
+
+orjson is used when installed, with the standard library as a fallback. Both
+encode ObjectId as its hex string and naive datetimes as ISO 8601 UTC.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator
+
+from bson import ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is slower but equivalent
+    orjson = None
+
+# Bytes per chunk when streaming a JSON array
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def encode_default(value: Any):
+    """Encode types the JSON encoders do not know natively"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat() + ('+00:00' if value.tzinfo is None else '')
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, 'tolist'):
+        # NumPy scalars and arrays from the analytics module
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(value: Any) -> bytes:
+        """Encode a value to UTF-8 JSON bytes"""
+        return orjson.dumps(value, default=encode_default, option=_ORJSON_OPTIONS)
+
+    def loads(data) -> Any:
+        """Decode JSON from str or bytes"""
+        return orjson.loads(data)
+else:
+    def dumps_bytes(value: Any) -> bytes:
+        """Encode a value to UTF-8 JSON bytes"""
+        return json.dumps(value, default=encode_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(data) -> Any:
+        """Decode JSON from str or bytes"""
+        return json.loads(data)
+
+
+def iter_json_array(items: Iterable[Any]) -> Iterator[bytes]:
+    """Encode an iterable as a JSON array, yielding it in chunks of about STREAM_CHUNK_BYTES"""
+    buffer = bytearray(b'[')
+    first = True
+    for item in items:
+        if not first:
+            buffer += b','
+        buffer += dumps_bytes(item)
+        first = False
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (see dumps_bytes)"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
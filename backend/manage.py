@@ -0,0 +1,136 @@
+"""
+Maintenance commands for the attendance backend.
+
+Usage:
+    python manage.py migrate [--list]
+    python manage.py migrate-photos
+    python manage.py dedupe-attendance [--dry-run]
+    python manage.py migrate-attendance-format --to bitset|ids
+    python manage.py rebuild-attendance-stats [--course <id> ...]
+    python manage.py refresh-insights [--student <id> ...] [--force]
+"""
+import argparse
+import sys
+
+import database as db
+
+
+def cmd_migrate(args) -> int:
+    """List or apply schema and index migrations"""
+    import migrations
+
+    if args.list:
+        applied = migrations.applied_migrations(db.get_db())
+        for name, description, _ in migrations.MIGRATIONS:
+            entry = applied.get(name)
+            status = f"applied {entry['appliedAt']:%Y-%m-%d %H:%M}" if entry else 'pending'
+            print(f"{name:32} {status:24} {description}")
+        return 0
+    report = migrations.run_migrations(db.get_db(), on_change=db.bump_version)
+    if not report:
+        print("✓ Schema is up to date")
+    failed = [entry for entry in report if entry['status'] == 'failed']
+    for entry in failed:
+        print(f"❌ {entry['name']}: {entry['error']}")
+    return 1 if failed else 0
+
+
+def cmd_migrate_photos(args) -> int:
+    """Move inline student photos into the photo store"""
+    import photos
+
+    moved = photos.migrate_inline_photos(batch_size=args.batch_size)
+    print(f"✓ Moved {moved} inline photo(s) to the {photos.PHOTO_STORE} photo store")
+    return 0
+
+
+def cmd_dedupe_attendance(args) -> int:
+    """Merge duplicate attendance sessions and make (courseId, date) unique"""
+    result = db.merge_duplicate_attendance(dry_run=args.dry_run)
+    verb = 'Would remove' if args.dry_run else 'Removed'
+    print(f"✓ {verb} {result['removed']} duplicate record(s) across {result['groups']} course/date pair(s)")
+    if not args.dry_run and not result['uniqueIndex']:
+        print("❌ Unique (courseId, date) index could not be created")
+        return 1
+    return 0
+
+
+def cmd_migrate_attendance_format(args) -> int:
+    """Rewrite attendance presence as roster bitmaps or id arrays"""
+    converted = db.convert_attendance_storage(args.to, batch_size=args.batch_size)
+    print(f"✓ Converted {converted} attendance record(s) to the {args.to} format")
+    if args.to != db.ATTENDANCE_STORAGE:
+        print(f"⚠️  ATTENDANCE_STORAGE is '{db.ATTENDANCE_STORAGE}'; set it to '{args.to}' so new writes use the same format")
+    return 0
+
+
+def cmd_rebuild_attendance_stats(args) -> int:
+    """Regenerate the per-student, per-course attendance counters from the records"""
+    result = db.rebuild_attendance_stats(args.course)
+    print(f"✓ Rebuilt {result['stats']} attendance stat row(s) across {result['courses']} course(s)")
+    return 0
+
+
+def cmd_refresh_insights(args) -> int:
+    """Regenerate stored student insights whose attendance changed (one Gemini call per student)"""
+    import insights
+
+    if not args.student:
+        result = insights.run_cycle()
+        print(f"✓ Refreshed {result['refreshed']} of {result['changed']} changed student(s); "
+              f"{result['failed']} failed, {result['deferred']} deferred to the next cycle")
+        return 1 if result['failed'] else 0
+    failed = 0
+    for student_id in args.student:
+        try:
+            insights.refresh_student(student_id, force=args.force)
+            print(f"✓ {student_id}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {student_id}: {e}")
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='IIIT-NR Attendance backend maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate = subparsers.add_parser('migrate', help='Apply pending schema and index migrations')
+    migrate.add_argument('--list', action='store_true', help='Show applied and pending migrations')
+    migrate.set_defaults(func=cmd_migrate)
+
+    migrate_photos = subparsers.add_parser('migrate-photos', help='Move inline student photos to GridFS or the filesystem store')
+    migrate_photos.add_argument('--batch-size', type=int, default=100)
+    migrate_photos.set_defaults(func=cmd_migrate_photos)
+
+    dedupe_attendance = subparsers.add_parser('dedupe-attendance', help='Merge duplicate (courseId, date) attendance records')
+    dedupe_attendance.add_argument('--dry-run', action='store_true', help='Report duplicates without changing anything')
+    dedupe_attendance.set_defaults(func=cmd_dedupe_attendance)
+
+    migrate_format = subparsers.add_parser('migrate-attendance-format', help='Convert attendance presence between id arrays and roster bitmaps')
+    migrate_format.add_argument('--to', choices=('bitset', 'ids'), required=True)
+    migrate_format.add_argument('--batch-size', type=int, default=500)
+    migrate_format.set_defaults(func=cmd_migrate_attendance_format)
+
+    rebuild_stats = subparsers.add_parser('rebuild-attendance-stats', help='Regenerate attendance_stats from attendance records')
+    rebuild_stats.add_argument('--course', action='append', help='Only rebuild this course (repeatable)')
+    rebuild_stats.set_defaults(func=cmd_rebuild_attendance_stats)
+
+    refresh_insights = subparsers.add_parser('refresh-insights', help='Regenerate stored AI insights for students whose attendance changed')
+    refresh_insights.add_argument('--student', action='append', help='Only refresh this student (repeatable)')
+    refresh_insights.add_argument('--force', action='store_true', help='With --student, regenerate even if attendance is unchanged')
+    refresh_insights.set_defaults(func=cmd_refresh_insights)
+
+    args = parser.parse_args(argv)
+    if args.command == 'migrate':
+        # Report what this command applies instead of migrating silently while connecting
+        db.MIGRATE_ON_START = False
+
+    if not db.init_db():
+        print("❌ Cannot continue without a MongoDB connection")
+        return 1
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
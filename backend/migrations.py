@@ -0,0 +1,144 @@
+"""
+Versioned schema and index migrations.
+
+Migrations run in order at startup (see database.init_db) or with
+``python manage.py migrate``. Each applied migration is recorded in the
+schema_migrations collection and never runs again. Every step is idempotent,
+so workers starting at the same time may safely run the same step twice.
+"""
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Collections whose documents are addressed by the application-level "id" field
+ID_COLLECTIONS = ('students', 'courses', 'attendance_records')
+
+ID_INDEX = "id_1"
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+class MigrationError(Exception):
+    """Raised when a migration cannot be applied until the data is fixed"""
+
+
+def backfill_ids(database) -> Dict:
+    """Give every document without an id the hex string of its _id, one server-side update per collection"""
+    missing = {"$or": [{"id": {"$exists": False}}, {"id": None}, {"id": ""}]}
+    # updatedAt moves so delta-sync clients fetch the documents again, now with their ids
+    backfill = [{"$set": {"id": {"$toString": "$_id"}, "updatedAt": datetime.utcnow()}}]
+    modified = {
+        collection: database[collection].update_many(missing, backfill).modified_count
+        for collection in ID_COLLECTIONS
+    }
+    return {"modified": modified, "changed": [collection for collection, count in modified.items() if count]}
+
+
+def create_unique_id_indexes(database) -> Dict:
+    """Index id uniquely on every collection addressed by id"""
+    for collection in ID_COLLECTIONS:
+        existing = database[collection].index_information().get(ID_INDEX)
+        if existing and existing.get('unique'):
+            continue
+        duplicates = list(database[collection].aggregate([
+            {"$group": {"_id": "$id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": 5},
+        ], allowDiskUse=True))
+        if duplicates:
+            # Keep lookups indexed meanwhile; the unique index is retried on the next run
+            if not existing:
+                database[collection].create_index("id", name=ID_INDEX)
+            sample = ', '.join(str(d['_id']) for d in duplicates)
+            raise MigrationError(f"{collection} has documents sharing an id (e.g. {sample}); give them distinct ids and restart")
+        if existing:
+            database[collection].drop_index(ID_INDEX)
+        database[collection].create_index("id", name=ID_INDEX, unique=True)
+    return {"indexed": list(ID_COLLECTIONS)}
+
+
+def attendance_date_values(database) -> Dict:
+    """Store each session's YYYY-MM-DD date as a datetime and index it for per-student range queries"""
+    updated = 0
+    unparsed = 0
+    operations = []
+    cursor = database.attendance_records.find(
+        {"dateValue": {"$exists": False}}, {"_id": 1, "date": 1}
+    ).batch_size(BACKFILL_BATCH_SIZE)
+    for record in cursor:
+        try:
+            value = datetime.strptime(record.get('date') or '', '%Y-%m-%d')
+        except ValueError:
+            value = None
+            unparsed += 1
+        operations.append(UpdateOne({"_id": record['_id']}, {"$set": {"dateValue": value}}))
+        if len(operations) >= BACKFILL_BATCH_SIZE:
+            updated += database.attendance_records.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += database.attendance_records.bulk_write(operations, ordered=False).modified_count
+
+    # Multikey: one entry per present student and session, for "which sessions did X attend"
+    database.attendance_records.create_index([("presentStudentIds", 1), ("dateValue", 1)])
+    # Sessions of a course in a date range, and bitset records that have no id array to index
+    database.attendance_records.create_index([("courseId", 1), ("dateValue", 1)])
+    return {"updated": updated, "unparsed": unparsed, "changed": ['attendance_records'] if updated else []}
+
+
+# (name, description, function) in the order they must be applied; never renumber or remove entries
+MIGRATIONS: List[Tuple[str, str, Callable]] = [
+    ("0001_backfill_ids", "Backfill missing id fields from _id", backfill_ids),
+    ("0002_unique_id_indexes", "Unique id index on students, courses and attendance_records", create_unique_id_indexes),
+    ("0003_attendance_date_values", "Datetime dateValue on attendance records with student and course range indexes", attendance_date_values),
+]
+
+
+def applied_migrations(database) -> Dict[str, Dict]:
+    """Recorded migrations by name"""
+    return {entry['_id']: entry for entry in database.schema_migrations.find()}
+
+
+def pending_migrations(database) -> List[str]:
+    """Names of migrations not yet applied, in order"""
+    done = applied_migrations(database)
+    return [name for name, _, _ in MIGRATIONS if name not in done]
+
+
+def run_migrations(database, on_change: Optional[Callable[[str], None]] = None) -> List[Dict]:
+    """Apply pending migrations in order, stopping at the first that fails.
+
+    A migration lists the collections it rewrote under "changed" in its result;
+    on_change (database.bump_version) is called for each, so ETags and cached
+    documents from before the migration are invalidated.
+    Returns one entry per migration attempted: {name, status, result|error}.
+    """
+    done = applied_migrations(database)
+    report = []
+    for name, description, migrate in MIGRATIONS:
+        if name in done:
+            continue
+        started = time.perf_counter()
+        try:
+            result = migrate(database)
+        except (MigrationError, OperationFailure) as e:
+            print(f"[Migrations] {name} not applied: {e}")
+            report.append({"name": name, "status": "failed", "error": str(e)})
+            break
+        duration_ms = round((time.perf_counter() - started) * 1000)
+        if on_change:
+            for collection in (result or {}).get('changed', []):
+                on_change(collection)
+        try:
+            database.schema_migrations.insert_one({
+                "_id": name, "description": description,
+                "appliedAt": datetime.utcnow(), "durationMs": duration_ms, "result": result,
+            })
+        except DuplicateKeyError:
+            # Another worker finished the same step first
+            pass
+        print(f"[Migrations] Applied {name} in {duration_ms} ms")
+        report.append({"name": name, "status": "applied", "result": result})
+    return report
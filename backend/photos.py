@@ -0,0 +1,255 @@
+"""
+Student photo storage.
+
+Photos are kept out of the students collection: the original upload and
+resized variants live in GridFS (or on the local filesystem for tests and
+single-machine setups) and are served by URL with long-lived caching.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import gridfs
+
+import database as db
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it only the original size is served
+    Image = None
+
+PHOTO_STORE = os.getenv('PHOTO_STORE', 'gridfs')
+PHOTO_STORE_PATH = os.getenv('PHOTO_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'photo_store'))
+PHOTO_WORKERS = int(os.getenv('PHOTO_WORKERS', '2'))
+
+# Longest edge in pixels for each generated variant; "full" is the original upload
+PHOTO_SIZES = {'thumb': 96, 'medium': 320}
+
+DATA_URL_PATTERN = re.compile(r'^data:(?P<type>[\w/+.-]+)?(;[\w=-]+)*;base64,(?P<data>.+)$', re.DOTALL)
+
+photo_executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix='photos')
+
+
+class GridFSPhotoStore:
+    """Photo variants stored as GridFS files with filename <studentId>:<size>"""
+
+    def __init__(self):
+        self._fs = None
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            self._fs = gridfs.GridFS(db.get_db(), collection='photos')
+        return self._fs
+
+    def _latest(self, name: str):
+        # Only the file document is read here, never its chunks
+        return self.fs.find_one({"filename": name}, sort=[("uploadDate", -1), ("_id", -1)])
+
+    def put(self, name: str, data: bytes, content_type: str, version: str):
+        # The new file gets its own _id and is complete before older ones are dropped, so
+        # readers never miss a photo and concurrent uploads cannot collide on an _id
+        file_id = self.fs.put(data, filename=name, contentType=content_type, version=version)
+        uploaded = self.fs.find_one({"_id": file_id}).upload_date
+        for old in self.fs.find({"filename": name, "uploadDate": {"$lt": uploaded}}):
+            self.fs.delete(old._id)
+
+    def stat(self, name: str) -> Optional[Tuple[Any, str, str]]:
+        grid_out = self._latest(name)
+        if grid_out is None:
+            return None
+        return grid_out._id, getattr(grid_out, 'contentType', None) or 'image/jpeg', getattr(grid_out, 'version', '')
+
+    def read(self, ref) -> Optional[bytes]:
+        try:
+            return self.fs.get(ref).read()
+        except gridfs.errors.NoFile:
+            # Replaced by a newer upload since stat()
+            return None
+
+    def delete(self, name: str):
+        for grid_out in self.fs.find({"filename": name}):
+            self.fs.delete(grid_out._id)
+
+
+class FilesystemPhotoStore:
+    """Photo variants stored as files under PHOTO_STORE_PATH"""
+
+    def __init__(self, root: str = PHOTO_STORE_PATH):
+        self.root = root
+
+    def _paths(self, name: str) -> Tuple[str, str]:
+        safe = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, f"{safe}.bin"), os.path.join(self.root, f"{safe}.json")
+
+    def put(self, name: str, data: bytes, content_type: str, version: str):
+        os.makedirs(self.root, exist_ok=True)
+        data_path, meta_path = self._paths(name)
+        # Write to temp files and rename so readers never see a partial photo
+        with open(data_path + '.tmp', 'wb') as f:
+            f.write(data)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({"contentType": content_type, "version": version}, f)
+        os.replace(data_path + '.tmp', data_path)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def stat(self, name: str) -> Optional[Tuple[Any, str, str]]:
+        _, meta_path = self._paths(name)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        return name, meta.get('contentType', 'image/jpeg'), meta.get('version', '')
+
+    def read(self, ref) -> Optional[bytes]:
+        data_path, _ = self._paths(ref)
+        try:
+            with open(data_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, name: str):
+        for path in self._paths(name):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+photo_store = FilesystemPhotoStore() if PHOTO_STORE == 'filesystem' else GridFSPhotoStore()
+
+
+def is_data_url(value) -> bool:
+    """Return True for base64 data URLs as produced by the StudentManager upload"""
+    return isinstance(value, str) and value.startswith('data:')
+
+
+def parse_data_url(data_url: str) -> Tuple[bytes, str]:
+    """Decode a base64 data URL into bytes and a content type"""
+    match = DATA_URL_PATTERN.match(data_url)
+    if not match:
+        raise ValueError('Photo must be a base64 data URL')
+    data = base64.b64decode(match.group('data'), validate=True)
+    if not data:
+        raise ValueError('Photo is empty')
+    return data, match.group('type') or 'image/jpeg'
+
+
+def photo_url(student_id: str, version: str) -> str:
+    """Versioned URL for a student's photo; the version makes it safe to cache forever"""
+    return f"/api/students/{student_id}/photo?v={version}"
+
+
+def _variant_name(student_id: str, size: str) -> str:
+    return f"{student_id}:{size}"
+
+
+def _resize(data: bytes, max_edge: int) -> Tuple[bytes, str]:
+    """Downscale an image to fit max_edge, re-encoded as JPEG"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((max_edge, max_edge))
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=85, optimize=True)
+        return out.getvalue(), 'image/jpeg'
+
+
+def generate_variants(student_id: str, data: bytes, version: str):
+    """Create the resized variants for one upload (runs on the photo pool)"""
+    if Image is None:
+        return
+    for size, max_edge in PHOTO_SIZES.items():
+        try:
+            resized, content_type = _resize(data, max_edge)
+            photo_store.put(_variant_name(student_id, size), resized, content_type, version)
+        except Exception as e:
+            print(f"[Photos] Could not create {size} variant for {student_id}: {e}")
+
+
+def save_student_photo(student_id: str, data_url: str, wait: bool = False) -> Dict:
+    """Store an uploaded photo and queue its variants; returns the fields to set on the student"""
+    data, content_type = parse_data_url(data_url)
+    version = hashlib.sha1(data).hexdigest()[:16]
+    photo_store.put(_variant_name(student_id, 'full'), data, content_type, version)
+    future = photo_executor.submit(generate_variants, student_id, data, version)
+    if wait:
+        future.result()
+    return {"photoVersion": version, "photoUrl": photo_url(student_id, version)}
+
+
+def delete_student_photo(student_id: str):
+    """Remove every stored variant of a student's photo"""
+    for size in ('full', *PHOTO_SIZES):
+        photo_store.delete(_variant_name(student_id, size))
+
+
+def find_student_photo(student_id: str, size: str = 'full') -> Optional[Tuple[Any, str, str]]:
+    """Return (store ref, content type, version) for a variant, falling back to the original.
+
+    Only metadata is read, so callers can answer conditional requests without the bytes.
+    """
+    full = photo_store.stat(_variant_name(student_id, 'full'))
+    if size != 'full' and full is not None:
+        variant = photo_store.stat(_variant_name(student_id, size))
+        # A variant from an older upload may still be around while the new one is generated
+        if variant is not None and variant[2] == full[2]:
+            return variant
+    return full
+
+
+def read_student_photo(student_id: str, size: str, found: Tuple[Any, str, str]) -> Optional[Tuple[bytes, str, str]]:
+    """Return (bytes, content type, version) for a photo located by find_student_photo"""
+    data = photo_store.read(found[0])
+    if data is None:
+        # A new upload replaced the file in between; serve that one instead
+        found = find_student_photo(student_id, size)
+        data = photo_store.read(found[0]) if found else None
+    return (data, found[1], found[2]) if data is not None else None
+
+
+def apply_photo_update(student_id: str, payload: Dict) -> Dict:
+    """Move an inline photo out of a create/update payload into the photo store"""
+    if 'photo' not in payload:
+        return payload
+    payload = dict(payload)
+    photo = payload.pop('photo')
+    if is_data_url(photo):
+        payload.update(save_student_photo(student_id, photo))
+    elif not photo:
+        delete_student_photo(student_id)
+        payload.update({"photoVersion": None, "photoUrl": None})
+    # Anything else is the photo URL echoed back by the client; nothing to change
+    return payload
+
+
+def migrate_inline_photos(batch_size: int = 100) -> int:
+    """Move inline data-URL photos from student documents into the photo store"""
+    database = db.get_db()
+    moved = 0
+    cursor = database.students.find(
+        {"photo": {"$regex": "^data:"}},
+        {"_id": 1, "id": 1, "photo": 1}
+    ).batch_size(batch_size)
+    for student in cursor:
+        student_id = student.get('id') or str(student['_id'])
+        try:
+            fields = save_student_photo(student_id, student['photo'], wait=True)
+        except Exception as e:
+            print(f"[Photos] Skipping {student_id}: {e}")
+            continue
+        database.students.update_one(
+            {"_id": student['_id']},
+            {"$set": {**fields, "id": student_id, "updatedAt": datetime.utcnow()}, "$unset": {"photo": ""}}
+        )
+        moved += 1
+    if moved:
+        db.bump_version('students')
+    return moved
@@ -0,0 +1,134 @@
+"""
+Content negotiation for API responses.
+
+Compresses responses with brotli or gzip according to Accept-Encoding, and
+encodes them as MessagePack for clients that ask for it in Accept.
+"""
+import gzip
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import Response, request
+
+import json_provider
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it every client gets JSON
+    msgpack = None
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL_GZIP = int(os.getenv('COMPRESS_LEVEL_GZIP', '6'))
+COMPRESS_LEVEL_BROTLI = int(os.getenv('COMPRESS_LEVEL_BROTLI', '5'))
+
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html') + MSGPACK_TYPES
+
+# Progressive streams would stall behind the compressor's buffer
+UNCOMPRESSED_STREAM_TYPES = ('text/event-stream', 'application/x-ndjson')
+
+
+def wants_msgpack() -> bool:
+    """True when the client prefers MessagePack over JSON (opt-in through Accept)"""
+    if msgpack is None:
+        return False
+    accept = request.accept_mimetypes
+    best = accept.best_match(MSGPACK_TYPES + ('application/json',))
+    return best in MSGPACK_TYPES and accept[best] > accept['application/json']
+
+
+def response_mimetype() -> str:
+    """Mimetype of data responses for the current request"""
+    return MSGPACK_TYPES[0] if wants_msgpack() else 'application/json'
+
+
+def dumps_bytes(value) -> bytes:
+    """Encode a value in the negotiated format"""
+    if wants_msgpack():
+        return msgpack.packb(value, default=json_provider.encode_default, use_bin_type=True)
+    return json_provider.dumps_bytes(value)
+
+
+def iter_array(items: Iterable) -> Iterator[bytes]:
+    """Encode an iterable as an array in the negotiated format.
+
+    JSON is streamed item by item. A MessagePack array needs its length up
+    front, so it is packed once the items have been read.
+    """
+    if wants_msgpack():
+        yield dumps_bytes(list(items))
+    else:
+        yield from json_provider.iter_json_array(items)
+
+
+def choose_encoding() -> Optional[str]:
+    """Pick the best supported Content-Encoding the client accepts"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body chunk by chunk"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_LEVEL_BROTLI)
+        for chunk in chunks:
+            out = compressor.process(chunk)
+            if out:
+                yield out
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL_GZIP, zlib.DEFLATED, 31)  # 31 = gzip container
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+
+
+def compress_response(response: Response) -> Response:
+    """after_request hook: compress eligible responses and mark them Vary"""
+    vary = {v.strip() for v in response.headers.get('Vary', '').split(',') if v.strip()}
+    response.headers['Vary'] = ', '.join(sorted(vary | {'Accept', 'Accept-Encoding'}))
+
+    if response.status_code < 200 or response.status_code in (204, 304) or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES or request.method == 'HEAD':
+        return response
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        if response.mimetype in UNCOMPRESSED_STREAM_TYPES:
+            return response
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        if encoding == 'br':
+            data = brotli.compress(data, quality=COMPRESS_LEVEL_BROTLI)
+        else:
+            data = gzip.compress(data, compresslevel=COMPRESS_LEVEL_GZIP)
+        response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class NegotiatingJSONProvider(json_provider.FastJSONProvider):
+    """JSON provider whose responses switch to MessagePack when the client asks for it"""
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=response_mimetype())
@@ -12,7 +12,7 @@ import TeacherDashboard from './components/TeacherDashboard';
 import ErrorBoundary from './components/ErrorBoundary';
 import { Users, BookOpen, ClipboardCheck, BarChart2, LogOut, Sun, Moon, UserCircle, Menu, X } from 'lucide-react';
 import Chatbot from './components/Chatbot';
-import * as api from './services/apiService';
+import { syncAll } from './services/syncService';
 import { motion } from 'framer-motion';
 import { discoverApiUrl, getApiUrl } from './utils/config';
 
@@ -49,11 +49,8 @@ const App: React.FC = () => {
       
       // Now load data
       setConnectionStatus('✓ Connected! Loading data...');
-      const [studentsData, coursesData, attendanceData] = await Promise.all([
-        api.fetchStudents(),
-        api.fetchCourses(),
-        api.fetchAttendance()
-      ]);
+      // Only what changed since the last launch is downloaded
+      const { students: studentsData, courses: coursesData, attendance: attendanceData } = await syncAll();
       setStudents(studentsData);
       setCourses(coursesData);
       setAttendance(attendanceData);
@@ -195,51 +195,40 @@ const AttendanceTaker: React.FC<AttendanceTakerProps> = ({ courses, students, at
         status: presentStudentIds.has(student.id) ? 'present' : 'absent'
     }));
 
+    const savedRecord: AttendanceRecord = {
+        ...existingRecord,
+        courseId: selectedCourseId,
+        date,
+        presentStudentIds: Array.from(presentStudentIds),
+        timestamp: newTimestamp,
+    };
+
     try {
+        // Optimistic update
         if (existingRecordIndex > -1) {
-            const updatedRecord = {
-                ...existingRecord,
-                presentStudentIds: Array.from(presentStudentIds),
-                attendanceData, // Add backend-compatible format
-                timestamp: newTimestamp,
-            };
-            
-            // Optimistic update
-            const updatedAttendance = [...attendance];
-            updatedAttendance[existingRecordIndex] = updatedRecord;
-            setAttendance(updatedAttendance);
-            
-            // API call
-            if (existingRecord.id) {
-                await api.updateAttendance(existingRecord.id, updatedRecord);
-            } else {
-                // If no ID, it might be a legacy record or unsaved one. Try creating.
-                const created = await api.createAttendance(updatedRecord);
-                if (created && (created.id || created._id)) {
-                     const realId = created.id || created._id;
-                     setAttendance(prev => prev.map((r, idx) => idx === existingRecordIndex ? { ...r, id: realId } : r));
-                }
-            }
+            setAttendance(prev => prev.map((r, idx) => idx === existingRecordIndex ? savedRecord : r));
+        } else {
+            setAttendance(prev => [...prev, savedRecord]);
+        }
 
+        let saved: any;
+        if (existingRecord?.id) {
+            // Only send who changed, so concurrent edits to other students are kept; the save time is always stored
+            const previous = new Set(existingRecord.presentStudentIds);
+            const add = savedRecord.presentStudentIds.filter(id => !previous.has(id));
+            const remove = existingRecord.presentStudentIds.filter(id => !presentStudentIds.has(id));
+            saved = await api.patchAttendanceSession(selectedCourseId, date, add, remove, newTimestamp);
         } else {
-            const newRecord: AttendanceRecord = {
-                courseId: selectedCourseId,
-                date,
-                presentStudentIds: Array.from(presentStudentIds),
+            // One idempotent upsert keyed by course and date; the server owns the record id
+            saved = await api.saveAttendanceSession(selectedCourseId, date, {
+                presentStudentIds: savedRecord.presentStudentIds,
+                attendanceData, // Add backend-compatible format
                 timestamp: newTimestamp,
-            };
-            
-            // Optimistic update
-            setAttendance([...attendance, newRecord]);
-            
-            // API call
-            const created = await api.createAttendance(newRecord);
-            
-            // Update with real ID
-            if (created && (created.id || created._id)) {
-                const realId = created.id || created._id;
-                setAttendance(prev => prev.map(r => r.courseId === newRecord.courseId && r.date === newRecord.date ? { ...r, id: realId } : r));
-            }
+            });
+        }
+        if (saved && (saved.id || saved._id)) {
+            const realId = saved.id || saved._id;
+            setAttendance(prev => prev.map(r => r.courseId === selectedCourseId && r.date === date ? { ...r, id: realId } : r));
         }
         setIsSaved(true);
         setRecordExists(true);
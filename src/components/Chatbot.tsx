@@ -69,21 +69,58 @@ const Chatbot: React.FC = () => {
 
       const response = await fetch(`${API_BASE_URL}/chat`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ prompt: fullPrompt }),
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body: JSON.stringify({ prompt: fullPrompt, stream: true }),
         signal: controller.signal,
       });
 
-      clearTimeout(timeoutId);
-
       if (!response.ok) {
+        clearTimeout(timeoutId);
         throw new Error('Failed to get response from chatbot');
       }
 
-      const data = await response.json();
-      const modelResponse = data.response || 'Sorry, I could not generate a response.';
+      let modelResponse = '';
+      const isStream = (response.headers.get('Content-Type') || '').includes('text/event-stream');
+
+      if (isStream && response.body) {
+        // Render partial text as Server-Sent Events arrive
+        setMessages(prev => [...prev, { role: 'model', text: '' }]);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop() || '';
+          for (const rawEvent of events) {
+            const eventName = rawEvent.match(/^event: (.*)$/m)?.[1];
+            const dataLine = rawEvent.match(/^data: (.*)$/m)?.[1];
+            if (!dataLine) continue;
+            const payload = JSON.parse(dataLine);
+            if (eventName === 'error') throw new Error(payload.error || 'Streaming failed');
+            if (eventName === 'done') {
+              modelResponse = payload.response || modelResponse;
+            } else if (payload.text) {
+              modelResponse += payload.text;
+            }
+            const partial = modelResponse;
+            setMessages(prev => [...prev.slice(0, -1), { role: 'model', text: partial }]);
+          }
+        }
+        clearTimeout(timeoutId);
+        if (!modelResponse) {
+          modelResponse = 'Sorry, I could not generate a response.';
+          setMessages(prev => [...prev.slice(0, -1), { role: 'model', text: modelResponse }]);
+        }
+      } else {
+        clearTimeout(timeoutId);
+        const data = await response.json();
+        modelResponse = data.response || 'Sorry, I could not generate a response.';
+        setMessages(prev => [...prev, { role: 'model', text: modelResponse }]);
+      }
 
-      setMessages(prev => [...prev, { role: 'model', text: modelResponse }]);
       setConversationHistory(prev => [...prev, `User: ${currentInput}`, `Assistant: ${modelResponse}`]);
     } catch (error: any) {
       console.error("Chatbot error:", error);
@@ -92,7 +129,12 @@ const Chatbot: React.FC = () => {
         errorText = 'Request timeout - the AI is taking too long to respond. Please try a shorter question.';
       }
       const errorMessage = { role: 'model' as const, text: errorText };
-      setMessages(prev => [...prev, errorMessage]);
+      // Drop the empty streaming placeholder, if any, before showing the error
+      setMessages(prev => {
+        const last = prev[prev.length - 1];
+        const kept = last && last.role === 'model' && !last.text ? prev.slice(0, -1) : prev;
+        return [...kept, errorMessage];
+      });
     } finally {
       setIsLoading(false);
     }
@@ -3,6 +3,7 @@ import { User, Student, Teacher } from '../types';
 import { Eye, EyeOff, User as UserIcon, GraduationCap, Settings } from 'lucide-react';
 import { motion } from 'framer-motion';
 import { getApiUrl, setApiUrl, resetApiUrl } from '../utils/config';
+import { loginStudent } from '../services/apiService';
 
 interface LoginProps {
   onLogin: (user: User) => void;
@@ -17,7 +18,7 @@ const Login: React.FC<LoginProps> = ({ onLogin, students, teachers }) => {
   const [isPasswordVisible, setIsPasswordVisible] = useState(false);
   const [error, setError] = useState('');
 
-  const handleLogin = (e: React.FormEvent) => {
+  const handleLogin = async (e: React.FormEvent) => {
     e.preventDefault();
     setError('');
 
@@ -31,12 +32,11 @@ const Login: React.FC<LoginProps> = ({ onLogin, students, teachers }) => {
         setError('Invalid teacher email or password.');
       }
     } else {
-      const student = students.find(
-        s => s.email.toLowerCase() === email.toLowerCase() && s.password === password
-      );
-      if (student) {
+      // Student credentials are checked by the backend; the student list never carries passwords
+      try {
+        const student = await loginStudent(email, password);
         onLogin({ type: 'student', email: student.email });
-      } else {
+      } catch {
         setError('Invalid student email or password.');
       }
     }
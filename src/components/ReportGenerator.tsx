@@ -159,7 +159,7 @@ const ReportGenerator: React.FC<ReportGeneratorProps> = ({ courses, students, at
     setReportData(null);
 
     try {
-      const data = await generateAttendanceSummary(selectedCourse, students, attendanceRecords);
+      const data = await generateAttendanceSummary(selectedCourse);
       setReportData(data);
     } catch (e: any) {
       setError(e.message || "An unknown error occurred while generating the report.");
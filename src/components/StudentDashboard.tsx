@@ -283,7 +283,7 @@ const StudentDashboard: React.FC<StudentDashboardProps> = ({ student, courses, a
     setAiSummary(null);
     setSummaryError(null);
     try {
-      const summary = await generateStudentSummary(student, studentCourses, attendanceRecords);
+      const summary = await generateStudentSummary(student);
       setAiSummary(summary);
     } catch (error) {
       console.error("Failed to generate AI summary:", error);
@@ -299,7 +299,7 @@ const StudentDashboard: React.FC<StudentDashboardProps> = ({ student, courses, a
     setAiModalTitle('Your AI-Powered Goal');
     try {
       const { percentage } = getCourseAttendance(course.id);
-      const goal = await generateAttendanceGoal(student.name, course.name, percentage);
+      const goal = await generateAttendanceGoal(student, course, percentage);
       setAiModalContent(goal);
     } catch (e) {
       setAiModalContent("Sorry, I couldn't generate a goal right now. Please try again later.");
@@ -313,19 +313,10 @@ const StudentDashboard: React.FC<StudentDashboardProps> = ({ student, courses, a
     setIsAiLoading(true);
     setAiModalTitle('AI Performance Predictor');
     try {
-      const courseRecords = attendanceRecords
-        .filter(r => r.courseId === course.id)
-        .sort((a, b) => new Date(a.date).getTime() - new Date(b.date).getTime());
-
-      const recentRecords = courseRecords.slice(-15).map(r => ({
-        date: r.date,
-        isPresent: r.presentStudentIds.includes(student.id)
-      }));
-
-      if (recentRecords.length < 5) {
+      const prediction = await predictAttendancePerformance(student, course);
+      if (prediction === null) {
         setAiModalContent("There isn't enough attendance data for this course to make a reliable prediction yet. Keep up the great work!");
       } else {
-        const prediction = await predictAttendancePerformance(student.name, course.name, recentRecords);
         setAiModalContent(prediction);
       }
     } catch (e) {
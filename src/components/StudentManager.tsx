@@ -270,7 +270,7 @@ const StudentManager: React.FC<StudentManagerProps> = ({ students: allStudents,
     setName(student.name);
     setStudentId(student.studentId);
     setEmail(student.email);
-    setPassword(student.password);
+    setPassword('');
     setPhoto(student.photo);
     setBranch(student.branch);
     setIsModalOpen(true);
@@ -352,7 +352,8 @@ const StudentManager: React.FC<StudentManagerProps> = ({ students: allStudents,
 
     try {
       if (currentStudent) {
-        const updatedStudent = { ...currentStudent, name, studentId, email, password, photo, branch };
+        // Leave the stored password untouched unless a new one was typed
+        const updatedStudent = { ...currentStudent, name, studentId, email, photo, branch, ...(password ? { password } : {}) };
         // Optimistic update
         setStudents(allStudents.map(s => s.id === currentStudent.id ? updatedStudent : s));
         
@@ -482,6 +483,7 @@ const StudentManager: React.FC<StudentManagerProps> = ({ students: allStudents,
 
 
       const newStudents: Student[] = [];
+      const lineNumbers = new Map<string, number>();
       const importErrors: ImportResult['errors'] = [];
       const existingStudentIds = new Set(allStudents.map(s => s.studentId.toLowerCase()));
       const batchStudentIds = new Set<string>(); // Bug fix: Track IDs within the CSV file
@@ -517,36 +519,38 @@ const StudentManager: React.FC<StudentManagerProps> = ({ students: allStudents,
           branch,
         };
         newStudents.push(newStudent);
+        lineNumbers.set(newStudent.id, lineNumber);
         batchStudentIds.add(studentId.toLowerCase()); // Bug fix: Add to batch set
       });
 
+      let successCount = newStudents.length;
       if (newStudents.length > 0) {
         // Optimistic update
         setStudents(prev => [...prev, ...newStudents]);
         
-        // API calls
+        // One request for the whole file; the server validates against the unique studentId index
         try {
-            // Process in chunks of 5 to avoid overwhelming the server
-            const chunkSize = 5;
-            for (let i = 0; i < newStudents.length; i += chunkSize) {
-                const chunk = newStudents.slice(i, i + chunkSize);
-                await Promise.all(chunk.map(async (student) => {
-                    try {
-                        const created = await api.createStudent(student);
-                        // Update with real ID
-                        setStudents(prev => prev.map(s => s.studentId === student.studentId ? { ...s, id: created._id || created.id } : s));
-                    } catch (err) {
-                        console.error(`Failed to sync imported student ${student.name}`, err);
-                    }
-                }));
-            }
+            const result = await api.bulkCreateStudents(
+              newStudents.map(student => ({ ...student, lineNumber: lineNumbers.get(student.id) }))
+            );
+            const createdByLine = new Map(result.created.map(c => [c.lineNumber, c.id] as [number, string]));
+            const failedLines = new Set(result.errors.map(err => err.lineNumber));
+            setStudents(prev => prev
+              .filter(s => !failedLines.has(lineNumbers.get(s.id) ?? -1))
+              .map(s => {
+                const realId = createdByLine.get(lineNumbers.get(s.id) ?? -1);
+                return realId ? { ...s, id: realId } : s;
+              }));
+            importErrors.push(...result.errors);
+            importErrors.sort((a, b) => a.lineNumber - b.lineNumber);
+            successCount = result.successCount;
         } catch (err) {
             console.error("Error during bulk import sync:", err);
         }
       }
       
       setImportResult({
-        successCount: newStudents.length,
+        successCount,
         errors: importErrors
       });
       setIsImportSummaryModalOpen(true);
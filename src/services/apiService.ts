@@ -41,8 +41,26 @@ async function apiCall<T>(endpoint: string, options?: RequestInit): Promise<T> {
 
 // ============= STUDENT API =============
 
+// Passwords are never listed. Photos are served by URL; `photo` only covers documents not yet migrated
+const STUDENT_LIST_FIELDS = 'name,studentId,email,branch,photoUrl,photo';
+
+// Point `photo` at the cacheable photo endpoint so components can keep using it as an <img> src
+export function withPhotoUrl(student: any) {
+  if (!student.photoUrl) return student;
+  const path = student.photoUrl.replace(/^\/api/, '');
+  return { ...student, photo: `${getApiUrl()}${path}&size=medium` };
+}
+
 export async function fetchStudents() {
-  return apiCall<any[]>('/students');
+  const students = await apiCall<any[]>(`/students?fields=${STUDENT_LIST_FIELDS}`);
+  return students.map(withPhotoUrl);
+}
+
+export async function loginStudent(email: string, password: string) {
+  return apiCall<any>('/auth/student', {
+    method: 'POST',
+    body: JSON.stringify({ email, password }),
+  });
 }
 
 export async function createStudent(student: any) {
@@ -52,6 +70,19 @@ export async function createStudent(student: any) {
   });
 }
 
+export interface BulkImportResult {
+  successCount: number;
+  created: { lineNumber: number; id: string; _id: string; studentId: string }[];
+  errors: { lineNumber: number; name: string; studentId?: string; reason: string }[];
+}
+
+export async function bulkCreateStudents(students: any[]) {
+  return apiCall<BulkImportResult>('/students/bulk', {
+    method: 'POST',
+    body: JSON.stringify({ students }),
+  });
+}
+
 export async function updateStudent(studentId: string, updateData: any) {
   return apiCall<any>(`/students/${studentId}`, {
     method: 'PUT',
@@ -93,9 +124,28 @@ export async function deleteCourse(courseId: string) {
 
 // ============= ATTENDANCE API =============
 
+// Compact attendance: present students are sent as positions in each course's roster
+interface CompactAttendance {
+  rosters: Record<string, string[]>;
+  records: any[];
+}
+
+function expandCompactAttendance({ rosters, records }: CompactAttendance) {
+  return records.map(({ presentIndexes, presentExtraIds, ...record }) => {
+    if (!presentIndexes) return record;
+    const roster = rosters[record.courseId] || [];
+    return {
+      ...record,
+      presentStudentIds: [...presentIndexes.map((i: number) => roster[i]), ...(presentExtraIds || [])],
+    };
+  });
+}
+
 export async function fetchAttendance(courseId?: string) {
-  const query = courseId ? `?courseId=${courseId}` : '';
-  return apiCall<any[]>(`/attendance${query}`);
+  const params = new URLSearchParams({ encoding: 'compact' });
+  if (courseId) params.set('courseId', courseId);
+  const data = await apiCall<CompactAttendance>(`/attendance?${params.toString()}`);
+  return expandCompactAttendance(data);
 }
 
 export async function createAttendance(record: any) {
@@ -112,12 +162,144 @@ export async function updateAttendance(recordId: string, updateData: any) {
   });
 }
 
+// Idempotent create-or-update of the single record for a course and date
+export async function saveAttendanceSession(courseId: string, date: string, record: any) {
+  return apiCall<any>(`/courses/${encodeURIComponent(courseId)}/attendance/${encodeURIComponent(date)}`, {
+    method: 'PUT',
+    body: JSON.stringify(record),
+  });
+}
+
+// Mark/unmark individual students on a session without resending the whole roster
+export async function patchAttendanceSession(courseId: string, date: string, add: string[], remove: string[], timestamp?: number) {
+  return apiCall<{ id: string; courseId: string; date: string; presentCount: number; created: boolean }>(
+    `/courses/${encodeURIComponent(courseId)}/attendance/${encodeURIComponent(date)}`, {
+    method: 'PATCH',
+    body: JSON.stringify({ add, remove, timestamp }),
+  });
+}
+
 export async function deleteAttendance(recordId: string) {
   return apiCall<{ message: string }>(`/attendance/${recordId}`, {
     method: 'DELETE',
   });
 }
 
+export interface CourseAttendanceStats {
+  courseId: string;
+  name: string;
+  code: string;
+  sessions: number;
+  present: number;
+  percentage: number;
+  lastSeen: string | null;
+  streak: number | null;
+}
+
+export interface StudentAttendanceStats {
+  studentId: string;
+  totalClasses: number;
+  presentClasses: number;
+  overallPercentage: number;
+  courses: CourseAttendanceStats[];
+}
+
+// Server-maintained counters; avoids downloading every record to compute percentages
+export async function fetchStudentAttendanceStats(studentId: string) {
+  return apiCall<StudentAttendanceStats>(`/students/${studentId}/attendance-stats`);
+}
+
+export interface StudentSessionRow {
+  id: string;
+  courseId: string;
+  date: string; // YYYY-MM-DD
+  present: boolean;
+}
+
+// Sessions of the student's courses, oldest first; limit keeps only the most recent ones
+export async function fetchStudentAttendance(
+  studentId: string,
+  options: { from?: string; to?: string; courseId?: string; limit?: number } = {}
+) {
+  const params = new URLSearchParams();
+  Object.entries(options).forEach(([key, value]) => {
+    if (value !== undefined && value !== '') params.set(key, String(value));
+  });
+  const query = params.toString();
+  return apiCall<{ studentId: string; total: number; present: number; sessions: StudentSessionRow[] }>(
+    `/students/${studentId}/attendance${query ? `?${query}` : ''}`
+  );
+}
+
+export interface CourseInsight {
+  courseId: string;
+  name: string;
+  percentage: number;
+  goal: string | null;
+  prediction: string | null;
+}
+
+export interface StudentInsights {
+  studentId: string;
+  available: boolean;
+  stale?: boolean; // attendance changed since the insights were generated
+  summary?: string;
+  courses?: CourseInsight[];
+  generatedAt?: string;
+}
+
+// AI summary, goals and predictions pregenerated in the background; no Gemini call on read
+export async function fetchStudentInsights(studentId: string) {
+  return apiCall<StudentInsights>(`/students/${studentId}/insights`);
+}
+
+// ============= SYNC API =============
+
+export interface SyncChanges<T> {
+  upserted: T[];
+  deleted: string[];
+}
+
+export interface SyncResponse {
+  full: boolean;
+  cursor: string;
+  students: SyncChanges<any>;
+  courses: SyncChanges<any>;
+  attendance: SyncChanges<any>;
+}
+
+// Everything when cursor is null, otherwise only what changed since that cursor
+export async function syncData(cursor: string | null) {
+  const params = new URLSearchParams({ studentsFields: STUDENT_LIST_FIELDS });
+  if (cursor) params.set('since', cursor);
+  return apiCall<SyncResponse>(`/sync?${params.toString()}`);
+}
+
+export interface PushOperation {
+  key: string; // Idempotency key generated on the device, e.g. crypto.randomUUID()
+  type: 'createStudent' | 'updateStudent' | 'deleteStudent' | 'createCourse' | 'updateCourse' | 'deleteCourse'
+    | 'saveAttendance' | 'patchAttendance' | 'deleteAttendance';
+  [field: string]: any;
+}
+
+export interface PushResult {
+  index: number;
+  key?: string;
+  status: 'applied' | 'failed' | 'inProgress';
+  replayed?: boolean;
+  result?: any;
+  code?: number;
+  error?: string;
+}
+
+// Flush an offline write queue; retrying with the same keys never applies an operation twice
+export async function pushOperations(operations: PushOperation[]) {
+  return apiCall<{ applied: number; failed: number; results: PushResult[] }>('/sync/push', {
+    method: 'POST',
+    body: JSON.stringify({ operations }),
+  });
+}
+
 // ============= HEALTH CHECK =============
 
 export async function checkHealth() {
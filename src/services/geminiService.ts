@@ -1,6 +1,7 @@
-import { Course, Student, AttendanceRecord, AttendanceReportData } from '../types';
+import { Course, Student, AttendanceReportData } from '../types';
 
 import { getApiUrl } from '../utils/config';
+import { fetchStudentInsights } from './apiService';
 
 // Backend API URL - uses environment variable or falls back to localhost
 const API_BASE_URL = getApiUrl();
@@ -52,16 +53,41 @@ async function callBackend(endpoint: string, data: any) {
   }
 }
 
+// Longest the client waits for a queued report before giving up
+const JOB_DEADLINE_MS = 180000;
+
+// Queue a report as a background job, then poll until it finishes. Polls return at once and are
+// spaced by the server's Retry-After, so waiting for Gemini never holds a backend request thread.
+async function runReportJob(endpoint: string, data: any) {
+  const queued = await callBackend(endpoint, { ...data, async: true });
+  const deadline = Date.now() + JOB_DEADLINE_MS;
+
+  while (Date.now() < deadline) {
+    const res = await fetch(`${API_BASE_URL}/jobs/${queued.jobId}`, { credentials: 'omit' });
+    if (!res.ok) {
+      const error = await res.json().catch(() => ({}));
+      throw new Error(error.error || `Job lookup failed: ${res.status}`);
+    }
+    const job = await res.json();
+    if (job.status === 'done') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Report generation failed.');
+    }
+    const retryAfter = Number(res.headers.get('Retry-After')) || 1;
+    await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+  }
+  throw new Error('Request timeout - AI is taking too long to respond. Please try again.');
+}
+
 export const generateAttendanceSummary = async (
-  course: Course,
-  allStudents: Student[],
-  records: AttendanceRecord[]
+  course: Course
 ): Promise<AttendanceReportData> => {
   try {
-    const result = await callBackend('/attendance/summary', {
-      course,
-      students: allStudents,
-      records,
+    // Students and records are loaded on the server, so only the course id is sent
+    const result = await runReportJob('/attendance/summary', {
+      courseId: course.id,
     });
     return result;
   } catch (error: any) {
@@ -71,15 +97,18 @@ export const generateAttendanceSummary = async (
 };
 
 export const generateStudentSummary = async (
-  student: Student,
-  courses: Course[],
-  records: AttendanceRecord[]
+  student: Student
 ): Promise<string> => {
   try {
-    const result = await callBackend('/student/summary', {
-      student,
-      courses,
-      records,
+    // Served from the pregenerated copy while the student's attendance is unchanged
+    const insights = await fetchStudentInsights(student.id).catch(() => null);
+    if (insights?.available && !insights.stale && insights.summary) {
+      return insights.summary;
+    }
+    // Attendance is aggregated on the server, so only the student's id is sent
+    const result = await runReportJob('/student/summary', {
+      studentId: student.id,
+      studentName: student.name,
     });
     return result.summary;
   } catch (error: any) {
@@ -89,14 +118,17 @@ export const generateStudentSummary = async (
 };
 
 export const generateAttendanceGoal = async (
-  studentName: string,
-  courseName: string,
+  student: Student,
+  course: Course,
   currentPercentage: number
 ): Promise<string> => {
   try {
+    // The ids let the server answer with a pregenerated goal instead of calling Gemini
     const result = await callBackend('/student/goal', {
-      studentName,
-      courseName,
+      studentId: student.id,
+      courseId: course.id,
+      studentName: student.name,
+      courseName: course.name,
       currentPercentage,
     });
     return result.goal;
@@ -106,16 +138,18 @@ export const generateAttendanceGoal = async (
   }
 };
 
+// Resolves to null when the course has too few sessions to predict from
 export const predictAttendancePerformance = async (
-  studentName: string,
-  courseName: string,
-  recentRecords: { date: string, isPresent: boolean }[]
-): Promise<string> => {
+  student: Student,
+  course: Course
+): Promise<string | null> => {
   try {
+    // Recent sessions are read on the server, so only the ids are sent
     const result = await callBackend('/student/prediction', {
-      studentName,
-      courseName,
-      recentRecords,
+      studentId: student.id,
+      courseId: course.id,
+      studentName: student.name,
+      courseName: course.name,
     });
     return result.prediction;
   } catch (error: any) {
@@ -0,0 +1,68 @@
+/**
+ * Delta sync with a local snapshot
+ * The first launch downloads everything; later launches only fetch what changed.
+ */
+
+import { Student, Course, AttendanceRecord } from '../types';
+import * as api from './apiService';
+import { getApiUrl } from '../utils/config';
+
+interface Snapshot {
+  cursor: string | null;
+  students: Student[];
+  courses: Course[];
+  attendance: AttendanceRecord[];
+}
+
+const EMPTY_SNAPSHOT: Snapshot = { cursor: null, students: [], courses: [], attendance: [] };
+
+// One snapshot per backend, so switching servers never mixes data
+function snapshotKey() {
+  return `syncSnapshot:${getApiUrl()}`;
+}
+
+function loadSnapshot(): Snapshot {
+  try {
+    const item = window.localStorage.getItem(snapshotKey());
+    return item ? JSON.parse(item) : EMPTY_SNAPSHOT;
+  } catch (error) {
+    console.error(error);
+    return EMPTY_SNAPSHOT;
+  }
+}
+
+function saveSnapshot(snapshot: Snapshot) {
+  try {
+    window.localStorage.setItem(snapshotKey(), JSON.stringify(snapshot));
+  } catch (error) {
+    // Quota exceeded: the next launch simply does a full sync again
+    console.error('Could not store sync snapshot:', error);
+  }
+}
+
+// Apply deletes first, then upserts, so a document deleted and re-created in the window survives
+function applyChanges<T extends { id?: string }>(current: T[], changes: api.SyncChanges<T>, full: boolean): T[] {
+  if (full) return changes.upserted;
+  const byId = new Map<string, T>();
+  current.forEach(item => byId.set(item.id as string, item));
+  changes.deleted.forEach(id => byId.delete(id));
+  changes.upserted.forEach(item => byId.set(item.id as string, item));
+  return Array.from(byId.values());
+}
+
+export async function syncAll(): Promise<Omit<Snapshot, 'cursor'>> {
+  const snapshot = loadSnapshot();
+  const changes = await api.syncData(snapshot.cursor);
+  const next: Snapshot = {
+    cursor: changes.cursor,
+    students: applyChanges(snapshot.students, changes.students, changes.full),
+    courses: applyChanges(snapshot.courses, changes.courses, changes.full),
+    attendance: applyChanges(snapshot.attendance, changes.attendance, changes.full),
+  };
+  saveSnapshot(next);
+  return {
+    students: next.students.map(api.withPhotoUrl),
+    courses: next.courses,
+    attendance: next.attendance,
+  };
+}
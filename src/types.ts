@@ -7,7 +7,7 @@ export interface Student {
   studentId: string;
   photo?: string;
   email: string;
-  password: string;
+  password?: string; // Only present on create/update; never returned by list endpoints
   branch: Branch;
 }
 